@@ -0,0 +1,249 @@
+"""
+分析集計: 全ユーザー横断の集計値をインクリメンタルに維持
+
+ProfileManager のリスナーとして登録し、書き込みのたびに差分を加算する。
+- ユーザー数、カテゴリー別のデータ保有ユーザー数
+- 人間形成ステージの分布
+- バッジ獲得数
+- カテゴリーの項目（CATEGORIES の fields）ごとの頻出値（Space-Saving による上位K件）
+  数えるのは事実ストアの現在の値を持つユーザー数（同じユーザーが何度話しても1、
+  値が変わったら以前の値から1を引く）。rebuild() も事実ストアから同じように数える
+
+差分はプロセス内にためておき、一定件数・一定時間ごとに data/analytics.json へ
+ロック付きで合算する（複数ワーカーでも集計が失われない）。参照時はファイルの
+内容とプロセス内の未反映分を合わせて返すため、ユーザー数に関わらず高速に応答できる。
+"""
+
+import atexit
+import os
+import threading
+import time
+from typing import Dict
+
+from config import (
+    DATA_DIR, CATEGORIES, ANALYTICS_TOPK_CAPACITY,
+    ANALYTICS_FLUSH_EVENTS, ANALYTICS_FLUSH_SECONDS
+)
+from storage import LockTable, JsonFileCache, atomic_write_json, read_json
+from text_utils import normalize_text
+
+OTHER_FIELD = "その他"
+
+
+def _empty_aggregates() -> Dict:
+    return {
+        "users": 0,
+        "coverage": {},
+        "stages": {},
+        "badges": {},
+        "values": {}
+    }
+
+
+def _add_count(counter: Dict, key: str, amount: int):
+    counter[key] = counter.get(key, 0) + amount
+
+
+def _field_and_value(category: str, key: str, value) -> tuple:
+    """集計に使う項目名と値（定義外の項目は「その他」にまとめる）"""
+    field = normalize_text(key)
+    if field not in CATEGORIES.get(category, {}).get("fields", []):
+        field = OTHER_FIELD
+    return field, normalize_text(value)[:50]
+
+
+def space_saving_add(summary: Dict[str, list], value: str, count: int, capacity: int):
+    """
+    Space-Saving アルゴリズムで頻出値の要約に加算
+    summary: {値: [推定回数, 誤差上限]}、要素数は capacity 以下に保たれる
+    count が負（値を持つユーザーが減った）の場合は、要約にある値だけ減らす
+    """
+    entry = summary.get(value)
+    if count < 0:
+        if entry is not None:
+            entry[0] += count
+            if entry[0] <= 0:
+                del summary[value]
+        return
+    if entry is not None:
+        entry[0] += count
+    elif len(summary) < capacity:
+        summary[value] = [count, 0]
+    else:
+        # 最小の要素を置き換える（推定回数は最小値を引き継ぐ）
+        min_value = min(summary, key=lambda v: summary[v][0])
+        min_count = summary.pop(min_value)[0]
+        summary[value] = [min_count + count, min_count]
+
+
+class AnalyticsStore:
+    """全ユーザー横断の集計値"""
+
+    def __init__(self, data_dir: str = DATA_DIR):
+        self.path = os.path.join(data_dir, "analytics.json")
+        self._locks = LockTable(os.path.join(data_dir, "locks"))
+        self._cache = JsonFileCache(max_entries=1)
+        self._lock = threading.Lock()
+        self._pending = _empty_aggregates()
+        self._pending_events = 0
+        self._last_flush = time.monotonic()
+        atexit.register(self.flush)
+
+    # --- ProfileManager リスナー ---
+
+    def on_user_created(self, profile: Dict):
+        with self._lock:
+            self._pending["users"] += 1
+            _add_count(self._pending["stages"], str(profile.get("human_stage", 1)), 1)
+        self._after_event()
+
+    def on_fact_changed(self, user_id: str, session_id: str, fact: Dict,
+                        change: str, previous_value):
+        category = fact["category"]
+        field, normalized = _field_and_value(category, fact["key"], fact["value"])
+        previous = _field_and_value(category, fact["key"], previous_value)[1] \
+            if previous_value is not None else ""
+        if normalized == previous:
+            return
+        with self._lock:
+            counts = self._pending["values"].setdefault(category, {}).setdefault(field, {})
+            if normalized:
+                _add_count(counts, normalized, 1)
+            if previous:
+                _add_count(counts, previous, -1)
+        self._after_event()
+
+    def on_counts_changed(self, user_id: str, old_counts: Dict[str, int],
+                          new_counts: Dict[str, int], old_stage: int, new_stage: int):
+        with self._lock:
+            for category in set(old_counts) | set(new_counts):
+                had = old_counts.get(category, 0) > 0
+                has = new_counts.get(category, 0) > 0
+                if had != has:
+                    _add_count(self._pending["coverage"], category, 1 if has else -1)
+            if old_stage != new_stage:
+                _add_count(self._pending["stages"], str(old_stage), -1)
+                _add_count(self._pending["stages"], str(new_stage), 1)
+        self._after_event()
+
+    def on_badge_added(self, user_id: str, badge_name: str):
+        with self._lock:
+            _add_count(self._pending["badges"], badge_name, 1)
+        self._after_event()
+
+    # --- 反映・参照 ---
+
+    def _after_event(self):
+        with self._lock:
+            self._pending_events += 1
+            due = (self._pending_events >= ANALYTICS_FLUSH_EVENTS or
+                   time.monotonic() - self._last_flush >= ANALYTICS_FLUSH_SECONDS)
+        if due:
+            self.flush()
+
+    def _take_pending(self) -> Dict:
+        with self._lock:
+            pending = self._pending
+            self._pending = _empty_aggregates()
+            self._pending_events = 0
+            self._last_flush = time.monotonic()
+        return pending
+
+    def flush(self):
+        """プロセス内の差分をファイルに合算"""
+        pending = self._take_pending()
+        if pending == _empty_aggregates():
+            return
+        with self._locks.lock("analytics"):
+            data = read_json(self.path) or _empty_aggregates()
+            data["users"] += pending["users"]
+            for name in ("coverage", "stages", "badges"):
+                for key, amount in pending[name].items():
+                    _add_count(data[name], key, amount)
+            for category, fields in pending["values"].items():
+                for field, counts in fields.items():
+                    summary = data["values"].setdefault(category, {}).setdefault(field, {})
+                    for value, count in counts.items():
+                        if count:
+                            space_saving_add(summary, value, count, ANALYTICS_TOPK_CAPACITY)
+            data["updated_at"] = time.time()
+            atomic_write_json(self.path, data, indent=None)
+
+    def snapshot(self, top_k: int = 10) -> Dict:
+        """集計値を取得（未反映の差分も含む）"""
+        data = self._cache.get(self.path) or _empty_aggregates()
+        with self._lock:
+            pending = {
+                "users": self._pending["users"],
+                "coverage": dict(self._pending["coverage"]),
+                "stages": dict(self._pending["stages"]),
+                "badges": dict(self._pending["badges"]),
+                "values": {
+                    category: {field: dict(counts) for field, counts in fields.items()}
+                    for category, fields in self._pending["values"].items()
+                }
+            }
+
+        def merged(name: str) -> Dict[str, int]:
+            result = dict(data[name])
+            for key, amount in pending[name].items():
+                _add_count(result, key, amount)
+            return result
+
+        top_values = {}
+        for category in CATEGORIES:
+            stored = data["values"].get(category, {})
+            local = pending["values"].get(category, {})
+            for field in set(stored) | set(local):
+                counts = {value: entry[0] for value, entry in stored.get(field, {}).items()}
+                for value, count in local.get(field, {}).items():
+                    _add_count(counts, value, count)
+                ranked = sorted(((value, count) for value, count in counts.items() if count > 0),
+                                key=lambda item: -item[1])[:top_k]
+                top_values.setdefault(category, {})[field] = [
+                    {"value": value, "count": count} for value, count in ranked
+                ]
+
+        coverage = merged("coverage")
+        stages = merged("stages")
+        return {
+            "users": data["users"] + pending["users"],
+            "category_coverage": {cat: coverage.get(cat, 0) for cat in CATEGORIES},
+            "stage_histogram": {key: stages[key] for key in sorted(stages, key=int)},
+            "badge_counts": merged("badges"),
+            "top_values": top_values,
+            "updated_at": data.get("updated_at")
+        }
+
+    def rebuild(self, profile_manager) -> Dict:
+        """
+        全データを走査して集計値を作り直す（既存データの取り込み・修復用）
+        走査中の書き込みは反映されない場合があるため、メンテナンス時に実行する
+        """
+        self._take_pending()
+        data = _empty_aggregates()
+        for user_id in profile_manager.iter_user_ids():
+            profile = profile_manager.get_user(user_id)
+            if not profile:
+                continue
+            data["users"] += 1
+            counts = profile_manager.get_category_data_count(user_id)
+            profile = profile_manager.get_user(user_id)
+            _add_count(data["stages"], str(profile.get("human_stage", 1)), 1)
+            for category, count in counts.items():
+                if count > 0:
+                    _add_count(data["coverage"], category, 1)
+            for badge_name in profile.get("badges", []):
+                _add_count(data["badges"], badge_name, 1)
+
+            # 事実ストアの現在の値（インクリメンタルな集計と同じくユーザーごとに1）
+            for fact in profile_manager.get_facts(user_id) or []:
+                field, normalized = _field_and_value(fact["category"], fact["key"], fact["value"])
+                if normalized:
+                    summary = data["values"].setdefault(fact["category"], {}).setdefault(field, {})
+                    space_saving_add(summary, normalized, 1, ANALYTICS_TOPK_CAPACITY)
+
+        data["updated_at"] = time.time()
+        with self._locks.lock("analytics"):
+            atomic_write_json(self.path, data, indent=None)
+        return self.snapshot()
@@ -2,10 +2,14 @@
 Flask メインアプリケーション: REST API エンドポイント
 """
 
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, g, request, jsonify, send_from_directory
 from flask_cors import CORS
+import logging
+import math
 import os
 import sys
+import threading
+import time
 
 # 現在のディレクトリをパスに追加
 sys.path.append(os.path.dirname(__file__))
@@ -13,7 +17,36 @@ sys.path.append(os.path.dirname(__file__))
 from profile_manager import ProfileManager
 from interviewer import Interviewer
 from gamification import GamificationManager
-from config import CHARACTERS, BADGES, HUMAN_STAGES, RANDOM_EVENTS
+from event_hub import EventHub, format_sse, parse_last_event_id
+from static_assets import AssetPipeline
+from exporter import ExportFilter, iter_export_records, iter_ndjson, normalize_date
+from analytics import AnalyticsStore
+from search_index import SearchIndex
+from retrieval import MemoryRetriever
+from sqlite_store import SqliteStore, SqliteMirror
+from tracing import span, start_trace, finish_trace
+from logging_setup import setup_logging
+from lm_monitor import LMStudioMonitor
+from archive import SessionArchiver
+from usage import start_meter, finish_meter, process_usage
+from speculation import Speculator
+from request_guard import ChatGuard, ChatGuardError
+from config import (
+    CHARACTERS, BADGES, HUMAN_STAGES, RANDOM_EVENTS,
+    MESSAGES_PAGE_DEFAULT, MESSAGES_PAGE_MAX, EVENT_HEARTBEAT_SECONDS,
+    EVENT_SYNC_MAX_STREAMS, EVENT_SYNC_STREAM_SECONDS,
+    FRONTEND_DIR, ASSET_PIPELINE_ENABLED, ASSET_BUILD_DIR, ASSET_URL_PREFIX,
+    ADMIN_TOKEN, SEARCH_RESULTS_DEFAULT, SEARCH_RESULTS_MAX, TRACE_ENABLED,
+    RETRIEVAL_ENABLED, SQLITE_DUAL_WRITE, SQLITE_PATH, LLM_TOTAL_SLOTS, LLM_WORKERS, LLM_SLOTS
+)
+
+setup_logging()
+logger = logging.getLogger("interview.app")
+
+if LLM_WORKERS > LLM_TOTAL_SLOTS:
+    logger.error("INTERVIEW_WORKERS (%d) exceeds INTERVIEW_LLM_SLOTS (%d): up to %d concurrent "
+                 "LLM requests will be sent; use at most %d workers",
+                 LLM_WORKERS, LLM_TOTAL_SLOTS, LLM_WORKERS * LLM_SLOTS, LLM_TOTAL_SLOTS)
 
 app = Flask(__name__, static_folder='../frontend', static_url_path='')
 CORS(app)
@@ -22,22 +55,142 @@ CORS(app)
 profile_manager = ProfileManager()
 interviewer = Interviewer()
 gamification = GamificationManager()
+event_hub = EventHub()
+event_hub.start()
+analytics = AnalyticsStore()
+profile_manager.add_listener(analytics)
+search_index = SearchIndex()
+profile_manager.add_listener(search_index)
+retriever = MemoryRetriever(profile_manager)
+
+# SQLiteへの二重書き込み（移行中の無停止切り替え用）
+if SQLITE_DUAL_WRITE:
+    profile_manager.add_listener(SqliteMirror(SqliteStore(SQLITE_PATH)))
+    logger.info("Dual-write to SQLite enabled (%s)", SQLITE_PATH)
+
+# LM Studioの接続確認・ウォームアップはバックグラウンドで行う
+lm_monitor = LMStudioMonitor(interviewer)
+lm_monitor.start()
+
+# アイドルなセッションのアーカイブ（ワーカーが複数あっても同時に実行するのは1つ）
+archiver = SessionArchiver(profile_manager, event_hub=event_hub)
+archiver.start()
+
+# ユーザーの入力中に次の応答のプロンプトを事前処理（INTERVIEW_SPECULATION=1 のとき）
+speculator = Speculator(interviewer, profile_manager)
+
+# /api/chat の重複リクエストの合流・Idempotency-Key・ユーザーごとのレート制限
+chat_guard = ChatGuard(profile_manager.idempotency, profile_manager.rate_limits)
+
+# 静的アセット（生成済みの一覧を読む。元ファイルが変わっていれば生成し直す）
+asset_pipeline = None
+if ASSET_PIPELINE_ENABLED:
+    asset_pipeline = AssetPipeline(FRONTEND_DIR, ASSET_BUILD_DIR)
+    asset_pipeline.load_or_build()
+
+
+def begin_request_trace():
+    """リクエストのトレースを開始"""
+    g.trace = start_trace(f"{request.method} {request.path}")
+
+
+def add_server_timing(response):
+    """トレース結果を Server-Timing ヘッダーで返す"""
+    header = finish_trace(g.pop('trace', None))
+    if header:
+        response.headers['Server-Timing'] = header
+    return response
+
+
+@app.teardown_request
+def clear_usage_meter(_exc):
+    """LLM使用量のメーターを片付ける（スレッドを使い回すため次のリクエストに残さない）"""
+    finish_meter()
+
+
+# 無効時はフックも登録しない
+if TRACE_ENABLED:
+    app.before_request(begin_request_trace)
+    app.after_request(add_server_timing)
+
+
+def not_modified(etag: str):
+    """If-None-Match がETagと一致すれば304レスポンスを返す"""
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    return None
+
+
+def with_etag(response, etag: str):
+    """ETagを付与し、毎回再検証させる"""
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def profile_delta(old_profile: dict, new_profile: dict) -> dict:
+    """2つのプロファイル間で変化したフィールドだけを返す"""
+    return {
+        key: value for key, value in new_profile.items()
+        if old_profile.get(key) != value
+    }
+
+
+def _int_arg(name: str, default=None):
+    """整数のクエリパラメータを取得（不正な値は ValueError）"""
+    value = request.args.get(name)
+    return default if value is None else int(value)
+
+
+def is_admin_request() -> bool:
+    """
+    管理APIへのアクセス可否
+    ADMIN_TOKEN が設定されていれば X-Admin-Token ヘッダーで照合し、
+    未設定ならlocalhostからのリクエストのみ許可する
+    """
+    if ADMIN_TOKEN:
+        return request.headers.get('X-Admin-Token') == ADMIN_TOKEN
+    return request.remote_addr in ('127.0.0.1', '::1')
 
 
 @app.route('/')
 def index():
     """メインページ"""
+    if asset_pipeline:
+        return asset_pipeline.send_index()
     return send_from_directory(app.static_folder, 'index.html')
 
 
+@app.route(f'{ASSET_URL_PREFIX}/<path:filename>')
+def assets(filename):
+    """フィンガープリント付きの静的アセット"""
+    response = asset_pipeline.send_asset(filename) if asset_pipeline else None
+    if response is None:
+        return jsonify({'error': 'Asset not found'}), 404
+    return response
+
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    """ヘルスチェック"""
-    lm_studio_connected = interviewer.check_lm_studio_connection()
-    return jsonify({
-        'status': 'ok',
-        'lm_studio': 'connected' if lm_studio_connected else 'disconnected'
-    })
+    """ヘルスチェック（LM Studioの状態はバックグラウンドで確認済みのもの）"""
+    return jsonify({'status': 'ok', **lm_monitor.status()})
+
+
+@app.route('/api/health/live', methods=['GET'])
+def health_live():
+    """死活確認（プロセスが応答できれば200）"""
+    return jsonify({'status': 'ok'})
+
+
+@app.route('/api/health/ready', methods=['GET'])
+def health_ready():
+    """準備完了確認（LM Studioに接続済み・ウォームアップ完了なら200、それ以外は503）"""
+    ready = lm_monitor.ready
+    return jsonify({'status': 'ready' if ready else 'not_ready', **lm_monitor.status()}), \
+        200 if ready else 503
 
 
 @app.route('/api/characters', methods=['GET'])
@@ -78,13 +231,45 @@ def get_user(user_id):
     if not profile:
         return jsonify({'error': 'User not found'}), 404
 
+    # カテゴリー別データ数はプロファイルに含まれるため、バージョンで変更を判定できる
+    etag = f"user-{user_id}-{profile.get('version', 0)}"
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
     # カテゴリー別データ数を取得
     category_counts = profile_manager.get_category_data_count(user_id)
 
-    return jsonify({
+    return with_etag(jsonify({
         'profile': profile,
         'category_counts': category_counts
-    })
+    }), etag)
+
+
+@app.route('/api/user/<user_id>/facts', methods=['GET'])
+def get_user_facts(user_id):
+    """
+    ユーザーの現在の事実（カテゴリー・項目ごとに重複を除いたデータ）を取得
+    ?category=...  カテゴリーで絞り込み
+    ?history=1     以前の値の履歴も含める
+    """
+    facts = profile_manager.get_facts(
+        user_id,
+        category=request.args.get('category') or None,
+        include_history=request.args.get('history') == '1'
+    )
+    if facts is None:
+        return jsonify({'error': 'User not found'}), 404
+    return jsonify({'user_id': user_id, 'facts': facts})
+
+
+@app.route('/api/user/<user_id>/usage', methods=['GET'])
+def get_user_usage(user_id):
+    """ユーザーのLLM使用量（用途別の累計・日別）と1日の上限の状態を取得"""
+    usage = profile_manager.get_usage(user_id)
+    if usage is None:
+        return jsonify({'error': 'User not found'}), 404
+    return jsonify(usage)
 
 
 @app.route('/api/session/create', methods=['POST'])
@@ -116,8 +301,8 @@ def create_session():
     # ランダムイベントチェック
     event = gamification.should_trigger_event()
     if event:
-        session['events_triggered'].append(event['name'])
-        profile_manager.update_session(session['session_id'], session)
+        profile_manager.add_triggered_event(session['session_id'], event['name'])
+        event_hub.publish(session['session_id'], 'event_triggered', event)
 
     # 更新されたセッションを取得
     session = profile_manager.get_session(session['session_id'])
@@ -132,126 +317,525 @@ def create_session():
 @app.route('/api/session/<session_id>', methods=['GET'])
 def get_session(session_id):
     """セッションを取得"""
+    summary = profile_manager.get_session_summary(session_id)
+    if not summary:
+        return jsonify({'error': 'Session not found'}), 404
+
+    etag = f"session-{session_id}-{summary['version']}"
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
     session = profile_manager.get_session(session_id)
-    if not session:
+    return with_etag(jsonify({'session': session}), etag)
+
+
+@app.route('/api/session/<session_id>/summary', methods=['GET'])
+def get_session_summary(session_id):
+    """セッションの概要（件数・最新メッセージ・リアクション）を取得"""
+    summary = profile_manager.get_session_summary(session_id)
+    if not summary:
         return jsonify({'error': 'Session not found'}), 404
 
-    return jsonify({'session': session})
+    etag = f"session-{session_id}-{summary['version']}"
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    return with_etag(jsonify({'summary': summary}), etag)
+
+
+@app.route('/api/session/<session_id>/messages', methods=['GET'])
+def get_session_messages(session_id):
+    """
+    会話メッセージをページ単位で取得
+    クエリ: before=<seq> / after=<seq> / limit=<件数>（最大 MESSAGES_PAGE_MAX）
+    """
+    try:
+        before = _int_arg('before')
+        after = _int_arg('after')
+        limit = _int_arg('limit', MESSAGES_PAGE_DEFAULT)
+    except ValueError:
+        return jsonify({'error': 'invalid cursor'}), 400
+
+    if before is not None and after is not None:
+        return jsonify({'error': 'before and after are exclusive'}), 400
+    limit = max(1, min(limit, MESSAGES_PAGE_MAX))
+
+    page = profile_manager.get_messages(session_id, before=before, after=after, limit=limit)
+    if page is None:
+        return jsonify({'error': 'Session not found'}), 404
 
+    messages = page['messages']
+    return jsonify({
+        'messages': messages,
+        'total': page['total'],
+        'has_more': page['has_more'],
+        'before': messages[0]['seq'] if messages else None,
+        'after': messages[-1]['seq'] if messages else None
+    })
 
-@app.route('/api/chat', methods=['POST'])
-def chat():
-    """チャットメッセージを送信"""
-    data = request.json
-    session_id = data.get('session_id')
-    user_message = data.get('message')
 
-    if not session_id or not user_message:
-        return jsonify({'error': 'session_id and message required'}), 400
+# 同期モードで同時に開ける配信の接続数（接続ごとにスレッドを占有するため）
+sync_event_streams = threading.BoundedSemaphore(EVENT_SYNC_MAX_STREAMS)
 
-    # セッション取得
-    session = profile_manager.get_session(session_id)
-    if not session:
+
+@app.route('/api/session/<session_id>/events', methods=['GET'])
+def session_events(session_id):
+    """
+    セッションのイベントをServer-Sent Eventsで配信
+    イベント: badge_earned / stage_changed / data_extracted / event_triggered
+    再接続時は Last-Event-ID ヘッダー（または last_event_id クエリ）から再開する
+    同期モードでは接続数と接続時間を制限する（多数の接続は非同期モードで扱う）
+    """
+    if not profile_manager.get_session_summary(session_id):
         return jsonify({'error': 'Session not found'}), 404
 
-    # ユーザー取得
-    user_id = session['user_id']
-    profile = profile_manager.get_user(user_id)
-    if not profile:
-        return jsonify({'error': 'User not found'}), 404
+    if not sync_event_streams.acquire(blocking=False):
+        return jsonify({'error': 'Too many event streams (use the async server mode)'}), 503, {
+            'Retry-After': str(EVENT_HEARTBEAT_SECONDS)
+        }
+
+    last_event_id = parse_last_event_id(
+        request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    )
+    subscription = event_hub.subscribe(session_id, last_event_id)
+    deadline = time.monotonic() + EVENT_SYNC_STREAM_SECONDS
+
+    def stream():
+        yield "retry: 3000\n\n"
+        while not subscription.closed and time.monotonic() < deadline:
+            events = subscription.get(EVENT_HEARTBEAT_SECONDS)
+            if not events:
+                yield ": keep-alive\n\n"
+            for event in events:
+                yield format_sse(event)
+
+    def close():
+        subscription.close()
+        sync_event_streams.release()
+
+    response = Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # 送信前に切断された場合もスレッド枠を返すよう、ジェネレーターではなく応答の終了時に片付ける
+    response.call_on_close(close)
+    return response
+
+
+class ChatRequestError(Exception):
+    """チャットリクエストのエラー（HTTPステータス付き）"""
+
+    def __init__(self, message: str, status: int, retry_after: float = None):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.retry_after = retry_after
+
+    def to_result(self) -> tuple:
+        body = {'error': self.message}
+        if self.retry_after is not None:
+            body['retry_after'] = self.retry_after
+        return self.status, body
+
+
+def chat_result_headers(status: int, body: dict, replayed: bool) -> dict:
+    """/api/chat のレスポンスヘッダー（合流・返し直しの印と Retry-After）"""
+    headers = {}
+    if replayed:
+        headers['Idempotent-Replayed'] = 'true'
+    if status == 429:
+        headers['Retry-After'] = str(max(1, math.ceil(body.get('retry_after', 1))))
+    return headers
+
+
+def begin_chat_turn(session_id, user_message) -> dict:
+    """
+    チャットターンの前処理（LLM呼び出し前まで）
+    同期版・非同期版のチャットAPIで共通に使う
+    Returns: ターンの状態を保持する辞書
+    """
+    if not session_id or not user_message:
+        raise ChatRequestError('session_id and message required', 400)
+
+    with span('load'):
+        # セッション取得（会話は読まない）
+        session = profile_manager.get_session_summary(session_id)
+        if not session:
+            raise ChatRequestError('Session not found', 404)
+
+        # ユーザー取得
+        user_id = session['user_id']
+        profile = profile_manager.get_user(user_id)
+        if not profile:
+            raise ChatRequestError('User not found', 404)
+
+    # ユーザーごとのレート制限（LLMを呼ぶ前に判定）
+    retry_after = chat_guard.limiter.acquire(user_id)
+    if retry_after:
+        chat_guard.record_rate_limited()
+        raise ChatRequestError('Too many requests', 429, round(retry_after, 1))
 
     # ユーザーメッセージを保存
-    profile_manager.add_message(session_id, 'user', user_message)
+    with span('save_message'):
+        profile_manager.add_message(session_id, 'user', user_message)
 
-    # メッセージ分析
-    message_analysis = gamification.analyze_message_for_data(user_message)
+    with span('analysis'):
+        # メッセージ分析
+        message_analysis = gamification.analyze_message_for_data(user_message)
 
-    # リアクション判定
-    reaction_tier = gamification.determine_reaction(user_message, message_analysis)
+        # リアクション判定
+        reaction_tier = gamification.determine_reaction(user_message, message_analysis)
 
-    # セッションにリアクション記録
-    if reaction_tier != "none":
-        session = profile_manager.get_session(session_id)
-        session['reactions'][reaction_tier] = session['reactions'].get(reaction_tier, 0) + 1
-        profile_manager.update_session(session_id, session)
+        # セッションにリアクション記録
+        if reaction_tier != "none":
+            profile_manager.increment_reaction(session_id, reaction_tier)
 
-    # 表情選択
-    expression = gamification.get_expression_for_reaction(reaction_tier, message_analysis)
+        # 表情選択
+        expression = gamification.get_expression_for_reaction(reaction_tier, message_analysis)
 
     # カテゴリー別データ数と空カテゴリーを取得
-    category_counts = profile_manager.get_category_data_count(user_id)
-    empty_categories = profile_manager.get_empty_categories(user_id)
+    with span('counts'):
+        category_counts = profile_manager.get_category_data_count(user_id)
+        empty_categories = profile_manager.get_empty_categories(user_id)
 
     # 会話履歴を構築
-    session = profile_manager.get_session(session_id)
-    messages = []
-    for msg in session['conversation']:
-        role = msg['role']
-        content = msg['content']
-        messages.append({'role': role, 'content': content})
+    with span('history'):
+        conversation = profile_manager.get_conversation(session_id) or []
+        messages = [message.to_llm() for message in conversation]
+
+    # 1日の使用量の上限を超えていれば、想起とデータ抽出を省略する（応答は続ける）
+    over_quota = profile_manager.usage.quota_status(user_id)['exceeded']
+
+    # 過去セッションから関連する事実を選ぶ
+    memories = []
+    if RETRIEVAL_ENABLED and not over_quota:
+        with span('retrieval'):
+            memories = retriever.retrieve(profile, session_id, user_message)
+
+    turn = {
+        'session_id': session_id,
+        'user_id': user_id,
+        'user_message': user_message,
+        'profile': profile,
+        'message_analysis': message_analysis,
+        'reaction_tier': reaction_tier,
+        'expression': expression,
+        'category_counts': category_counts,
+        'empty_categories': empty_categories,
+        'messages': messages,
+        'memories': memories,
+        'over_quota': over_quota
+    }
+
+    # 前のターンの後に事前処理したプロンプトと一致するかを記録
+    with span('speculation'):
+        speculator.consume(turn)
+    return turn
 
-    # LM Studioからレスポンス取得
-    assistant_response = interviewer.get_response(
-        messages,
-        profile['character'],
-        profile,
-        category_counts,
-        empty_categories
-    )
 
+def record_assistant_response(turn: dict, assistant_response) -> str:
+    """LLMの応答を保存（応答がない場合は代替メッセージ）"""
     if not assistant_response:
         assistant_response = "ごめんね、ちょっと考えがまとまらなくて..."
-        expression = "thinking"
+        if turn.get('next_topic'):
+            # 事前に用意した次の話題で会話を続ける
+            assistant_response += turn['next_topic']
+            speculator.record_fallback()
+        turn['expression'] = "thinking"
 
     # アシスタントメッセージを保存
-    profile_manager.add_message(session_id, 'assistant', assistant_response, expression)
-
-    # プロファイリングデータ抽出
-    extracted_data = interviewer.extract_profile_data(
-        user_message,
-        assistant_response,
-        messages
-    )
+    with span('save_reply'):
+        profile_manager.add_message(
+            turn['session_id'], 'assistant', assistant_response, turn['expression']
+        )
+    turn['response'] = assistant_response
+    return assistant_response
+
+
+def complete_chat_turn(turn: dict, extracted_data: list,
+                       delta: bool = False, profile_version=None) -> dict:
+    """
+    チャットターンの後処理（データ保存・バッジ・ステージ）
+    delta=True でクライアントのプロファイルがターン開始時と同じバージョンなら、
+    profile の代わりに変化したフィールドだけを profile_delta で返す
+    Returns: /api/chat のレスポンスボディ
+    """
+    session_id = turn['session_id']
+    user_id = turn['user_id']
+    profile = turn['profile']
 
     # 抽出したデータを保存
-    for data_point in extracted_data:
-        try:
-            profile_manager.add_extracted_data(
-                session_id,
-                data_point['category'],
-                data_point['key'],
-                data_point['value']
-            )
-            print(f"[Data] Saved: {data_point['category']} - {data_point['key']}: {data_point['value']}")
-        except Exception as e:
-            print(f"[Data] Error saving data point: {e}")
+    saved_data = []
+    with span('save_data'):
+        for data_point in extracted_data:
+            try:
+                profile_manager.add_extracted_data(
+                    session_id,
+                    data_point['category'],
+                    data_point['key'],
+                    data_point['value']
+                )
+                saved_data.append(data_point)
+                logger.debug("Saved data point", extra={"fields": data_point})
+            except Exception as e:
+                logger.error("Error saving data point: %s", e)
+    if saved_data:
+        event_hub.publish(session_id, 'data_extracted', {'data': saved_data})
 
     # バッジチェック
-    newly_earned_badges = gamification.check_badges(profile, message_analysis)
-    for badge_name in newly_earned_badges:
-        profile_manager.add_badge(user_id, badge_name)
+    with span('badges'):
+        newly_earned_badges = gamification.check_badges(profile, turn['message_analysis'])
+        for badge_name in newly_earned_badges:
+            profile_manager.add_badge(user_id, badge_name)
+            event_hub.publish(session_id, 'badge_earned', {'badge': badge_name})
 
     # 人間形成ステージ更新
-    total_count = profile_manager.get_total_data_count(user_id)
-    new_stage = profile_manager.calculate_human_stage(total_count)
-    old_stage = profile.get('human_stage', 1)
-    stage_changed = new_stage > old_stage
+    with span('stage'):
+        total_count = profile_manager.get_total_data_count(user_id)
+        new_stage = profile_manager.calculate_human_stage(total_count)
+        old_stage = profile.get('human_stage', 1)
+        stage_changed = new_stage > old_stage
+        if stage_changed:
+            event_hub.publish(session_id, 'stage_changed', {
+                'old_stage': old_stage,
+                'new_stage': new_stage,
+                'total_data_count': total_count
+            })
+
+    # LLM使用量をセッションとユーザーに記録
+    usage = turn['meter'].to_dict() if turn.get('meter') else {}
+    with span('usage'):
+        profile_manager.add_usage(user_id, session_id, usage)
 
     # 更新されたプロファイルを取得
-    profile = profile_manager.get_user(user_id)
+    old_profile = profile
+    with span('reload_profile'):
+        profile = profile_manager.get_user(user_id)
 
-    return jsonify({
+    result = {
         'success': True,
-        'response': assistant_response,
-        'expression': expression,
-        'reaction': reaction_tier,
+        'response': turn['response'],
+        'expression': turn['expression'],
+        'reaction': turn['reaction_tier'],
         'badges': newly_earned_badges,
         'stage_changed': stage_changed,
         'new_stage': new_stage,
-        'profile': profile
+        'profile_version': profile.get('version', 0),
+        'usage': usage
+    }
+    if turn['over_quota']:
+        result['quota_exceeded'] = True
+
+    # ユーザーが次のメッセージを入力している間に、次の応答のプロンプトを事前処理
+    speculator.schedule(turn)
+
+    if delta and profile_version == old_profile.get('version', 0):
+        result['profile_delta'] = profile_delta(old_profile, profile)
+    else:
+        result['profile'] = profile
+    return result
+
+
+@app.route('/api/chat', methods=['POST'])
+def chat():
+    """
+    チャットメッセージを送信
+    同じ内容（Idempotency-Key があれば同じキー）のリクエストが処理中ならその結果を、
+    処理済みのキーならその結果を返す（Idempotent-Replayed: true）
+    """
+    data = request.json
+    try:
+        ticket = chat_guard.ticket(data.get('session_id'), data.get('message'),
+                                   request.headers.get('Idempotency-Key'))
+        result = chat_guard.replay(ticket)
+        replayed = result is not None
+        if not replayed:
+            result, replayed = chat_guard.run(ticket, lambda: run_chat_turn(data, ticket))
+    except ChatGuardError as e:
+        return jsonify({'error': e.message}), e.status
+
+    status, body = result
+    return jsonify(body), status, chat_result_headers(status, body, replayed)
+
+
+def run_chat_turn(data: dict, ticket) -> tuple:
+    """チャットターンを処理（合流した同じ内容のリクエストにも同じ結果を返す）"""
+    meter = start_meter()   # finish_meter はリクエスト終了時のフックで呼ぶ
+
+    try:
+        turn = begin_chat_turn(data.get('session_id'), data.get('message'))
+    except ChatRequestError as e:
+        return e.to_result()
+
+    turn['meter'] = meter
+    profile = turn['profile']
+
+    # LM Studioからレスポンス取得
+    assistant_response = interviewer.get_response(
+        turn['messages'],
+        profile['character'],
+        profile,
+        turn['category_counts'],
+        turn['empty_categories'],
+        user_id=turn['user_id'],
+        memories=turn['memories']
+    )
+    assistant_response = record_assistant_response(turn, assistant_response)
+
+    # プロファイリングデータ抽出（使用量の上限を超えている場合は省略）
+    extracted_data = [] if turn['over_quota'] else interviewer.extract_profile_data(
+        turn['user_message'],
+        assistant_response,
+        turn['messages'],
+        user_id=turn['user_id']
+    )
+
+    result = 200, complete_chat_turn(
+        turn, extracted_data, data.get('delta', False), data.get('profile_version')
+    )
+    chat_guard.remember(ticket, result)
+    return result
+
+
+@app.route('/api/admin/export', methods=['GET'])
+def export_data():
+    """
+    全ユーザーのプロファイル・セッション・抽出データをNDJSONでストリーミング出力
+    クエリ: since / until（ISO日時）, category, cursor（再開位置）, messages=1, gzip=1
+    """
+    if not is_admin_request():
+        return jsonify({'error': 'Forbidden'}), 403
+
+    try:
+        export_filter = ExportFilter(
+            request.args.get('since'),
+            request.args.get('until'),
+            request.args.get('category'),
+            request.args.get('messages') == '1'
+        )
+    except ValueError:
+        return jsonify({'error': 'invalid date'}), 400
+
+    compress = request.args.get('gzip') == '1'
+    records = iter_export_records(profile_manager, export_filter, request.args.get('cursor'))
+    headers = {'Cache-Control': 'no-store'}
+    if compress:
+        headers['Content-Encoding'] = 'gzip'
+    return Response(iter_ndjson(records, compress), mimetype='application/x-ndjson',
+                    headers=headers)
+
+
+@app.route('/api/admin/analytics', methods=['GET'])
+def get_analytics():
+    """
+    全ユーザー横断の集計値を取得
+    クエリ: k=<頻出値の件数>
+    """
+    if not is_admin_request():
+        return jsonify({'error': 'Forbidden'}), 403
+
+    try:
+        top_k = max(1, min(_int_arg('k', 10), 100))
+    except ValueError:
+        return jsonify({'error': 'invalid k'}), 400
+    return jsonify(analytics.snapshot(top_k))
+
+
+@app.route('/api/admin/analytics/rebuild', methods=['POST'])
+def rebuild_analytics():
+    """全データを走査して集計値を作り直す"""
+    if not is_admin_request():
+        return jsonify({'error': 'Forbidden'}), 403
+    return jsonify(analytics.rebuild(profile_manager))
+
+
+@app.route('/api/admin/store', methods=['GET'])
+def get_store_stats():
+    """ユーザー数・セッション数（一覧から取得するのでディレクトリは走査しない）とアーカイブの状態"""
+    if not is_admin_request():
+        return jsonify({'error': 'Forbidden'}), 403
+    return jsonify({
+        'users': profile_manager.count_users(),
+        'sessions': profile_manager.count_sessions(),
+        'archive': {**profile_manager.archive.stats(), 'last_run': archiver.last_run}
     })
 
 
+@app.route('/api/admin/archive', methods=['POST'])
+def run_archiver():
+    """アイドルなセッションのアーカイブを今すぐ実行"""
+    if not is_admin_request():
+        return jsonify({'error': 'Forbidden'}), 403
+    result = archiver.run()
+    if result is None:
+        return jsonify({'error': 'archiver is already running'}), 409
+    return jsonify(result)
+
+
+@app.route('/api/admin/usage', methods=['GET'])
+def get_process_usage():
+    """このワーカープロセスのLLM使用量（用途別、接続確認・ウォームアップも含む）"""
+    if not is_admin_request():
+        return jsonify({'error': 'Forbidden'}), 403
+    return jsonify(process_usage())
+
+
+@app.route('/api/admin/speculation', methods=['GET'])
+def get_speculation_stats():
+    """事前処理の的中率と、使われなかった事前処理のトークン数・所要時間"""
+    if not is_admin_request():
+        return jsonify({'error': 'Forbidden'}), 403
+    return jsonify(speculator.stats())
+
+
+@app.route('/api/admin/chat-guard', methods=['GET'])
+def get_chat_guard_stats():
+    """/api/chat の合流・返し直し・レート制限の件数（このワーカープロセス）"""
+    if not is_admin_request():
+        return jsonify({'error': 'Forbidden'}), 403
+    return jsonify(chat_guard.stats())
+
+
+@app.route('/api/admin/scheduler', methods=['GET'])
+def get_scheduler_stats():
+    """LLMリクエストスケジューラーの待ち行列・待ち時間の統計"""
+    if not is_admin_request():
+        return jsonify({'error': 'Forbidden'}), 403
+    return jsonify(interviewer.scheduler.stats())
+
+
+@app.route('/api/search', methods=['GET'])
+def search_facts():
+    """
+    抽出データを検索
+    クエリ: q, category, since / until（ISO日時）, limit
+    """
+    if not is_admin_request():
+        return jsonify({'error': 'Forbidden'}), 403
+
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'q is required'}), 400
+    try:
+        limit = max(1, min(_int_arg('limit', SEARCH_RESULTS_DEFAULT), SEARCH_RESULTS_MAX))
+        since = normalize_date(request.args.get('since'))
+        until = normalize_date(request.args.get('until'))
+    except ValueError:
+        return jsonify({'error': 'invalid parameter'}), 400
+
+    return jsonify(search_index.search(query, request.args.get('category'), since, until, limit))
+
+
+@app.route('/api/admin/search/rebuild', methods=['POST'])
+def rebuild_search_index():
+    """セッションファイルから検索インデックスを作り直す"""
+    if not is_admin_request():
+        return jsonify({'error': 'Forbidden'}), 403
+    return jsonify(search_index.rebuild(profile_manager))
+
+
 @app.route('/api/badges', methods=['GET'])
 def get_badges():
     """バッジ一覧を取得"""
@@ -275,14 +859,7 @@ if __name__ == '__main__':
     print("Interview System Backend Starting...")
     print("=" * 50)
     print("LM Studio URL:", interviewer.lm_studio_url)
-    print("Checking LM Studio connection...")
-
-    if interviewer.check_lm_studio_connection():
-        print("✓ LM Studio is connected!")
-    else:
-        print("✗ LM Studio is NOT connected!")
-        print("Please start LM Studio at http://localhost:1234")
-
+    print("LM Studio connection is checked in the background (see /api/health/ready)")
     print("=" * 50)
     print("Server starting at http://localhost:5001")
     print("=" * 50)
@@ -0,0 +1,379 @@
+"""
+セッションのアーカイブ: しばらく更新されていないセッションを圧縮してセグメントファイルにまとめる
+
+ほとんどのセッションは1日経つと読み書きされないが、セッションごとにJSON・メッセージログ・
+インデックスの3ファイルが残り続ける。アーカイバーはアイドルなセッションを
+1件ずつ zlib で圧縮して archive/segments/<番号>.seg に追記し、ファイルを削除する
+（セッションのイベントログと Idempotency-Key の記録も、使われていなければ削除する）。
+
+- archive/index.bin: セッションIDの昇順に (UUID 16バイト, セグメント番号, オフセット, 長さ)
+  を並べた固定長レコード。読み手は mmap して二分探索する（全体をメモリに読み込まない）
+- セグメントは実行ごとに新しいファイルを作り、公開後は変更しない（mmap で読む）
+- インデックスは1回の実行の最後に1度だけ、既存のインデックスと新しい記録をマージして
+  置き換える（記録の件数に比例する時間で済む）
+- 書き込み順は セグメント（fsync）→ インデックス（rename で置き換え）→ 元ファイルの削除
+  なので、どの時点で中断しても同じセッションを読める（元ファイルは実行の最後まで残る）
+- ProfileManager はファイルがないセッションをアーカイブから読む。アーカイブ済みの
+  セッションに書き込むと、通常のファイルに戻る（以降はそちらが優先される）。
+  セッションJSONを読んだ直後にファイルが消えた場合も、読み手はアーカイブから読み直す
+- 通常のファイルに戻ったセッションが再びアーカイブされると、インデックスは新しい記録を
+  指し、古いセグメントの記録は使われないまま残る（セグメントは書き換えないため、
+  現状は回収しない）。stats() の segment_bytes と live_bytes の差がその量
+
+使い方（サーバー内でも ARCHIVE_INTERVAL_SECONDS ごとに実行される）:
+    python backend/archive.py [--idle-hours 24] [--data-dir data]
+"""
+
+import argparse
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from typing import Dict, Iterator, List, Optional
+
+sys.path.append(os.path.dirname(__file__))
+
+from config import (
+    DATA_DIR, ARCHIVE_ENABLED, ARCHIVE_IDLE_SECONDS, ARCHIVE_INTERVAL_SECONDS,
+    ARCHIVE_SEGMENT_BYTES, ARCHIVE_COMPRESS_LEVEL
+)
+from storage import uuid_bytes, uuid_str
+
+try:
+    import fcntl
+except ImportError:  # Windows: アーカイバーの多重起動は防がない
+    fcntl = None
+
+logger = logging.getLogger("interview.archive")
+
+
+class SessionArchive:
+    """アーカイブ済みセッションの読み込みとセグメント・インデックスの書き込み"""
+
+    ENTRY = struct.Struct('<16sIQI')   # UUID, セグメント番号, オフセット, 長さ
+
+    def __init__(self, archive_dir: str):
+        self.archive_dir = archive_dir
+        self.segments_dir = os.path.join(archive_dir, "segments")
+        self.index_path = os.path.join(archive_dir, "index.bin")
+        os.makedirs(self.segments_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._index = None          # ((inode, mtime_ns), mmap または b'')
+        self._segments: Dict[int, mmap.mmap] = {}
+
+    # 読み込み
+
+    def _current_index(self):
+        """インデックスの mmap（アーカイバーが置き換えていれば開き直す）"""
+        try:
+            st = os.stat(self.index_path)
+        except FileNotFoundError:
+            return b''
+        stamp = (st.st_ino, st.st_mtime_ns)
+        index = self._index
+        if index is not None and index[0] == stamp:
+            return index[1]
+        with self._lock:
+            with open(self.index_path, 'rb') as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if st.st_size else b''
+            self._index = (stamp, data)
+            return data
+
+    def _lower_bound(self, index, key: bytes, lo: int = 0) -> int:
+        """key 以上の最初のレコードの番号（lo 番目以降を二分探索）"""
+        size = self.ENTRY.size
+        hi = len(index) // size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if index[mid * size:mid * size + 16] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _lookup(self, session_id: str) -> Optional[tuple]:
+        try:
+            key = uuid_bytes(session_id)
+        except ValueError:
+            return None
+        index = self._current_index()
+        size = self.ENTRY.size
+        pos = self._lower_bound(index, key) * size
+        if index[pos:pos + 16] == key:
+            return self.ENTRY.unpack_from(index, pos)[1:]
+        return None
+
+    def _segment(self, number: int) -> mmap.mmap:
+        segment = self._segments.get(number)
+        if segment is None:
+            with self._lock:
+                segment = self._segments.get(number)
+                if segment is None:
+                    with open(self.segment_path(number), 'rb') as f:
+                        segment = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    self._segments[number] = segment
+        return segment
+
+    def contains(self, session_id: str) -> bool:
+        return self._lookup(session_id) is not None
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        """
+        アーカイブ済みセッションを取得（なければNone）
+        Returns: {"session": セッションJSON, "messages": メッセージログの記録}
+        """
+        location = self._lookup(session_id)
+        if location is None:
+            return None
+        number, offset, length = location
+        return json.loads(zlib.decompress(self._segment(number)[offset:offset + length]))
+
+    def iter_ids(self) -> Iterator[str]:
+        index = self._current_index()
+        for pos in range(0, len(index) - len(index) % self.ENTRY.size, self.ENTRY.size):
+            yield uuid_str(bytes(index[pos:pos + 16]))
+
+    def stats(self) -> Dict:
+        segments = [entry for entry in os.scandir(self.segments_dir) if entry.name.endswith(".seg")]
+        index = self._current_index()
+        usable = len(index) - len(index) % self.ENTRY.size
+        return {
+            "sessions": usable // self.ENTRY.size,
+            "segments": len(segments),
+            "segment_bytes": sum(entry.stat().st_size for entry in segments),
+            # インデックスから参照されている記録の合計（残りは置き換えられた古い記録）
+            "live_bytes": sum(self.ENTRY.unpack_from(index, pos)[3]
+                              for pos in range(0, usable, self.ENTRY.size))
+        }
+
+    # 書き込み（アーカイバーのみ）
+
+    def segment_path(self, number: int) -> str:
+        return os.path.join(self.segments_dir, f"{number:08d}.seg")
+
+    def next_segment_number(self) -> int:
+        numbers = [int(entry.name[:-4]) for entry in os.scandir(self.segments_dir)
+                   if entry.name.endswith(".seg") and entry.name[:-4].isdigit()]
+        return max(numbers, default=0) + 1
+
+    def publish(self, entries: Dict[bytes, tuple]):
+        """
+        新しい (セグメント番号, オフセット, 長さ) をインデックスにマージして置き換える
+        既存のインデックスは並んでいるので、新しい記録の間の範囲をまとめて書き写す
+        """
+        index = self._current_index()
+        size = self.ENTRY.size
+        usable = len(index) - len(index) % size
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.archive_dir, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pos = 0
+                for key in sorted(entries):
+                    end = min(self._lower_bound(index, key, pos // size) * size, usable)
+                    f.write(index[pos:end])
+                    pos = end
+                    if index[pos:pos + 16] == key:
+                        pos += size   # 同じセッションは新しい記録を使う
+                    f.write(self.ENTRY.pack(key, *entries[key]))
+                f.write(index[pos:usable])
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.index_path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+
+class SegmentWriter:
+    """セグメントファイルへの追記（ARCHIVE_SEGMENT_BYTES を超えたら次のファイルへ）"""
+
+    def __init__(self, archive: SessionArchive):
+        self.archive = archive
+        self.number = archive.next_segment_number()
+        self.file = None
+        self.entries: Dict[bytes, tuple] = {}
+
+    def append(self, session_id: str, record: Dict) -> int:
+        data = zlib.compress(
+            json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8'),
+            ARCHIVE_COMPRESS_LEVEL
+        )
+        if self.file is not None and self.file.tell() + len(data) > ARCHIVE_SEGMENT_BYTES:
+            self._close_segment()
+            self.number += 1
+        if self.file is None:
+            self.file = open(self.archive.segment_path(self.number), 'xb')
+        offset = self.file.tell()
+        self.file.write(data)
+        self.entries[uuid_bytes(session_id)] = (self.number, offset, len(data))
+        return len(data)
+
+    def _close_segment(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        self.file = None
+
+    def commit(self):
+        """書き込んだセッションをインデックスに公開（実行の最後に1度だけ呼ぶ）"""
+        if self.file is not None:
+            self._close_segment()
+            self.number += 1
+        if self.entries:
+            self.archive.publish(self.entries)
+        self.entries = {}
+
+
+class SessionArchiver:
+    """アイドルなセッションをアーカイブに移す（バックグラウンドスレッドまたはCLI）"""
+
+    def __init__(self, manager, idle_seconds: float = ARCHIVE_IDLE_SECONDS, event_hub=None):
+        self.manager = manager
+        self.archive: SessionArchive = manager.archive
+        self.idle_seconds = idle_seconds
+        self.event_hub = event_hub   # None ならイベントログは保持期間切れで消える
+        self.last_run: Optional[Dict] = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        if self._thread is None and ARCHIVE_ENABLED:
+            self._thread = threading.Thread(target=self._loop, name='archiver', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.wait(ARCHIVE_INTERVAL_SECONDS):
+            try:
+                self.run()
+            except Exception as e:
+                logger.exception("Archive run failed: %s", e)
+
+    def run(self) -> Optional[Dict]:
+        """
+        1回分のアーカイブを実行して結果を返す
+        他のプロセスが実行中ならNone（ワーカーごとのスレッドが同時に動いても1つだけ実行する）
+        """
+        lock_fd = os.open(os.path.join(self.archive.archive_dir, ".lock"),
+                          os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return None
+            return self._run_locked()
+        finally:
+            os.close(lock_fd)
+
+    def _run_locked(self) -> Dict:
+        started = time.perf_counter()
+        result = {"archived": 0, "skipped": 0, "source_bytes": 0, "archived_bytes": 0}
+        writer = SegmentWriter(self.archive)
+        batch: List[tuple] = []
+        threshold = time.time() - self.idle_seconds
+
+        for session_id in self.manager.session_manifest.iter_sorted():
+            snapshot = self._snapshot(session_id, threshold)
+            if snapshot is None:
+                continue
+            record, stamp, source_bytes = snapshot
+            result["archived_bytes"] += writer.append(session_id, record)
+            result["source_bytes"] += source_bytes
+            batch.append((session_id, stamp))
+        self._commit(writer, batch, threshold, result)
+
+        result["seconds"] = round(time.perf_counter() - started, 2)
+        self.last_run = result
+        if result["archived"]:
+            logger.info("Archived %d sessions (%d -> %d bytes)", result["archived"],
+                        result["source_bytes"], result["archived_bytes"])
+        return result
+
+    def _files(self, session_id: str) -> List[str]:
+        meta_path = self.manager._session_path(session_id)
+        base = meta_path[:-len(".json")]
+        return [meta_path, base + ".jsonl", base + ".idx"]
+
+    @staticmethod
+    def _stamp(paths: List[str]) -> tuple:
+        stamp = []
+        for path in paths:
+            try:
+                st = os.stat(path)
+                stamp.append((st.st_ino, st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                stamp.append(None)
+        return tuple(stamp)
+
+    def _snapshot(self, session_id: str, threshold: float) -> Optional[tuple]:
+        """アーカイブ対象ならセッションの記録と、その時点のファイルの状態を返す"""
+        paths = self._files(session_id)
+        try:
+            if os.stat(paths[0]).st_mtime > threshold:
+                return None   # 最近更新された
+        except FileNotFoundError:
+            return None       # アーカイブ済み
+
+        with self.manager._lock_session(session_id):
+            stamp = self._stamp(paths)
+            session = self.manager._load_session_meta(session_id)
+            if session is None or stamp[0] is None:
+                return None
+            messages = self.manager._message_log(session_id).read()
+        record = {"session": session, "messages": messages}
+        return record, stamp, sum(entry[2] for entry in stamp if entry)
+
+    def _commit(self, writer: SegmentWriter, batch: List[tuple], threshold: float, result: Dict):
+        """インデックスを公開してから、アーカイブ後に変更されていないセッションのファイルを消す"""
+        writer.commit()
+        for session_id, stamp in batch:
+            with self.manager._lock_session(session_id):
+                paths = self._files(session_id)
+                if self._stamp(paths) != stamp:
+                    result["skipped"] += 1   # アーカイブ中に書き込まれた（ファイルの方が新しい）
+                    continue
+                # セッションJSONを先に消す（読み手はアーカイブを読むようになる）
+                for path in paths:
+                    try:
+                        os.unlink(path)
+                    except FileNotFoundError:
+                        pass
+            # セッションのロックの外で消す（どちらも対象のセッションが使われ始めていれば残す）
+            if self.event_hub is not None:
+                self.event_hub.remove(session_id, before=threshold)
+            self.manager.idempotency.remove(session_id)
+            result["archived"] += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    parser.add_argument('--idle-hours', type=float, default=ARCHIVE_IDLE_SECONDS / 3600,
+                        help='この時間以上更新されていないセッションをアーカイブする')
+    args = parser.parse_args()
+
+    from event_hub import EventHub
+    from profile_manager import ProfileManager
+    manager = ProfileManager(args.data_dir)
+    result = SessionArchiver(manager, args.idle_hours * 3600, EventHub(args.data_dir)).run()
+    if result is None:
+        print("Another archiver is running")
+        sys.exit(1)
+    print(json.dumps({**result, **manager.archive.stats()}, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+"""
+ASGI(非同期)アプリケーション: LLM待ちでワーカースレッドを占有しないサーバーモード
+
+/api/chat と /api/health、イベント配信(SSE)はイベントループ上で処理し、LM Studioへの
+リクエストは非同期HTTPクライアントで待機する。ファイルI/Oは専用の
+スレッドプールで実行する。それ以外のエンドポイントはFlaskアプリに委譲する
+（エンドポイントとペイロードは同期モードと同じ）。
+
+起動方法:
+    uvicorn asgi_app:application --app-dir backend --host 0.0.0.0 --port 5001
+"""
+
+import asyncio
+import contextvars
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+
+from asgiref.wsgi import WsgiToAsgi
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Match, Route
+
+# 現在のディレクトリをパスに追加
+sys.path.append(os.path.dirname(__file__))
+
+from app import (
+    app as flask_app, interviewer, profile_manager, event_hub, lm_monitor, chat_guard,
+    ChatRequestError, begin_chat_turn, record_assistant_response, complete_chat_turn,
+    chat_result_headers
+)
+from request_guard import ChatGuardError
+from config import STORAGE_EXECUTOR_WORKERS, EVENT_HEARTBEAT_SECONDS, TRACE_ENABLED
+from event_hub import format_sse, parse_last_event_id
+from tracing import start_trace, finish_trace
+from usage import start_meter
+
+# ファイルI/O用スレッドプール
+storage_executor = ThreadPoolExecutor(
+    max_workers=STORAGE_EXECUTOR_WORKERS, thread_name_prefix='storage'
+)
+
+
+async def run_storage(func, *args, **kwargs):
+    """ファイルI/Oを伴う処理をスレッドプールで実行（トレースを引き継ぐ）"""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        storage_executor, partial(context.run, func, *args, **kwargs)
+    )
+
+
+async def health_check(request):
+    """ヘルスチェック（LM Studioの状態はバックグラウンドで確認済みのもの）"""
+    return JSONResponse({'status': 'ok', **lm_monitor.status()})
+
+
+async def health_live(request):
+    """死活確認"""
+    return JSONResponse({'status': 'ok'})
+
+
+async def health_ready(request):
+    """準備完了確認（LM Studioに接続済み・ウォームアップ完了なら200、それ以外は503）"""
+    ready = lm_monitor.ready
+    return JSONResponse({'status': 'ready' if ready else 'not_ready', **lm_monitor.status()},
+                        status_code=200 if ready else 503)
+
+
+async def chat(request):
+    """チャットメッセージを送信（非同期版、重複リクエストの扱いは同期版と同じ）"""
+    data = await request.json()
+    try:
+        ticket = chat_guard.ticket(data.get('session_id'), data.get('message'),
+                                   request.headers.get('idempotency-key'))
+        result = await run_storage(chat_guard.replay, ticket)
+        replayed = result is not None
+        if not replayed:
+            result, replayed = await chat_guard.run_async(
+                ticket, partial(run_chat_turn, data, ticket), run_storage
+            )
+    except ChatGuardError as e:
+        return JSONResponse({'error': e.message}, status_code=e.status)
+
+    status, body = result
+    return JSONResponse(body, status_code=status,
+                        headers=chat_result_headers(status, body, replayed))
+
+
+async def run_chat_turn(data: dict, ticket) -> tuple:
+    """チャットターンを処理（非同期版）"""
+    # リクエストごとのタスクのコンテキストに置くので、終了時に片付ける必要はない
+    meter = start_meter()
+
+    try:
+        turn = await run_storage(
+            begin_chat_turn, data.get('session_id'), data.get('message')
+        )
+    except ChatRequestError as e:
+        return e.to_result()
+
+    turn['meter'] = meter
+    profile = turn['profile']
+
+    # LM Studioからレスポンス取得
+    assistant_response = await interviewer.get_response_async(
+        turn['messages'],
+        profile['character'],
+        profile,
+        turn['category_counts'],
+        turn['empty_categories'],
+        user_id=turn['user_id'],
+        memories=turn['memories']
+    )
+    assistant_response = await run_storage(
+        record_assistant_response, turn, assistant_response
+    )
+
+    # プロファイリングデータ抽出（使用量の上限を超えている場合は省略）
+    extracted_data = [] if turn['over_quota'] else await interviewer.extract_profile_data_async(
+        turn['user_message'],
+        assistant_response,
+        turn['messages'],
+        user_id=turn['user_id']
+    )
+
+    result = 200, await run_storage(
+        complete_chat_turn, turn, extracted_data,
+        data.get('delta', False), data.get('profile_version')
+    )
+    await run_storage(chat_guard.remember, ticket, result)
+    return result
+
+
+async def session_events(request):
+    """セッションのイベントをServer-Sent Eventsで配信（非同期版）"""
+    session_id = request.path_params['session_id']
+    if not await run_storage(profile_manager.get_session_summary, session_id):
+        return JSONResponse({'error': 'Session not found'}, status_code=404)
+
+    last_event_id = parse_last_event_id(
+        request.headers.get('last-event-id') or request.query_params.get('last_event_id')
+    )
+    subscription = event_hub.subscribe(
+        session_id, last_event_id, loop=asyncio.get_running_loop()
+    )
+
+    async def stream():
+        try:
+            yield "retry: 3000\n\n"
+            while not subscription.closed:
+                if await request.is_disconnected():
+                    break
+                events = await subscription.get_async(EVENT_HEARTBEAT_SECONDS)
+                if not events:
+                    yield ": keep-alive\n\n"
+                for event in events:
+                    yield format_sse(event)
+        finally:
+            subscription.close()
+
+    return StreamingResponse(stream(), media_type='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+
+class ServerTimingMiddleware:
+    """ネイティブエンドポイントのトレース（Server-Timing ヘッダーを付与）"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        trace = start_trace(f"{scope['method']} {scope['path']}")
+
+        async def send_with_timing(message):
+            if message['type'] == 'http.response.start':
+                header = finish_trace(trace)
+                if header:
+                    message['headers'] = list(message.get('headers', [])) + [
+                        (b'server-timing', header.encode('latin-1'))
+                    ]
+            await send(message)
+
+        await self.app(scope, receive, send_with_timing)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """起動・終了処理"""
+    yield
+    await interviewer.aclose()
+    storage_executor.shutdown(wait=False)
+
+
+native_routes = [
+    Route('/api/health', health_check, methods=['GET']),
+    Route('/api/health/live', health_live, methods=['GET']),
+    Route('/api/health/ready', health_ready, methods=['GET']),
+    Route('/api/chat', chat, methods=['POST']),
+    Route('/api/session/{session_id}/events', session_events, methods=['GET']),
+]
+
+native_middleware = [
+    Middleware(CORSMiddleware, allow_origins=['*'],
+               allow_methods=['*'], allow_headers=['*'])
+]
+if TRACE_ENABLED:
+    native_middleware.append(Middleware(ServerTimingMiddleware))
+
+native_app = Starlette(
+    routes=native_routes,
+    middleware=native_middleware,
+    lifespan=lifespan
+)
+wsgi_app = WsgiToAsgi(flask_app)
+
+
+def _is_native(scope) -> bool:
+    """非同期で処理するエンドポイントかどうか"""
+    if scope['type'] != 'http':
+        return True  # lifespan など
+    return any(route.matches(scope)[0] != Match.NONE for route in native_routes)
+
+
+async def application(scope, receive, send):
+    """ASGIエントリーポイント"""
+    if _is_native(scope):
+        await native_app(scope, receive, send)
+    else:
+        await wsgi_app(scope, receive, send)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    print("=" * 50)
+    print("Interview System Backend Starting (async mode)...")
+    print("=" * 50)
+    print("LM Studio URL:", interviewer.lm_studio_url)
+    print("Server starting at http://localhost:5001")
+    print("=" * 50)
+
+    uvicorn.run(application, host='0.0.0.0', port=5001)
@@ -5,13 +5,139 @@
 import os
 
 # LM Studio設定
-LM_STUDIO_URL = "http://localhost:1234/v1/chat/completions"
+LM_STUDIO_URL = os.environ.get(
+    "LM_STUDIO_URL", "http://localhost:1234/v1/chat/completions"
+)
 LM_STUDIO_MODEL = "local-model"  # LM Studioでは任意の名前でOK
+LM_PROBE_INTERVAL = 30          # 接続確認の間隔（秒、接続中）
+LM_PROBE_RETRY_INTERVAL = 3     # 接続確認の間隔（秒、未接続時）
+LM_WARMUP_ENABLED = os.environ.get("INTERVIEW_WARMUP") == "1"   # 接続時にプロンプトキャッシュを温める
+
+# LLMリクエストスケジューラー設定（優先度順: 対話, データ抽出, メンテナンス）
+# LM Studioに同時に送るリクエスト数（LM Studioの並列数に合わせる）。スケジューラーはプロセスごとに
+# あるため、ワーカー数（INTERVIEW_WORKERS、gunicorn.conf.py が設定する）で割った数をワーカーごとに使う
+# （ワーカー数がスロット数より多いと合計が上限を超える。gunicorn は起動しない、それ以外は起動時にエラーを記録）
+LLM_TOTAL_SLOTS = int(os.environ.get("INTERVIEW_LLM_SLOTS", "4"))
+LLM_WORKERS = max(1, int(os.environ.get("INTERVIEW_WORKERS", "1")))
+LLM_SLOTS = max(1, LLM_TOTAL_SLOTS // LLM_WORKERS)   # ワーカーごと（ワーカー数の方が多い場合も1）
+LLM_QUEUE_LIMITS = (200, 100, 10)   # 優先度ごとの待ち行列の上限（超えると即座に拒否）
+LLM_QUEUE_TIMEOUTS = (30, 60, 5)    # 優先度ごとの待ち時間の上限（秒）
+
+# 非同期(ASGI)モード設定
+LM_STUDIO_MAX_CONNECTIONS = 100  # LM Studioへの同時接続数の上限
+STORAGE_EXECUTOR_WORKERS = 16    # ファイルI/Oを実行するスレッド数
 
 # データ保存先
-DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
-PROFILES_DIR = os.path.join(DATA_DIR, "profiles")
-SESSIONS_DIR = os.path.join(DATA_DIR, "sessions")
+DATA_DIR = os.environ.get(
+    "INTERVIEW_DATA_DIR", os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
+)
+
+# リクエストトレース設定（Server-Timing ヘッダー・トレースログ）
+TRACE_ENABLED = os.environ.get("INTERVIEW_TRACE") == "1"   # 無効時は計測コードを組み込まない
+TRACE_LOG_PATH = os.path.join(DATA_DIR, "traces.jsonl")
+TRACE_LOG_SAMPLE_RATE = 0.01    # トレースログに記録するリクエストの割合
+TRACE_SLOW_MS = 2000            # これより遅いリクエストは必ず記録
+
+# ログ設定
+LOG_LEVEL = os.environ.get("INTERVIEW_LOG_LEVEL", "INFO")     # DEBUGでLLM応答・抽出データの詳細も出力
+LOG_FORMAT = os.environ.get("INTERVIEW_LOG_FORMAT", "text")   # text / json
+LOG_FILE = os.environ.get("INTERVIEW_LOG_FILE")               # 未設定なら標準エラー出力
+LOG_QUEUE_SIZE = 10000          # 書き出し待ちのログの上限（超えた分は捨てる）
+LOG_DEBUG_SAMPLE_RATE = 1.0     # DEBUGログを出力する割合
+
+# 静的アセット配信（起動時にフィンガープリント付きで事前圧縮）
+FRONTEND_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "frontend")
+ASSET_PIPELINE_ENABLED = True
+ASSET_BUILD_DIR = os.path.join(FRONTEND_DIR, "dist")
+ASSET_URL_PREFIX = "/assets"
+ASSET_EXTENSIONS = (".css", ".js")
+
+# 会話メッセージAPIのページサイズ
+MESSAGES_PAGE_DEFAULT = 50
+MESSAGES_PAGE_MAX = 200
+
+# イベント配信（SSE）設定
+EVENT_HEARTBEAT_SECONDS = 15    # 接続維持用コメントの送信間隔
+EVENT_POLL_SECONDS = 0.5        # 他のワーカープロセスが発行したイベントを確認する間隔
+EVENT_READ_BYTES = 256 * 1024   # 1回に読むイベントログの最大バイト数
+EVENT_RETENTION_SECONDS = 7 * 24 * 3600   # この期間更新されていないイベントログは削除する（0で削除しない）
+EVENT_PURGE_INTERVAL_SECONDS = 3600       # 保持期間を過ぎたイベントログを削除する間隔
+# 同期モード（gthread）では配信の接続がスレッドを占有するため、ワーカーごとの接続数と
+# 1接続の時間を制限する（超えた接続は503、時間切れの接続はクライアントが自動で再接続する）
+EVENT_SYNC_MAX_STREAMS = int(os.environ.get(
+    "INTERVIEW_SYNC_SSE_STREAMS", max(1, int(os.environ.get("INTERVIEW_THREADS", "8")) // 4)
+))
+EVENT_SYNC_STREAM_SECONDS = 300
+
+# 管理API・エクスポート設定
+ADMIN_TOKEN = os.environ.get("INTERVIEW_ADMIN_TOKEN")  # 未設定時はlocalhostからのみ許可
+EXPORT_WORKERS = 4  # ファイル読み込みの並列数
+
+# 再抽出設定（過去の会話を現在の抽出プロンプトで処理し直す）
+REEXTRACT_DIR = os.path.join(DATA_DIR, "reextract")   # 進捗と抽出結果のキャッシュ
+REEXTRACT_CONCURRENCY = 4          # LM Studioへの同時リクエスト数
+REEXTRACT_PROGRESS_SECONDS = 10    # 進捗を表示する間隔
+
+# 分析集計設定
+ANALYTICS_TOPK_CAPACITY = 100   # 項目ごとに追跡する頻出値の数（Space-Saving）
+ANALYTICS_FLUSH_EVENTS = 50     # この件数の更新ごとにファイルへ反映
+ANALYTICS_FLUSH_SECONDS = 10    # 最後の反映からこの秒数が経っていれば反映
+
+# 検索設定
+SEARCH_RESULTS_DEFAULT = 20
+SEARCH_RESULTS_MAX = 100
+SEARCH_COMPACT_MIN_ROWS = 10000   # 置き換えられた行がこれ以上（かつ現在の行数以上）でログを書き直す
+
+# 事実ストア設定（カテゴリー・項目ごとに重複を除いたデータ）
+FACT_INITIAL_CONFIDENCE = 0.5   # 初めて聞いた値の信頼度
+FACT_CONFIRM_WEIGHT = 0.5       # 同じ値をもう一度聞いたとき、残り（1 - 信頼度）のうち上げる割合
+FACT_HISTORY_LIMIT = 10         # 項目ごとに残す以前の値の数
+
+# 過去セッションの想起設定（BM25で関連する事実をプロンプトに入れる）
+RETRIEVAL_ENABLED = True
+RETRIEVAL_TOP_K = 5                    # プロンプトに入れる最大件数
+RETRIEVAL_TOKEN_BUDGET = 120           # 入れる内容の合計の上限（推定トークン数）
+RETRIEVAL_MAX_ITEM_CHARS = 60          # 1件あたりの最大文字数（超えたら切り詰める）
+RETRIEVAL_MESSAGES_PER_SESSION = 100   # 索引に入れる過去セッションごとの発言数（新しい方から）
+RETRIEVAL_CACHE_USERS = 500            # プロセス内に保持するユーザー別索引の数
+
+# LLM使用量設定
+USAGE_DAILY_TOKEN_QUOTA = int(os.environ.get("INTERVIEW_DAILY_TOKEN_QUOTA", "0"))  # ユーザーごとの1日の上限（0で無制限）
+USAGE_RETENTION_DAYS = 31   # ユーザーごとの日別集計を残す日数
+
+# 投機的な事前処理設定（ユーザーの入力中に次の応答のプロンプトをLM Studioに読ませておく）
+SPECULATION_ENABLED = os.environ.get("INTERVIEW_SPECULATION") == "1"
+SPECULATION_MIN_IDLE_SLOTS = 2     # LLMの空きスロットがこれ以上ある場合だけ送る（対話用に残す）
+SPECULATION_TTL_SECONDS = 600      # これより古い事前処理は使わない
+SPECULATION_MAX_SESSIONS = 1000    # 事前処理の結果を保持するセッション数
+SPECULATION_WORKERS = 2            # 事前処理を送るスレッド数
+
+# チャットの重複送信・レート制限設定
+CHAT_RATE_PER_MINUTE = int(os.environ.get("INTERVIEW_CHAT_RATE_PER_MINUTE", "30"))  # ユーザーごと・全ワーカーの合計（0で無制限）
+CHAT_RATE_BURST = 10               # 連続して送れる数（トークンバケットの容量）
+CHAT_JOIN_TIMEOUT_SECONDS = 120    # 同じ内容の処理中のリクエストの結果を待つ最大時間
+CHAT_JOIN_POLL_SECONDS = 0.2       # 別のワーカーが処理中のキーの結果を確認する間隔
+IDEMPOTENCY_TTL_SECONDS = 3600     # Idempotency-Key の結果を返し直す期間
+IDEMPOTENCY_MAX_KEYS = 20          # セッションごとに保持するキーの数（古いものから削除）
+IDEMPOTENCY_MAX_KEY_LENGTH = 255
+
+# マルチプロセス設定
+LOCK_STRIPES = 1024     # ロックファイル数（キーはハッシュで振り分け）
+FSYNC_WRITES = False    # Trueで書き込みごとにfsync（クラッシュ耐性と引き換えに遅くなる）
+SHARD_DEPTH = 2         # profiles/sessions/facts の振り分け階層数（1階層256ディレクトリ、運用中は変更しない）
+
+# セッションのアーカイブ設定（アイドルなセッションを圧縮してセグメントファイルにまとめる）
+ARCHIVE_ENABLED = os.environ.get("INTERVIEW_ARCHIVE", "1") == "1"   # サーバー内で定期的に実行する
+ARCHIVE_IDLE_SECONDS = 24 * 3600          # この秒数以上更新されていないセッションが対象
+ARCHIVE_INTERVAL_SECONDS = 3600           # サーバー内での実行間隔
+ARCHIVE_SEGMENT_BYTES = 64 * 1024 * 1024  # セグメントファイルの最大サイズ
+ARCHIVE_COMPRESS_LEVEL = 6                # zlibの圧縮レベル
+
+# SQLiteストア設定（JSONファイルストアからの移行先）
+SQLITE_PATH = os.environ.get("INTERVIEW_SQLITE_PATH", os.path.join(DATA_DIR, "interview.db"))
+SQLITE_DUAL_WRITE = os.environ.get("INTERVIEW_SQLITE_DUAL_WRITE") == "1"   # JSONとSQLiteの両方に書き込む
+MIGRATION_WORKERS = os.cpu_count() or 4   # 移行ツールの読み込みプロセス数
+MIGRATION_BATCH_USERS = 100               # 1トランザクションで書き込むユーザー数
 
 # キャラクター定義
 CHARACTERS = {
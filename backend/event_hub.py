@@ -0,0 +1,341 @@
+"""
+イベント配信ハブ: バッジ獲得・ステージ変化などをセッションごとにプッシュ配信
+
+- イベントはセッションごとのログ（events/<ab>/<cd>/<session_id>.jsonl）に追記し、
+  購読者はログを末尾から読み進める。/api/chat と配信の接続が別のワーカープロセスでも届く
+- ログの1行目はログごとに異なるトークン。イベントIDは「トークン:ログ内のバイト位置
+  （そのイベントの行の終わり）」で、Last-Event-ID からどのワーカーでも再開できる
+- EVENT_RETENTION_SECONDS 以上更新されていないログは削除する（アーカイブされた
+  セッションのログも削除される）。削除後に届いた古い Last-Event-ID や、読んでいる途中で
+  ログが削除・作り直された購読者には resync イベントを送る
+- 同じプロセス内の発行は購読者をすぐに起こし、他のプロセスの発行は
+  EVENT_POLL_SECONDS ごとのファイルの確認で拾う
+- スレッド（Flask）と asyncio（ASGIモード）の両方の購読者に対応
+"""
+
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Set, Tuple
+
+from config import (
+    DATA_DIR, EVENT_POLL_SECONDS, EVENT_READ_BYTES,
+    EVENT_RETENTION_SECONDS, EVENT_PURGE_INTERVAL_SECONDS
+)
+from storage import ShardedDir
+
+logger = logging.getLogger("interview.events")
+
+# ログの1行目の最大長（{"log": "<トークン>"}）
+HEADER_MAX_BYTES = 64
+
+
+def _parse_header(head: bytes) -> Tuple[Optional[str], int]:
+    """
+    ログの先頭 HEADER_MAX_BYTES バイトからトークンと1行目の長さを読む
+    （空ならNone。トークンの行がない以前のログは "0" と0）
+    """
+    if not head:
+        return None, 0
+    end = head.find(b'\n')
+    token = json.loads(head[:end]).get("log") if end >= 0 else None
+    return (token, end + 1) if token else ("0", 0)
+
+
+def _read_header(f) -> Tuple[Optional[str], int]:
+    f.seek(0)
+    return _parse_header(f.read(HEADER_MAX_BYTES))
+
+
+def _event_id(token: Optional[str], position: int) -> str:
+    return f"{token}:{position}" if token else ""
+
+
+def _resync_event(token: Optional[str], position: int) -> Dict:
+    return {"id": _event_id(token, position), "type": "resync", "data": {}, "time": time.time()}
+
+
+class Subscription:
+    """1接続分の購読（読んでいるログのトークンと読み出し位置を持つ）"""
+
+    def __init__(self, hub: 'EventHub', session_id: str, path: str,
+                 token: Optional[str], position: int, pending: List[Dict], loop=None):
+        self.hub = hub
+        self.session_id = session_id
+        self.closed = False
+        self._path = path
+        self._token = token
+        self._position = position
+        self._pending = pending
+        self._cond = threading.Condition()
+        self._loop = loop
+        self._ready = asyncio.Event() if loop is not None else None
+
+    def _notify(self):
+        """同じプロセスでイベントが発行された"""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._ready.set)
+        else:
+            with self._cond:
+                self._cond.notify()
+
+    def _read(self) -> List[Dict]:
+        """ログの読み出し位置より後のイベント（書き込み途中の行は次回に読む）"""
+        events, self._pending = self._pending, []
+        try:
+            f = open(self._path, 'rb')
+        except FileNotFoundError:
+            if self._token is not None:
+                # ログが削除された（保持期間切れ・アーカイブ）
+                events.append(_resync_event(None, 0))
+                self._token, self._position = None, 0
+            return events
+        with f:
+            if os.fstat(f.fileno()).st_size == self._position:
+                return events
+            token, header_length = _read_header(f)
+            if token is None:
+                return events
+            if token != self._token:
+                if self._token is not None:
+                    # 読んでいる途中でログが削除されて作り直された
+                    events.append(_resync_event(token, header_length))
+                # 購読後に作られたログは先頭から送る
+                self._token, self._position = token, header_length
+            f.seek(self._position)
+            data = f.read(EVENT_READ_BYTES)
+        end = data.rfind(b'\n')
+        for line in data[:end + 1].splitlines(keepends=True):
+            self._position += len(line)
+            event = json.loads(line)
+            event["id"] = _event_id(self._token, self._position)
+            events.append(event)
+        return events
+
+    def get(self, timeout: float) -> List[Dict]:
+        """イベントを待って取り出す（スレッド用、タイムアウト時は空リスト）"""
+        deadline = time.monotonic() + timeout
+        events = self._read()
+        while not events and not self.closed:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            with self._cond:
+                self._cond.wait(min(EVENT_POLL_SECONDS, remaining))
+            events = self._read()
+        return events
+
+    async def get_async(self, timeout: float) -> List[Dict]:
+        """イベントを待って取り出す（asyncio用、タイムアウト時は空リスト）"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        events = self._read()
+        while not events and not self.closed:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(self._ready.wait(), min(EVENT_POLL_SECONDS, remaining))
+            except asyncio.TimeoutError:
+                pass
+            self._ready.clear()
+            events = self._read()
+        return events
+
+    def close(self):
+        """購読を終了"""
+        self.closed = True
+        if self._loop is None:
+            with self._cond:
+                self._cond.notify()
+        self.hub._remove(self)
+
+
+class EventHub:
+    """セッション単位のイベント配信ハブ"""
+
+    def __init__(self, data_dir: str = DATA_DIR):
+        self._dir = ShardedDir(os.path.join(data_dir, "events"))
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def _create_log(self, path: str):
+        """トークンの行だけのログを作る（他のプロセスが先に作っていればそのまま）"""
+        header = json.dumps({"log": uuid.uuid4().hex[:16]}) + "\n"
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            try:
+                os.write(fd, header.encode('utf-8'))
+            finally:
+                os.close(fd)
+            # link は既存のファイルを置き換えないので、1行目は必ずトークンになる
+            os.link(tmp_path, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.unlink(tmp_path)
+
+    def publish(self, session_id: str, event_type: str, data: Dict) -> Dict:
+        """イベントをログに追記して、このプロセスの購読者を起こす"""
+        record = {"type": event_type, "data": data, "time": time.time()}
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode('utf-8')
+        path = self._dir.locate(session_id, ".jsonl", create=True)
+        while True:
+            try:
+                fd = os.open(path, os.O_RDWR | os.O_APPEND)
+                break
+            except FileNotFoundError:
+                self._create_log(path)
+        try:
+            # O_APPEND の1回の書き込みなので、他のプロセスの行と混ざらない
+            os.write(fd, line)
+            position = os.lseek(fd, 0, os.SEEK_CUR)
+            os.lseek(fd, 0, os.SEEK_SET)   # 追記は O_APPEND なので読み出し位置は動かしてよい
+            header = os.read(fd, HEADER_MAX_BYTES)
+        finally:
+            os.close(fd)
+        token, _length = _parse_header(header)
+
+        with self._lock:
+            subscribers = list(self._subscribers.get(session_id, ()))
+        for subscription in subscribers:
+            subscription._notify()
+        return {"id": _event_id(token, position), **record}
+
+    def subscribe(self, session_id: str, last_event_id: Optional[str] = None,
+                  loop=None) -> Subscription:
+        """
+        購読を開始
+        last_event_id を指定すると、それより後のイベントをログから送る。
+        ログにない位置・削除されたログのIDの場合は resync イベントを送り、
+        クライアントに状態の再取得を促す。loop を指定すると asyncio 用の購読になる。
+        """
+        path = self._dir.locate(session_id, ".jsonl")
+        token, size, line_starts = None, 0, None
+        try:
+            with open(path, 'rb') as f:
+                token, header_length = _read_header(f)
+                size = os.fstat(f.fileno()).st_size
+                if token is not None and last_event_id:
+                    line_starts = self._position_in(f, header_length, size, token, last_event_id)
+        except FileNotFoundError:
+            pass
+
+        position, pending = size, []
+        if token is None:
+            position = 0   # ログができたら先頭から送る
+        if last_event_id:
+            if line_starts is not None:
+                position = line_starts
+            else:
+                pending.append(_resync_event(token, position))
+
+        subscription = Subscription(self, session_id, path, token, position, pending, loop)
+        with self._lock:
+            self._subscribers.setdefault(session_id, set()).add(subscription)
+        return subscription
+
+    @staticmethod
+    def _position_in(f, header_length: int, size: int, token: str,
+                     last_event_id: str) -> Optional[int]:
+        """Last-Event-ID がこのログの行の区切りを指していればその位置"""
+        id_token, _sep, value = last_event_id.partition(':')
+        if id_token != token or not value.isdigit():
+            return None
+        position = int(value)
+        if not header_length <= position <= size:
+            return None
+        if position == header_length:
+            return position
+        f.seek(position - 1)
+        return position if f.read(1) == b'\n' else None
+
+    def _remove(self, subscription: Subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.session_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.session_id]
+
+    # ログの削除
+
+    def remove(self, session_id: str, before: Optional[float] = None):
+        """
+        セッションのログを削除（アーカイブ時）
+        before を指定すると、その時刻以降に更新されたログは削除しない
+        """
+        path = self._dir.locate(session_id, ".jsonl")
+        try:
+            if before is None or os.stat(path).st_mtime < before:
+                os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    def purge(self, retention_seconds: float = EVENT_RETENTION_SECONDS) -> int:
+        """
+        retention_seconds 以上更新されていないログを削除し、削除した数を返す
+        （削除と同時に発行されたイベントは失われることがある。購読者には resync が届く）
+        """
+        threshold = time.time() - retention_seconds
+        with self._lock:
+            active = set(self._subscribers)
+        removed = 0
+        for session_id in list(self._dir.iter_keys(".jsonl")):
+            if session_id in active:
+                continue
+            path = self._dir.locate(session_id, ".jsonl")
+            try:
+                if os.stat(path).st_mtime < threshold:
+                    os.unlink(path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+    def start(self):
+        """保持期間を過ぎたログを EVENT_PURGE_INTERVAL_SECONDS ごとに削除するスレッドを開始"""
+        if self._thread is None and EVENT_RETENTION_SECONDS > 0:
+            self._thread = threading.Thread(target=self._loop, name='event-purge', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.wait(EVENT_PURGE_INTERVAL_SECONDS):
+            try:
+                removed = self.purge()
+                if removed:
+                    logger.info("Purged %d idle event logs", removed)
+            except Exception as e:
+                logger.exception("Event log purge failed: %s", e)
+
+    def stats(self) -> Dict:
+        """購読中のセッション数・購読者数（このプロセス）"""
+        with self._lock:
+            return {
+                "channels": len(self._subscribers),
+                "subscribers": sum(len(s) for s in self._subscribers.values())
+            }
+
+
+def format_sse(event: Dict) -> str:
+    """イベントを Server-Sent Events 形式に整形"""
+    return (
+        f"id: {event['id']}\n"
+        f"event: {event['type']}\n"
+        f"data: {json.dumps(event['data'], ensure_ascii=False)}\n\n"
+    )
+
+
+def parse_last_event_id(value: Optional[str]) -> Optional[str]:
+    """Last-Event-ID ヘッダーの値（空なら None。形式は購読開始時に確認する）"""
+    return value.strip() or None if value else None
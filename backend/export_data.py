@@ -0,0 +1,55 @@
+"""
+データエクスポートCLI: 全ユーザーのプロファイル・セッション・抽出データをNDJSONで出力
+
+使い方:
+    python backend/export_data.py -o export.ndjson.gz --gzip
+    python backend/export_data.py --since 2026-01-01 --category 趣味・興味・娯楽
+    python backend/export_data.py --cursor <前回のcursor>   # 中断したところから再開
+"""
+
+import argparse
+import os
+import sys
+
+# 現在のディレクトリをパスに追加
+sys.path.append(os.path.dirname(__file__))
+
+from config import DATA_DIR, EXPORT_WORKERS
+from exporter import ExportFilter, iter_export_records, iter_ndjson
+from profile_manager import ProfileManager
+
+
+def main():
+    parser = argparse.ArgumentParser(description='プロファイル・セッション・抽出データをNDJSONで出力')
+    parser.add_argument('-o', '--output', help='出力ファイル（省略時は標準出力）')
+    parser.add_argument('--gzip', action='store_true', help='gzip圧縮して出力')
+    parser.add_argument('--since', help='この日時以降のセッション・データのみ（ISO形式）')
+    parser.add_argument('--until', help='この日時より前のセッション・データのみ（ISO形式）')
+    parser.add_argument('--category', help='抽出データをこのカテゴリーに限定')
+    parser.add_argument('--messages', action='store_true', help='会話メッセージも出力')
+    parser.add_argument('--cursor', help='このcursorの次のユーザーから再開')
+    parser.add_argument('--workers', type=int, default=EXPORT_WORKERS, help='読み込みの並列数')
+    parser.add_argument('--data-dir', default=DATA_DIR, help='データディレクトリ')
+    args = parser.parse_args()
+
+    try:
+        export_filter = ExportFilter(args.since, args.until, args.category, args.messages)
+    except ValueError as e:
+        parser.error(f"invalid date: {e}")
+
+    profile_manager = ProfileManager(args.data_dir)
+    records = iter_export_records(profile_manager, export_filter, args.cursor, args.workers)
+
+    output = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    try:
+        for chunk in iter_ndjson(records, compress=args.gzip):
+            output.write(chunk)
+    finally:
+        if args.output:
+            output.close()
+        else:
+            output.flush()
+
+
+if __name__ == '__main__':
+    main()
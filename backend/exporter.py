@@ -0,0 +1,144 @@
+"""
+データエクスポート: 全ユーザーのプロファイル・セッション・抽出データをNDJSONでストリーミング出力
+
+ジェネレーターで1ユーザーずつ出力するため、データ量に関わらずメモリ使用量は一定。
+ファイルの読み込みはスレッドプールで先読みする（先読み数は workers * 2 まで）。
+
+出力レコード（1行1JSON）:
+    {"type": "user", "cursor": ..., "profile": {...}}
+    {"type": "session", "cursor": ..., "session": {...}}
+    {"type": "end", "cursor": ..., "users": N}
+cursor は全レコードを出力し終えたユーザーのうち最後のものを表す。中断した場合は、
+最後に受け取った cursor を指定すればその次のユーザーから再開できる。
+"""
+
+import json
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+
+from config import EXPORT_WORKERS
+
+
+def normalize_date(value: Optional[str]) -> Optional[str]:
+    """
+    日付文字列をISO形式に揃える（比較用、不正な値は ValueError）
+    保存されているタイムスタンプはタイムゾーンなしのローカル時刻なので、
+    タイムゾーン付き（末尾の Z を含む）の値はローカル時刻に変換してから揃える
+    """
+    if not value:
+        return None
+    if value.endswith(('Z', 'z')):
+        value = value[:-1] + '+00:00'   # Python 3.10 の fromisoformat は Z を読めない
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed.isoformat()
+
+
+class ExportFilter:
+    """エクスポート対象の絞り込み条件"""
+
+    def __init__(self, since: Optional[str] = None, until: Optional[str] = None,
+                 category: Optional[str] = None, include_messages: bool = False):
+        self.since = normalize_date(since)    # この日時以降（含む）
+        self.until = normalize_date(until)    # この日時より前（含まない）
+        self.category = category
+        self.include_messages = include_messages
+
+    def in_range(self, timestamp: Optional[str]) -> bool:
+        if not timestamp:
+            return self.since is None and self.until is None
+        if self.since and timestamp < self.since:
+            return False
+        if self.until and timestamp >= self.until:
+            return False
+        return True
+
+
+def _load_user_records(profile_manager, user_id: str,
+                       export_filter: ExportFilter) -> List[Dict]:
+    """1ユーザー分のレコードを読み込む（スレッドプールで実行）"""
+    profile = profile_manager.get_user(user_id)
+    if not profile:
+        return []
+
+    records = [{"type": "user", "profile": profile}]
+    for session_id in profile.get("sessions", []):
+        session = profile_manager.get_session(
+            session_id, include_conversation=export_filter.include_messages
+        )
+        if not session or not export_filter.in_range(session.get("date")):
+            continue
+
+        extracted_data = {}
+        for category, data_list in session.get("extracted_data", {}).items():
+            if export_filter.category and category != export_filter.category:
+                continue
+            extracted_data[category] = [
+                entry for entry in data_list
+                if export_filter.in_range(entry.get("timestamp"))
+            ]
+        session["extracted_data"] = extracted_data
+        records.append({"type": "session", "session": session})
+
+    # 日付で絞り込んだ場合、該当セッションのないユーザーは出力しない
+    if len(records) == 1 and (export_filter.since or export_filter.until):
+        return []
+    return records
+
+
+def iter_export_records(profile_manager, export_filter: ExportFilter,
+                        cursor: Optional[str] = None,
+                        workers: int = EXPORT_WORKERS) -> Iterator[Dict]:
+    """エクスポートレコードを順に生成"""
+    user_count = 0
+    last_cursor = cursor
+    window = max(1, workers * 2)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='export') as executor:
+        pending = deque()
+        user_ids = profile_manager.iter_user_ids(after=cursor)
+
+        def submit_next() -> bool:
+            user_id = next(user_ids, None)
+            if user_id is None:
+                return False
+            pending.append((user_id, executor.submit(
+                _load_user_records, profile_manager, user_id, export_filter
+            )))
+            return True
+
+        while len(pending) < window and submit_next():
+            pass
+
+        while pending:
+            user_id, future = pending.popleft()
+            submit_next()
+            records = future.result()
+            if records:
+                user_count += 1
+            # ユーザーの最後のレコードで初めてcursorが進む
+            for i, record in enumerate(records):
+                record["cursor"] = user_id if i == len(records) - 1 else last_cursor
+                yield record
+            last_cursor = user_id
+
+    yield {"type": "end", "cursor": last_cursor, "users": user_count}
+
+
+def iter_ndjson(records: Iterator[Dict], compress: bool = False) -> Iterator[bytes]:
+    """レコードをNDJSONのバイト列に変換（compress=Trueでgzip）"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    for record in records:
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        if compressor:
+            chunk = compressor.compress(line)
+            if chunk:
+                yield chunk
+        else:
+            yield line
+    if compressor:
+        yield compressor.flush()
@@ -0,0 +1,174 @@
+"""
+事実ストア: ユーザーごとの正規化されたプロファイリングデータ
+
+セッションの extracted_data は「いつ何を聞いたか」の記録で、同じ項目
+（例: 基本プロフィール/職業）が話題に出るたびに追加される。事実ストアは
+(カテゴリー, 項目名) ごとに現在の値を1件だけ持ち、追加時に次のように更新する:
+- 新しい項目: 作成（信頼度 FACT_INITIAL_CONFIDENCE）
+- 同じ値: 確認回数と信頼度を上げる
+- 違う値: 以前の値を履歴に移して値を更新（信頼度は初期値に戻す）
+
+ユーザーごとに facts/<ab>/<cd>/<user_id>.json（IDのハッシュで振り分け）に保存する。カテゴリー別データ数・ステージは
+ここの件数（重複を除いた項目数）から計算する。
+"""
+
+import os
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from config import FACT_INITIAL_CONFIDENCE, FACT_CONFIRM_WEIGHT, FACT_HISTORY_LIMIT
+from storage import LockTable, JsonFileCache, ShardedDir, atomic_write_json
+from text_utils import normalize_text
+
+# upsert の結果
+FACT_CREATED = "created"
+FACT_CONFIRMED = "confirmed"
+FACT_UPDATED = "updated"
+
+
+def fact_id(category: str, key: str) -> str:
+    """事実のID（カテゴリーと正規化した項目名）"""
+    return f"{category}/{normalize_text(key)}"
+
+
+class FactStore:
+    """ユーザーごとの事実テーブル"""
+
+    def __init__(self, data_dir: str, locks: LockTable):
+        self.facts_dir = os.path.join(data_dir, "facts")
+        self._dir = ShardedDir(self.facts_dir)
+        self._locks = locks
+        self._cache = JsonFileCache()
+
+    def _path(self, user_id: str) -> str:
+        return self._dir.locate(user_id, ".json")
+
+    def _lock(self, user_id: str):
+        return self._locks.lock(f"facts:{user_id}")
+
+    def exists(self, user_id: str) -> bool:
+        return os.path.exists(self._path(user_id))
+
+    def load(self, user_id: str) -> Dict:
+        """事実テーブルを取得（共有オブジェクトなので変更しないこと）"""
+        table = self._cache.get(self._path(user_id))
+        if table is None:
+            return {"user_id": user_id, "version": 0, "facts": {}}
+        return table
+
+    def create(self, user_id: str):
+        """空の事実テーブルを作成（新規ユーザー用）"""
+        with self._lock(user_id):
+            if not self.exists(user_id):
+                self._save(user_id, {"user_id": user_id, "version": 0, "facts": {}})
+
+    def ensure(self, user_id: str,
+               load_observations: Callable[[], Iterable[Tuple[str, str, str, object, str]]]) -> bool:
+        """
+        事実テーブルがなければ過去の記録から作成（事実ストア導入前のユーザー用）
+        load_observations: (session_id, category, key, value, timestamp) を返す関数
+        Returns: 作成した場合True
+        """
+        if self.exists(user_id):
+            return False
+        with self._lock(user_id):
+            if self.exists(user_id):
+                return False
+            table = {"user_id": user_id, "version": 0, "facts": {}}
+            # 古い順に適用すると最後に聞いた値が現在の値になる
+            for session_id, category, key, value, timestamp in sorted(
+                    load_observations(), key=lambda observation: observation[4]):
+                self._apply(table, session_id, category, key, value, timestamp)
+            self._save(user_id, table)
+        return True
+
+    def upsert(self, user_id: str, session_id: str, category: str,
+               key: str, value, timestamp: Optional[str] = None) -> Tuple[Dict, str]:
+        """
+        事実を追加または更新
+        Returns: (更新後の事実, FACT_CREATED / FACT_CONFIRMED / FACT_UPDATED)
+        """
+        timestamp = timestamp or datetime.now().isoformat()
+        with self._lock(user_id):
+            table = self.load(user_id)
+            table = {**table, "facts": dict(table["facts"])}
+            fact, change = self._apply(table, session_id, category, key, value, timestamp)
+            self._save(user_id, table)
+        return fact, change
+
+    def _apply(self, table: Dict, session_id: str, category: str,
+               key: str, value, timestamp: str) -> Tuple[Dict, str]:
+        """1件分の更新を table に反映（table["facts"] の要素は置き換える）"""
+        facts = table["facts"]
+        fid = fact_id(category, key)
+        current = facts.get(fid)
+
+        if current is None:
+            fact = {
+                "category": category,
+                "key": key,
+                "value": value,
+                "confidence": FACT_INITIAL_CONFIDENCE,
+                "mentions": 1,
+                "first_seen": timestamp,
+                "updated_at": timestamp,
+                "session_id": session_id,
+                "history": []
+            }
+            change = FACT_CREATED
+        elif normalize_text(current["value"]) == normalize_text(value):
+            confidence = current["confidence"] + (1 - current["confidence"]) * FACT_CONFIRM_WEIGHT
+            fact = {
+                **current,
+                "confidence": round(confidence, 4),
+                "mentions": current["mentions"] + 1,
+                "updated_at": timestamp
+            }
+            change = FACT_CONFIRMED
+        else:
+            previous = {
+                "value": current["value"],
+                "confidence": current["confidence"],
+                "session_id": current["session_id"],
+                "until": timestamp
+            }
+            fact = {
+                **current,
+                "key": key,
+                "value": value,
+                "confidence": FACT_INITIAL_CONFIDENCE,
+                "mentions": 1,
+                "updated_at": timestamp,
+                "session_id": session_id,
+                "history": (current["history"] + [previous])[-FACT_HISTORY_LIMIT:]
+            }
+            change = FACT_UPDATED
+
+        facts[fid] = fact
+        return fact, change
+
+    def _save(self, user_id: str, table: Dict):
+        table["version"] = table.get("version", 0) + 1
+        table["updated_at"] = datetime.now().isoformat()
+        atomic_write_json(self._dir.locate(user_id, ".json", create=True), table)
+
+    def list_facts(self, user_id: str, category: Optional[str] = None,
+                   include_history: bool = False) -> List[Dict]:
+        """現在の事実の一覧（カテゴリー、項目名の順）"""
+        facts = []
+        for fid, fact in self.load(user_id)["facts"].items():
+            if category and fact["category"] != category:
+                continue
+            entry = {"id": fid, **fact}
+            if not include_history:
+                entry.pop("history")
+            facts.append(entry)
+        facts.sort(key=lambda fact: fact["id"])
+        return facts
+
+    def counts(self, user_id: str) -> Dict[str, int]:
+        """カテゴリー別の事実数"""
+        counts: Dict[str, int] = {}
+        for fact in self.load(user_id)["facts"].values():
+            counts[fact["category"]] = counts.get(fact["category"], 0) + 1
+        return counts
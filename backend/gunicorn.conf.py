@@ -0,0 +1,40 @@
+"""
+gunicorn設定: マルチプロセス本番モード
+
+起動方法:
+    gunicorn -c backend/gunicorn.conf.py app:app
+
+各ワーカーは同じ data/ ディレクトリを共有する。ProfileManager は
+ファイルロックとrenameによるアトミック書き込みで整合性を保つ。
+"""
+
+import multiprocessing
+import os
+import sys
+
+chdir = os.path.dirname(os.path.abspath(__file__))
+bind = os.environ.get('INTERVIEW_BIND', '0.0.0.0:5001')
+# ワーカーは config.py でワーカー数を読み、LM Studioの同時リクエスト数（INTERVIEW_LLM_SLOTS）を按分する。
+# 各ワーカーは最低1件送るので、ワーカー数はスロット数まで（既定はCPU数とスロット数の小さい方）
+llm_slots = int(os.environ.get('INTERVIEW_LLM_SLOTS', 4))
+workers = int(os.environ.get('INTERVIEW_WORKERS', min(multiprocessing.cpu_count(), llm_slots)))
+if workers > llm_slots:
+    raise SystemExit(
+        f"INTERVIEW_WORKERS ({workers}) exceeds INTERVIEW_LLM_SLOTS ({llm_slots}): "
+        "each worker sends at least one LLM request at a time"
+    )
+os.environ['INTERVIEW_WORKERS'] = str(workers)
+
+# LLM待ちの間も他のリクエストを処理できるようスレッドワーカーを使う
+worker_class = 'gthread'
+threads = int(os.environ.get('INTERVIEW_THREADS', 8))
+timeout = 120
+
+
+def on_starting(server):
+    """静的アセットをマスタープロセスで一度だけ生成（ワーカーは一覧を読むだけ）"""
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from config import ASSET_PIPELINE_ENABLED, FRONTEND_DIR, ASSET_BUILD_DIR
+    from static_assets import AssetPipeline
+    if ASSET_PIPELINE_ENABLED:
+        AssetPipeline(FRONTEND_DIR, ASSET_BUILD_DIR).build()
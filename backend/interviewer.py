@@ -3,12 +3,28 @@
 """
 
 import requests
+import hashlib
 import json
+import logging
 import re
 from typing import Dict, List, Optional
 from config import (
-    LM_STUDIO_URL, LM_STUDIO_MODEL, CHARACTERS, CATEGORIES
+    LM_STUDIO_URL, LM_STUDIO_MODEL, LM_STUDIO_MAX_CONNECTIONS,
+    CHARACTERS, CATEGORIES
 )
+from tracing import traced
+from usage import metered, PURPOSE_REPLY, PURPOSE_EXTRACTION, PURPOSE_HEALTH, PURPOSE_SPECULATION
+from llm_scheduler import (
+    LLMScheduler, PRIORITY_INTERACTIVE, PRIORITY_EXTRACTION, PRIORITY_MAINTENANCE
+)
+
+try:
+    import httpx
+except ImportError:  # 非同期モードを使わない場合は不要
+    httpx = None
+
+logger = logging.getLogger("interview.interviewer")
+extraction_logger = logging.getLogger("interview.extraction")
 
 
 class Interviewer:
@@ -16,23 +32,125 @@ class Interviewer:
 
     def __init__(self):
         self.lm_studio_url = LM_STUDIO_URL
+        self._async_client = None
+        # LM Studioへのリクエストはすべてスケジューラーを通す
+        self.scheduler = LLMScheduler()
+
+    def _get_async_client(self):
+        """非同期HTTPクライアントを取得（初回呼び出し時に生成）"""
+        if httpx is None:
+            raise RuntimeError("httpx is required for async mode")
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=LM_STUDIO_MAX_CONNECTIONS)
+            )
+        return self._async_client
+
+    async def aclose(self):
+        """非同期HTTPクライアントを閉じる"""
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+    def _connection_check_payload(self) -> Dict:
+        """接続確認用のリクエストボディ"""
+        return {
+            "model": LM_STUDIO_MODEL,
+            "messages": [{"role": "user", "content": "test"}],
+            "max_tokens": 10
+        }
 
     def check_lm_studio_connection(self) -> bool:
         """LM Studioへの接続確認"""
         try:
             # 簡単なテストリクエスト
-            response = requests.post(
-                self.lm_studio_url,
-                json={
-                    "model": LM_STUDIO_MODEL,
-                    "messages": [{"role": "user", "content": "test"}],
-                    "max_tokens": 10
-                },
-                timeout=5
-            )
+            with self.scheduler.slot(PRIORITY_MAINTENANCE), metered(PURPOSE_HEALTH) as call:
+                response = requests.post(
+                    self.lm_studio_url,
+                    json=self._connection_check_payload(),
+                    timeout=5
+                )
+                call.read(response)
+            return response.status_code == 200
+        except Exception as e:
+            logger.warning("LM Studio connection error: %s", e)
+            return False
+
+    def list_models(self) -> Optional[List[str]]:
+        """LM Studioのモデル一覧を取得（接続できなければNone）"""
+        models_url = self.lm_studio_url.replace("/chat/completions", "/models")
+        try:
+            with self.scheduler.slot(PRIORITY_MAINTENANCE), metered(PURPOSE_HEALTH):
+                response = requests.get(models_url, timeout=5)
+            if response.status_code != 200:
+                return None
+            return [model.get("id", "") for model in response.json().get("data", [])]
+        except Exception as e:
+            logger.debug("LM Studio discovery failed: %s", e)
+            return None
+
+    def warm_up(self, character_id: str) -> bool:
+        """
+        キャラクターのシステムプロンプトを1トークンだけ生成させて送る
+        固定部分（【現在の状況】より前）が実際の会話と同じなので、プロンプトキャッシュが効く
+        """
+        system_prompt = self.generate_system_prompt(character_id, {}, {}, [])
+        payload = {
+            "model": LM_STUDIO_MODEL,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": "こんにちは"}
+            ],
+            "max_tokens": 1,
+            "stream": False
+        }
+        try:
+            with self.scheduler.slot(PRIORITY_MAINTENANCE), metered(PURPOSE_HEALTH) as call:
+                response = requests.post(self.lm_studio_url, json=payload, timeout=120)
+                call.read(response)
             return response.status_code == 200
         except Exception as e:
-            print(f"LM Studio connection error: {e}")
+            logger.warning("Warm-up failed (%s): %s", character_id, e)
+            return False
+
+    def warm_prefix(self, system_prompt: str, messages: List[Dict]) -> Optional[Dict]:
+        """
+        次の応答のプロンプトの先頭部分（システムプロンプト + 会話履歴）を1トークンだけ生成させて送り、
+        LM Studio側のプロンプトキャッシュに載せておく（空いているスロットがなければ待たずに送らない）
+        Returns: 応答の usage（失敗・拒否した場合はNone）
+        """
+        payload = {
+            "model": LM_STUDIO_MODEL,
+            "messages": [{"role": "system", "content": system_prompt}] + messages,
+            "max_tokens": 1,
+            "temperature": 0.8,
+            "stream": False
+        }
+        try:
+            with self.scheduler.try_slot(PRIORITY_MAINTENANCE), metered(PURPOSE_SPECULATION) as call:
+                response = requests.post(self.lm_studio_url, json=payload, timeout=60)
+                result = call.read(response)
+        except Exception as e:
+            logger.debug("Prefix warm-up skipped: %s", e)
+            return None
+        if result is None:
+            return None
+        return call.usage or {}
+
+    async def check_lm_studio_connection_async(self) -> bool:
+        """LM Studioへの接続確認（非同期版）"""
+        try:
+            async with self.scheduler.slot_async(PRIORITY_MAINTENANCE):
+                with metered(PURPOSE_HEALTH) as call:
+                    response = await self._get_async_client().post(
+                        self.lm_studio_url,
+                        json=self._connection_check_payload(),
+                        timeout=5
+                    )
+                    call.read(response)
+            return response.status_code == 200
+        except Exception as e:
+            logger.warning("LM Studio connection error: %s", e)
             return False
 
     def generate_system_prompt(self, character_id: str, profile: Dict,
@@ -88,10 +206,77 @@ class Interviewer:
 
         return system_prompt
 
+    @staticmethod
+    def memory_block(memories: List[str]) -> str:
+        """過去セッションから選んだ関連する事実（retrieval.MemoryRetriever）の区切られたブロック"""
+        memory_lines = "\n".join(f"- {memory}" for memory in memories)
+        return f"【以前の会話で聞いたこと】（関係があれば自然に触れる）\n{memory_lines}"
+
+    def with_memories(self, system_prompt: str, messages: List[Dict],
+                      memories: Optional[List[str]]) -> tuple:
+        """
+        想起した事実を入れたシステムプロンプトとメッセージ（messages は変更しない）
+        メッセージごとに変わるので最新のユーザー発言の前に付ける。システムプロンプトと
+        それまでの履歴は変わらないのでプロンプトキャッシュが効く（2つ目のシステムメッセージは
+        チャットテンプレートによっては使えない）。末尾がユーザー発言でなければシステムプロンプトの最後に入れる
+        """
+        if not memories:
+            return system_prompt, messages
+        block = self.memory_block(memories)
+        if messages and messages[-1].get("role") == "user":
+            latest = dict(messages[-1])
+            latest["content"] = f"{block}\n\n【ユーザーの発言】\n{latest['content']}"
+            return system_prompt, messages[:-1] + [latest]
+        return f"{system_prompt}\n\n{block}", messages
+
+    def _build_response_payload(self, messages: List[Dict], character_id: str,
+                                profile: Dict, category_counts: Dict[str, int],
+                                empty_categories: List[str],
+                                max_tokens: int,
+                                memories: Optional[List[str]] = None) -> Dict:
+        """応答生成用のリクエストボディを構築"""
+        # システムプロンプトを生成
+        system_prompt = self.generate_system_prompt(
+            character_id, profile, category_counts, empty_categories
+        )
+
+        # メッセージリストを構築
+        system_prompt, messages = self.with_memories(system_prompt, messages, memories)
+        full_messages = [
+            {"role": "system", "content": system_prompt}
+        ] + messages
+
+        return {
+            "model": LM_STUDIO_MODEL,
+            "messages": full_messages,
+            "max_tokens": max_tokens,
+            "temperature": 0.8,
+            "stream": False
+        }
+
+    def _parse_response_result(self, result: Dict) -> str:
+        """LM Studioの応答JSONからアシスタントの発言を取り出す"""
+        assistant_message = result["choices"][0]["message"]["content"]
+
+        logger.debug("LM Studio raw response: %.200s", assistant_message)
+
+        # 内部コメントを除去（一時的に無効化）
+        # cleaned_message = self._clean_response(assistant_message)
+        cleaned_message = assistant_message  # 一時的に無効化
+
+        logger.debug("Cleaned response: %.200s", cleaned_message,
+                     extra={"fields": {"raw_length": len(assistant_message),
+                                       "cleaned_length": len(cleaned_message)}})
+
+        return cleaned_message.strip()
+
+    @traced('llm_reply')
     def get_response(self, messages: List[Dict], character_id: str,
                     profile: Dict, category_counts: Dict[str, int],
                     empty_categories: List[str],
-                    max_tokens: int = 100) -> Optional[str]:
+                    max_tokens: int = 100,
+                    user_id: Optional[str] = None,
+                    memories: Optional[List[str]] = None) -> Optional[str]:
         """
         LM Studioからレスポンスを取得
         Args:
@@ -101,55 +286,61 @@ class Interviewer:
             category_counts: カテゴリー別データ数
             empty_categories: 空のカテゴリーリスト
             max_tokens: 最大トークン数
+            user_id: ユーザーID（スケジューラーでユーザーごとに順番に実行するため）
+            memories: 過去セッションから選んだ関連する事実
         Returns:
             AIの応答テキスト
         """
         try:
-            # システムプロンプトを生成
-            system_prompt = self.generate_system_prompt(
-                character_id, profile, category_counts, empty_categories
+            payload = self._build_response_payload(
+                messages, character_id, profile, category_counts,
+                empty_categories, max_tokens, memories
             )
 
-            # メッセージリストを構築
-            full_messages = [
-                {"role": "system", "content": system_prompt}
-            ] + messages
-
             # LM Studioにリクエスト
-            response = requests.post(
-                self.lm_studio_url,
-                json={
-                    "model": LM_STUDIO_MODEL,
-                    "messages": full_messages,
-                    "max_tokens": max_tokens,
-                    "temperature": 0.8,
-                    "stream": False
-                },
-                timeout=30
-            )
+            with self.scheduler.slot(PRIORITY_INTERACTIVE, user_id), metered(PURPOSE_REPLY) as call:
+                response = requests.post(self.lm_studio_url, json=payload, timeout=30)
+                result = call.read(response)
 
-            if response.status_code == 200:
-                result = response.json()
-                assistant_message = result["choices"][0]["message"]["content"]
+            if result is not None:
+                return self._parse_response_result(result)
+            else:
+                logger.error("LM Studio error: %s", response.status_code)
+                return None
 
-                # デバッグ: 元のメッセージを出力
-                print(f"[DEBUG] LM Studio raw response: {assistant_message[:200]}")
+        except Exception as e:
+            logger.error("Error getting response: %s", e)
+            return None
 
-                # 内部コメントを除去（一時的に無効化）
-                # cleaned_message = self._clean_response(assistant_message)
-                cleaned_message = assistant_message  # 一時的に無効化
+    @traced('llm_reply')
+    async def get_response_async(self, messages: List[Dict], character_id: str,
+                                 profile: Dict, category_counts: Dict[str, int],
+                                 empty_categories: List[str],
+                                 max_tokens: int = 100,
+                                 user_id: Optional[str] = None,
+                                 memories: Optional[List[str]] = None) -> Optional[str]:
+        """LM Studioからレスポンスを取得（非同期版、引数は get_response と同じ）"""
+        try:
+            payload = self._build_response_payload(
+                messages, character_id, profile, category_counts,
+                empty_categories, max_tokens, memories
+            )
 
-                # デバッグ: クリーン後のメッセージを出力
-                print(f"[DEBUG] Cleaned response: {cleaned_message[:200]}")
-                print(f"[DEBUG] Response length - raw: {len(assistant_message)}, cleaned: {len(cleaned_message)}")
+            async with self.scheduler.slot_async(PRIORITY_INTERACTIVE, user_id):
+                with metered(PURPOSE_REPLY) as call:
+                    response = await self._get_async_client().post(
+                        self.lm_studio_url, json=payload, timeout=30
+                    )
+                    result = call.read(response)
 
-                return cleaned_message.strip()
+            if result is not None:
+                return self._parse_response_result(result)
             else:
-                print(f"LM Studio error: {response.status_code}")
+                logger.error("LM Studio error: %s", response.status_code)
                 return None
 
         except Exception as e:
-            print(f"Error getting response: {e}")
+            logger.error("Error getting response: %s", e)
             return None
 
     def _clean_response(self, text: str) -> str:
@@ -241,56 +432,119 @@ class Interviewer:
 
         return questions.get(category, "他に何か教えて！")
 
+    def _build_extraction_payload(self, user_message: str, assistant_response: str,
+                                  conversation_history: List[Dict]) -> Dict:
+        """データ抽出用のリクエストボディを構築"""
+        # データ抽出用プロンプト
+        extraction_prompt = self._create_extraction_prompt(
+            user_message, assistant_response, conversation_history
+        )
+
+        return {
+            "model": LM_STUDIO_MODEL,
+            "messages": [
+                {"role": "system", "content": extraction_prompt},
+                {"role": "user", "content": user_message}
+            ],
+            "max_tokens": 500,
+            "temperature": 0.3,  # 低めで正確性を重視
+            "stream": False
+        }
+
+    def _parse_extraction_result(self, result: Dict, strict: bool = False) -> List[Dict]:
+        """
+        LM Studioの応答JSONから抽出データを取り出す
+        strict のときはJSON配列を読めない応答で ValueError を送出する
+        """
+        extracted_text = result["choices"][0]["message"]["content"]
+
+        extraction_logger.debug("LM Studio response: %s", extracted_text)
+
+        # JSON形式でパース
+        extracted_data = self._parse_extracted_data(extracted_text, strict)
+        extraction_logger.info("Found %d data points", len(extracted_data))
+
+        # 抽出されたデータ（1件ずつ）
+        if extraction_logger.isEnabledFor(logging.DEBUG):
+            for data in extracted_data:
+                extraction_logger.debug("Data", extra={"fields": data})
+
+        return extracted_data
+
+    @traced('llm_extract')
     def extract_profile_data(self, user_message: str, assistant_response: str, 
-                             conversation_history: List[Dict]) -> List[Dict]:
+                             conversation_history: List[Dict],
+                             user_id: Optional[str] = None) -> List[Dict]:
         """
         会話からプロファイリングデータを抽出
         Returns: [{"category": "基本プロフィール", "key": "職業", "value": "エンジニア"}, ...]
         """
         try:
-            # データ抽出用プロンプト
-            extraction_prompt = self._create_extraction_prompt(
-                user_message, assistant_response, conversation_history
+            return self.request_extraction(
+                user_message, assistant_response, conversation_history, user_id=user_id
             )
 
-            # LM Studioにリクエスト
-            response = requests.post(
-                self.lm_studio_url,
-                json={
-                    "model": LM_STUDIO_MODEL,
-                    "messages": [
-                        {"role": "system", "content": extraction_prompt},
-                        {"role": "user", "content": user_message}
-                    ],
-                    "max_tokens": 500,
-                    "temperature": 0.3,  # 低めで正確性を重視
-                    "stream": False
-                },
-                timeout=30
-            )
-
-            if response.status_code == 200:
-                result = response.json()
-                extracted_text = result["choices"][0]["message"]["content"]
+        except requests.HTTPError as e:
+            extraction_logger.error("LM Studio error: %s", e.response.status_code)
+            return []
 
-                # デバッグ: 生のレスポンスを出力
-                print(f"[Extraction] LM Studio response: {extracted_text}")
+        except Exception as e:
+            extraction_logger.error("Error: %s", e)
+            return []
 
-                # JSON形式でパース
-                extracted_data = self._parse_extracted_data(extracted_text)
-                print(f"[Extraction] Found {len(extracted_data)} data points")
+    def request_extraction(self, user_message: str, assistant_response: str = "",
+                           conversation_history: Optional[List[Dict]] = None,
+                           priority: int = PRIORITY_EXTRACTION,
+                           user_id: Optional[str] = None) -> List[Dict]:
+        """
+        データ抽出のリクエストを送る
+        extract_profile_data と違い、失敗時（応答にJSON配列がない場合を含む）は
+        例外を送出する（抽出結果が空の場合と区別するため）
+        """
+        payload = self._build_extraction_payload(
+            user_message, assistant_response, conversation_history or []
+        )
+
+        # LM Studioにリクエスト
+        with self.scheduler.slot(priority, user_id), metered(PURPOSE_EXTRACTION) as call:
+            response = requests.post(self.lm_studio_url, json=payload, timeout=30)
+            result = call.read(response)
+
+        response.raise_for_status()
+        return self._parse_extraction_result(result, strict=True)
+
+    def extraction_prompt_version(self) -> str:
+        """抽出プロンプト（CATEGORIES を含む）とモデルから決まるバージョン"""
+        prompt = self._create_extraction_prompt("", "", [])
+        digest = hashlib.sha1(f"{LM_STUDIO_MODEL}\n{prompt}".encode("utf-8")).hexdigest()
+        return digest[:12]
+
+    @traced('llm_extract')
+    async def extract_profile_data_async(self, user_message: str,
+                                         assistant_response: str,
+                                         conversation_history: List[Dict],
+                                         user_id: Optional[str] = None) -> List[Dict]:
+        """会話からプロファイリングデータを抽出（非同期版）"""
+        try:
+            payload = self._build_extraction_payload(
+                user_message, assistant_response, conversation_history
+            )
 
-                # デバッグ: 抽出されたデータを出力
-                for data in extracted_data:
-                    print(f"[Extraction] Data: {data}")
+            async with self.scheduler.slot_async(PRIORITY_EXTRACTION, user_id):
+                with metered(PURPOSE_EXTRACTION) as call:
+                    response = await self._get_async_client().post(
+                        self.lm_studio_url, json=payload, timeout=30
+                    )
+                    result = call.read(response)
 
-                return extracted_data
+            if result is not None:
+                return self._parse_extraction_result(result)
             else:
-                print(f"[Extraction] LM Studio error: {response.status_code}")
+                extraction_logger.error("LM Studio error: %s", response.status_code)
                 return []
 
         except Exception as e:
-            print(f"[Extraction] Error: {e}")
+            extraction_logger.error("Error: %s", e)
             return []
 
     def _create_extraction_prompt(self, user_message: str, assistant_response: str,
@@ -324,16 +578,19 @@ class Interviewer:
 
         return prompt
 
-    def _parse_extracted_data(self, text: str) -> List[Dict]:
-        """抽出されたテキストからJSONデータをパース"""
+    def _parse_extracted_data(self, text: str, strict: bool = False) -> List[Dict]:
+        """
+        抽出されたテキストからJSONデータをパース
+        strict のときはJSON配列が見つからない・読めない場合に ValueError を送出する
+        """
         try:
-            print(f"[Extraction] Parsing text: {text[:500]}")
+            extraction_logger.debug("Parsing text: %.500s", text)
 
             # JSONブロックを抽出
             json_match = re.search(r"\[.*\]", text, re.DOTALL)
             if json_match:
                 json_str = json_match.group(0)
-                print(f"[Extraction] JSON string: {json_str[:300]}")
+                extraction_logger.debug("JSON string: %.300s", json_str)
 
                 data = json.loads(json_str)
 
@@ -347,17 +604,25 @@ class Interviewer:
                         item["category"] in CATEGORIES):
                         valid_data.append(item)
                     else:
-                        print(f"[Extraction] Invalid item: {item}")
+                        extraction_logger.warning("Invalid item: %s", item)
 
                 return valid_data
             else:
-                print(f"[Extraction] No JSON array found in text")
+                extraction_logger.warning("No JSON array found in text")
+                if strict:
+                    raise ValueError("no JSON array in extraction response")
                 return []
         except json.JSONDecodeError as e:
-            print(f"[Extraction] JSON parse error: {e}")
-            print(f"[Extraction] Problematic text: {text[:500]}")
+            extraction_logger.warning("JSON parse error: %s", e,
+                                      extra={"fields": {"text": text[:500]}})
+            if strict:
+                raise ValueError(f"malformed JSON in extraction response: {e}") from e
             return []
+        except ValueError:
+            raise   # strict で送出したもの
         except Exception as e:
-            print(f"[Extraction] Parse error: {e}")
+            extraction_logger.error("Parse error: %s", e)
+            if strict:
+                raise ValueError(f"unreadable extraction response: {e}") from e
             return []
 
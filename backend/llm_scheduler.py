@@ -0,0 +1,229 @@
+"""
+LLMリクエストスケジューラー: LM Studioへの同時リクエスト数と実行順序を制御
+
+- 同時実行数をLM Studioの並列スロット数に合わせて制限する
+- 優先度クラス: 対話（ユーザーが応答を待っている） > データ抽出 > メンテナンス（接続確認など）
+- 同じ優先度の中ではユーザーごとに順番に実行する（1人の大量リクエストで他が待たされない）
+- 優先度ごとに待ち行列の上限と待ち時間の上限を持ち、超えたリクエストは拒否する
+スレッド（Flask）と asyncio（ASGIモード）の両方から利用できる。
+スケジューラーはプロセスごとに独立している（マルチプロセス時は config.LLM_SLOTS が
+INTERVIEW_LLM_SLOTS をワーカー数 INTERVIEW_WORKERS で割った数になる）。
+"""
+
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, Optional
+
+from config import LLM_SLOTS, LLM_QUEUE_LIMITS, LLM_QUEUE_TIMEOUTS
+from tracing import span
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_EXTRACTION = 1
+PRIORITY_MAINTENANCE = 2
+PRIORITY_NAMES = ("interactive", "extraction", "maintenance")
+
+
+class SchedulerRejected(Exception):
+    """待ち行列が一杯、または待ち時間の上限を超えた"""
+
+    def __init__(self, priority: int, reason: str):
+        super().__init__(f"LLM request rejected ({PRIORITY_NAMES[priority]}: {reason})")
+        self.priority = priority
+        self.reason = reason
+
+
+def _percentile_ms(sorted_values: list, ratio: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * ratio))
+    return round(sorted_values[index] * 1000, 1)
+
+
+class _Waiter:
+    """実行待ちのリクエスト1件"""
+
+    def __init__(self, priority: int, user_key: str, loop=None):
+        self.priority = priority
+        self.user_key = user_key
+        self.enqueued = time.monotonic()
+        self.granted = False
+        self._loop = loop
+        self._event = threading.Event() if loop is None else asyncio.Event()
+
+    def wake(self):
+        if self._loop is None:
+            self._event.set()
+        else:
+            self._loop.call_soon_threadsafe(self._event.set)
+
+
+class _ClassStats:
+    """優先度クラスごとの統計"""
+
+    def __init__(self):
+        self.admitted = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+        self.waits = deque(maxlen=1000)   # 直近の待ち時間（秒）
+
+
+class LLMScheduler:
+    """優先度付きの同時実行制御"""
+
+    def __init__(self, slots: int = LLM_SLOTS):
+        self.slots = slots
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        # 優先度ごとに ユーザー → 待ち行列（先頭のユーザーから順番に実行）
+        self._queues = [OrderedDict() for _ in PRIORITY_NAMES]
+        self._queued = [0] * len(PRIORITY_NAMES)
+        self._stats = [_ClassStats() for _ in PRIORITY_NAMES]
+
+    # --- 待ち行列の操作（self._lock を取得して呼ぶ） ---
+
+    def _enqueue(self, waiter: _Waiter):
+        self._queues[waiter.priority].setdefault(waiter.user_key, deque()).append(waiter)
+        self._queued[waiter.priority] += 1
+
+    def _dequeue(self, waiter: _Waiter):
+        users = self._queues[waiter.priority]
+        queue = users.get(waiter.user_key)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            self._queued[waiter.priority] -= 1
+            if not queue:
+                del users[waiter.user_key]
+
+    def _admit(self, priority: int, waited: float):
+        self.in_flight += 1
+        stats = self._stats[priority]
+        stats.admitted += 1
+        stats.waits.append(waited)
+
+    def _dispatch(self):
+        """空いたスロットを優先度の高い順・ユーザーの順番に割り当てる"""
+        now = time.monotonic()
+        while self.in_flight < self.slots:
+            for priority, users in enumerate(self._queues):
+                if users:
+                    break
+            else:
+                return
+            user_key, queue = next(iter(users.items()))
+            waiter = queue.popleft()
+            self._queued[priority] -= 1
+            if queue:
+                users.move_to_end(user_key)
+            else:
+                del users[user_key]
+            waiter.granted = True
+            self._admit(priority, now - waiter.enqueued)
+            waiter.wake()
+
+    def _try_enter(self, priority: int, user_key: str, loop=None) -> Optional[_Waiter]:
+        """すぐに実行できればNone、待つ必要があれば待ち行列に入れた _Waiter を返す"""
+        with self._lock:
+            if self.in_flight < self.slots and not any(self._queued[:priority + 1]):
+                self._admit(priority, 0.0)
+                return None
+            if self._queued[priority] >= LLM_QUEUE_LIMITS[priority]:
+                self._stats[priority].rejected_full += 1
+                raise SchedulerRejected(priority, "queue full")
+            waiter = _Waiter(priority, user_key, loop)
+            self._enqueue(waiter)
+            return waiter
+
+    def _give_up(self, waiter: _Waiter) -> bool:
+        """待ち時間切れの処理（直前に実行が許可されていればFalse）"""
+        with self._lock:
+            if waiter.granted:
+                return False
+            self._dequeue(waiter)
+            self._stats[waiter.priority].rejected_timeout += 1
+            return True
+
+    def release(self):
+        """実行の終了"""
+        with self._lock:
+            self.in_flight -= 1
+            self._dispatch()
+
+    # --- 公開API ---
+
+    @contextmanager
+    def slot(self, priority: int, user_id: Optional[str] = None):
+        """スロットを取得して実行（スレッド用）"""
+        waiter = self._try_enter(priority, user_id or "")
+        if waiter is not None:
+            with span('llm_queue'):
+                waiter._event.wait(LLM_QUEUE_TIMEOUTS[priority])
+            if self._give_up(waiter):
+                raise SchedulerRejected(priority, "queue timeout")
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def slot_async(self, priority: int, user_id: Optional[str] = None):
+        """スロットを取得して実行（asyncio用）"""
+        waiter = self._try_enter(priority, user_id or "", asyncio.get_running_loop())
+        if waiter is not None:
+            try:
+                with span('llm_queue'):
+                    await asyncio.wait_for(waiter._event.wait(), LLM_QUEUE_TIMEOUTS[priority])
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                # クライアント切断など: 許可済みならスロットを返す
+                if not self._give_up(waiter):
+                    self.release()
+                raise
+            if self._give_up(waiter):
+                raise SchedulerRejected(priority, "queue timeout")
+        try:
+            yield
+        finally:
+            self.release()
+
+    @contextmanager
+    def try_slot(self, priority: int):
+        """空いているスロットがあれば実行（待たない。待ち行列がある・空きがなければ SchedulerRejected）"""
+        with self._lock:
+            if self.in_flight >= self.slots or any(self._queued):
+                raise SchedulerRejected(priority, "busy")
+            self._admit(priority, 0.0)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def idle_slots(self) -> int:
+        """空いているスロット数（待ち行列があれば0）。投機的なリクエストを送るかの判断に使う"""
+        with self._lock:
+            if any(self._queued):
+                return 0
+            return self.slots - self.in_flight
+
+    def stats(self) -> Dict:
+        """待ち行列の長さ・待ち時間などの統計"""
+        with self._lock:
+            classes = {}
+            for priority, name in enumerate(PRIORITY_NAMES):
+                stats = self._stats[priority]
+                waits = sorted(stats.waits)
+                classes[name] = {
+                    "queued": self._queued[priority],
+                    "users_waiting": len(self._queues[priority]),
+                    "admitted": stats.admitted,
+                    "rejected_full": stats.rejected_full,
+                    "rejected_timeout": stats.rejected_timeout,
+                    "wait_ms_avg": round(sum(waits) / len(waits) * 1000, 1) if waits else 0.0,
+                    "wait_ms_p50": _percentile_ms(waits, 0.5),
+                    "wait_ms_p95": _percentile_ms(waits, 0.95),
+                    "wait_ms_max": _percentile_ms(waits, 1.0)
+                }
+            return {"slots": self.slots, "in_flight": self.in_flight, "classes": classes}
@@ -0,0 +1,100 @@
+"""
+LM Studio監視: 接続状態をバックグラウンドで確認し、必要ならモデルをウォームアップ
+
+起動時にLM Studioの応答を待たずにサーバーを立ち上げ、接続確認（モデル一覧の取得）は
+バックグラウンドスレッドで定期的に行う。/api/health は確認済みの状態を返すだけなので
+リクエストごとにLM Studioへ問い合わせない。
+
+ウォームアップ（LM_WARMUP_ENABLED）を有効にすると、接続できた時点で各キャラクターの
+システムプロンプト（固定部分）を送り、LM Studio側のプロンプトキャッシュを温めておく。
+LM Studioが再起動した場合（切断→再接続）も再度ウォームアップする。
+"""
+
+import logging
+import threading
+import time
+from typing import Dict, List, Optional
+
+from config import CHARACTERS, LM_PROBE_INTERVAL, LM_PROBE_RETRY_INTERVAL, LM_WARMUP_ENABLED
+
+logger = logging.getLogger("interview.lm_monitor")
+
+
+class LMStudioMonitor:
+    """LM Studioの接続状態（バックグラウンドで更新）"""
+
+    def __init__(self, interviewer, warmup: bool = LM_WARMUP_ENABLED):
+        self.interviewer = interviewer
+        self.warmup = warmup
+        self.connected: Optional[bool] = None   # 未確認ならNone
+        self.models: List[str] = []
+        self.checked_at: Optional[float] = None
+        self.warmed_up: List[str] = []
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        """監視スレッドを開始（複数回呼んでも1つだけ）"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='lm-monitor', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.check()
+            self._stop.wait(LM_PROBE_INTERVAL if self.connected else LM_PROBE_RETRY_INTERVAL)
+
+    def check(self) -> bool:
+        """接続を確認して状態を更新"""
+        models = self.interviewer.list_models()
+        connected = models is not None
+        was_connected = self.connected
+        self.connected = connected
+        self.models = models or []
+        self.checked_at = time.time()
+
+        if connected and not was_connected:
+            logger.info("LM Studio is connected (models: %s)", ", ".join(self.models) or "-")
+            if self.warmup:
+                self._warm_up()
+        elif not connected and was_connected is not False:
+            logger.warning("LM Studio is not reachable at %s", self.interviewer.lm_studio_url)
+            self.warmed_up = []
+        return connected
+
+    def _warm_up(self):
+        """各キャラクターのシステムプロンプトを送ってプロンプトキャッシュを温める"""
+        warmed = []
+        for character_id in CHARACTERS:
+            started = time.perf_counter()
+            if self.interviewer.warm_up(character_id):
+                warmed.append(character_id)
+                logger.info("Warmed up %s (%.0f ms)", character_id,
+                            (time.perf_counter() - started) * 1000)
+        self.warmed_up = warmed
+
+    @property
+    def ready(self) -> bool:
+        """リクエストを受けられる状態か（LM Studioに接続済み、ウォームアップ有効なら完了済み）"""
+        if not self.connected:
+            return False
+        return not self.warmup or len(self.warmed_up) == len(CHARACTERS)
+
+    def status(self) -> Dict:
+        if self.connected is None:
+            lm_studio = 'unknown'
+        else:
+            lm_studio = 'connected' if self.connected else 'disconnected'
+        return {
+            'lm_studio': lm_studio,
+            'models': self.models,
+            'checked_at': self.checked_at,
+            'warmup': self.warmup,
+            'warmed_up': self.warmed_up
+        }
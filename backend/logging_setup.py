@@ -0,0 +1,129 @@
+"""
+ログ設定: キュー経由の非同期ロギング
+
+- 各モジュールは logging.getLogger("interview.<コンポーネント>") でロガーを取得する
+- ログはキューに入れるだけで、書き出しはバックグラウンドスレッドが行う
+  （出力先が詰まってもリクエストは止まらない。キューが一杯なら捨てて件数を数える）
+- DEBUGログはサンプリングできる（大量に出るLLM応答・抽出データの詳細など）
+- 形式は text / json（1行1JSON、extra={"fields": {...}} の内容も出力）
+- トレースログ（interview.trace）は TRACE_LOG_PATH に別途書き出す
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import threading
+
+from config import (
+    LOG_LEVEL, LOG_FORMAT, LOG_FILE, LOG_QUEUE_SIZE, LOG_DEBUG_SAMPLE_RATE, TRACE_LOG_PATH
+)
+
+ROOT_LOGGER = "interview"
+TRACE_LOGGER = "interview.trace"
+
+_setup_lock = threading.Lock()
+_listener = None
+_queue_handler = None
+
+
+class JsonFormatter(logging.Formatter):
+    """1行1JSONの構造化ログ"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """人が読む形式（fields は key=value で末尾に付ける）"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s [%(name)s] %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            text += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        return text
+
+
+class SamplingFilter(logging.Filter):
+    """DEBUGログを一定の割合だけ通す"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno > logging.DEBUG or self.rate >= 1.0 or random.random() < self.rate
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """キューが一杯なら待たずに捨てる"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging():
+    """ロギングを初期化（複数回呼んでも1回だけ実行）"""
+    global _listener, _queue_handler
+    with _setup_lock:
+        if _listener is not None:
+            return
+
+        if LOG_FILE:
+            output = logging.FileHandler(LOG_FILE, encoding="utf-8")
+        else:
+            output = logging.StreamHandler(sys.stderr)
+        output.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+        output.addFilter(lambda record: record.name != TRACE_LOGGER)
+
+        trace_output = logging.FileHandler(TRACE_LOG_PATH, encoding="utf-8", delay=True)
+        trace_output.setFormatter(logging.Formatter("%(message)s"))
+        trace_output.addFilter(lambda record: record.name == TRACE_LOGGER)
+
+        _queue_handler = _DroppingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+        _queue_handler.addFilter(SamplingFilter(LOG_DEBUG_SAMPLE_RATE))
+
+        logger = logging.getLogger(ROOT_LOGGER)
+        logger.setLevel(LOG_LEVEL.upper())
+        logger.addHandler(_queue_handler)
+        logger.propagate = False
+        # トレースログはログレベルに関係なく記録する
+        logging.getLogger(TRACE_LOGGER).setLevel(logging.INFO)
+
+        _listener = logging.handlers.QueueListener(
+            _queue_handler.queue, output, trace_output, respect_handler_level=True
+        )
+        _listener.start()
+        atexit.register(_shutdown)
+
+
+def _shutdown():
+    """残りのログを書き出して終了（捨てたログがあれば件数を出す）"""
+    _listener.stop()
+    if _queue_handler.dropped:
+        sys.stderr.write(f"[Logging] dropped {_queue_handler.dropped} log records (queue full)\n")
@@ -0,0 +1,176 @@
+"""
+JSONファイルストア（data/profiles, data/sessions）からSQLiteストアへの移行ツール
+
+- ユーザーIDを MIGRATION_BATCH_USERS 件ずつに分け、プロセスプールで並列に読み込む
+- 読み込んだ結果はIDの順にSQLiteへ書き込み、バッチごとに1トランザクションで
+  「最後に書いたユーザーID」（チェックポイント）も保存する
+  → 中断しても再実行すれば続きから移行する（--restart で最初から）
+- 移行後、ユーザーごとのセッション数・メッセージ数・抽出データ数をJSON側と比較する
+
+無停止で切り替える手順:
+    1. INTERVIEW_SQLITE_DUAL_WRITE=1 でサーバーを再起動（以降の書き込みはSQLiteにも反映）
+    2. python backend/migrate.py で既存データを移行・検証
+    3. 検証が通ったら読み込み先を切り替える
+二重書き込み中に検証すると、実行中の書き込みの分だけ一時的に差が出ることがある
+（--verify-only でもう一度検証すればよい）。
+
+使い方:
+    python backend/migrate.py [--target data/interview.db] [--workers 8] [--batch 100]
+    python backend/migrate.py --verify-only
+"""
+
+import argparse
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List
+
+sys.path.append(os.path.dirname(__file__))
+
+from config import DATA_DIR, SQLITE_PATH, MIGRATION_WORKERS, MIGRATION_BATCH_USERS
+from profile_manager import ProfileManager
+from sqlite_store import SqliteStore
+
+CHECKPOINT = "migrate:last_user_id"
+
+# ワーカープロセスごとの ProfileManager
+_manager = None
+
+
+def _init_worker(data_dir: str):
+    global _manager
+    _manager = ProfileManager(data_dir)
+
+
+def _load_users(user_ids: List[str]) -> List[Dict]:
+    """ユーザーのプロファイル・セッション・メッセージを読み込む（ワーカーで実行）"""
+    records = []
+    for user_id in user_ids:
+        profile = _manager.get_user(user_id)
+        if not profile:
+            continue
+        sessions = []
+        for session_id in profile.get("sessions", []):
+            session = _manager.get_session(session_id)
+            if not session:
+                continue
+            messages = session.pop("conversation")
+            # 古い形式のセッションはメッセージ数を持っていない
+            session.setdefault("message_count", len(messages))
+            sessions.append({"session": session, "messages": messages})
+        records.append({"profile": profile, "sessions": sessions})
+    return records
+
+
+def _expected_counts(user_ids: List[str]) -> Dict[str, Dict[str, int]]:
+    """JSON側のセッション数・メッセージ数・抽出データ数（ワーカーで実行）"""
+    counts = {}
+    for user_id in user_ids:
+        profile = _manager.get_user(user_id)
+        if not profile:
+            continue
+        entry = {"sessions": 0, "messages": 0, "data": 0}
+        for session_id in profile.get("sessions", []):
+            summary = _manager.get_session_summary(session_id)
+            if not summary:
+                continue
+            entry["sessions"] += 1
+            entry["messages"] += summary["message_count"]
+            entry["data"] += sum(summary["data_counts"].values())
+        counts[user_id] = entry
+    return counts
+
+
+def _batches(user_ids: Iterator[str], size: int) -> Iterator[List[str]]:
+    batch = []
+    for user_id in user_ids:
+        batch.append(user_id)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _ordered_results(executor, func, batches: Iterator[List[str]], window: int):
+    """バッチを並列に処理し、投入した順に (バッチ, 結果) を返す（先読みは window 件まで）"""
+    pending = deque()
+    for batch in batches:
+        pending.append((batch, executor.submit(func, batch)))
+        if len(pending) >= window:
+            batch, future = pending.popleft()
+            yield batch, future.result()
+    while pending:
+        batch, future = pending.popleft()
+        yield batch, future.result()
+
+
+def migrate(data_dir: str, store: SqliteStore, workers: int, batch_size: int) -> int:
+    """移行を実行（チェックポイントから再開）して移行したユーザー数を返す"""
+    manager = ProfileManager(data_dir)
+    after = store.get_state(CHECKPOINT)
+    if after:
+        print(f"Resuming after user {after}")
+
+    migrated = 0
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(data_dir,)) as executor:
+        batches = _batches(manager.iter_user_ids(after=after), batch_size)
+        for batch, records in _ordered_results(executor, _load_users, batches, workers * 2):
+            store.write_batch(records, checkpoint=(CHECKPOINT, batch[-1]))
+            migrated += len(records)
+            elapsed = time.perf_counter() - started
+            print(f"  {migrated} users ({migrated / elapsed:.0f} users/s), last={batch[-1]}")
+    return migrated
+
+
+def verify(data_dir: str, store: SqliteStore, workers: int, batch_size: int) -> List[Dict]:
+    """ユーザーごとの件数をJSON側と比較して、一致しないものを返す"""
+    manager = ProfileManager(data_dir)
+    mismatches = []
+    checked = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(data_dir,)) as executor:
+        batches = _batches(manager.iter_user_ids(), batch_size)
+        for batch, expected in _ordered_results(executor, _expected_counts, batches, workers * 2):
+            actual = store.counts_for_users(list(expected))
+            for user_id, counts in expected.items():
+                if actual[user_id] != counts:
+                    mismatches.append({"user_id": user_id, "json": counts,
+                                       "sqlite": actual[user_id]})
+            checked += len(expected)
+    print(f"Verified {checked} users, {len(mismatches)} mismatches")
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--data-dir', default=DATA_DIR, help='JSONストアのデータディレクトリ')
+    parser.add_argument('--target', default=SQLITE_PATH, help='移行先のSQLiteファイル')
+    parser.add_argument('--workers', type=int, default=MIGRATION_WORKERS)
+    parser.add_argument('--batch', type=int, default=MIGRATION_BATCH_USERS,
+                        help='1トランザクションで書き込むユーザー数')
+    parser.add_argument('--restart', action='store_true', help='チェックポイントを消して最初から移行')
+    parser.add_argument('--verify-only', action='store_true', help='移行せずに検証だけ行う')
+    args = parser.parse_args()
+
+    store = SqliteStore(args.target)
+    if args.restart:
+        store.delete_state(CHECKPOINT)
+
+    if not args.verify_only:
+        started = time.perf_counter()
+        migrated = migrate(args.data_dir, store, args.workers, args.batch)
+        print(f"Migrated {migrated} users in {time.perf_counter() - started:.1f}s")
+
+    mismatches = verify(args.data_dir, store, args.workers, args.batch)
+    for mismatch in mismatches[:20]:
+        print(f"  {mismatch['user_id']}: json={mismatch['json']} sqlite={mismatch['sqlite']}")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+データモデル: メッセージ・抽出データのメモリ上の表現
+
+ファイルやAPIでは従来どおりの辞書（タイムスタンプはISO形式の文字列）を使い、
+メモリ上では __slots__ のデータクラスで持つ:
+- キー名を辞書ごとに持たないので、1件あたりのメモリが少ない
+- role / expression / category / key の値（文字列のもの）は sys.intern で共有する
+- タイムスタンプはUNIX時間（float）で持つ（ISO文字列より小さく、比較・計算が速い）
+to_dict() の結果は元の辞書と同じ形式なので、APIやセッションJSONの形式は変わらない。
+セッションのメタデータは1件ずつ読み書きするだけで件数も少ないので、辞書のまま扱う。
+
+メッセージログ（<session_id>.jsonl）には、新しいメッセージを配列
+[role, content, UNIX時間(, expression)] で書く（キー名とISO文字列の変換がないので
+読み書きが速く、ファイルも小さい）。以前の辞書形式の行もそのまま読める。
+"""
+
+import sys
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Union
+
+
+def intern_value(value):
+    """文字列なら intern したものを返す"""
+    return sys.intern(value) if type(value) is str else value
+
+
+def to_timestamp(value: Union[str, float, int, None]) -> Optional[float]:
+    """ISO形式の文字列（またはUNIX時間）をUNIX時間に変換"""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    return datetime.fromisoformat(value).timestamp()
+
+
+def to_iso(timestamp: Optional[float]) -> Optional[str]:
+    """UNIX時間をISO形式の文字列（ローカル時刻、datetime.now().isoformat() と同じ形式）に変換"""
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp).isoformat()
+
+
+@dataclass(slots=True)
+class Message:
+    """会話メッセージ1件"""
+    role: str
+    content: str
+    timestamp: Optional[float] = field(default_factory=time.time)
+    expression: Optional[str] = None   # アシスタントの表情
+
+    def __post_init__(self):
+        self.role = sys.intern(self.role)
+        if self.expression is not None:
+            self.expression = sys.intern(self.expression)
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "Message":
+        return cls(data["role"], data["content"],
+                   to_timestamp(data.get("timestamp")), data.get("expression"))
+
+    @classmethod
+    def from_record(cls, record: Union[List, Dict]) -> "Message":
+        """メッセージログの1行（配列または以前の辞書形式）から作る"""
+        if type(record) is list:
+            return cls(*record)
+        return cls.from_dict(record)
+
+    def to_row(self) -> List:
+        """メッセージログに書く形式"""
+        if self.expression is None:
+            return [self.role, self.content, self.timestamp]
+        return [self.role, self.content, self.timestamp, self.expression]
+
+    def to_dict(self) -> Dict:
+        data = {"role": self.role, "content": self.content}
+        if self.timestamp is not None:
+            data["timestamp"] = to_iso(self.timestamp)
+        if self.expression is not None:
+            data["expression"] = self.expression
+        return data
+
+    def to_llm(self) -> Dict:
+        """LLMに送る形式"""
+        return {"role": self.role, "content": self.content}
+
+
+@dataclass(slots=True)
+class DataPoint:
+    """抽出データ1件"""
+    category: str
+    key: str
+    value: Any
+    timestamp: Optional[float] = field(default_factory=time.time)
+
+    def __post_init__(self):
+        self.category = sys.intern(self.category)
+        self.key = intern_value(self.key)       # LLMが数値などを返すこともある
+        self.value = intern_value(self.value)   # 「読書」など同じ値が多い
+
+    @classmethod
+    def from_dict(cls, category: str, data: Dict) -> "DataPoint":
+        return cls(category, data["key"], data["value"], to_timestamp(data.get("timestamp")))
+
+    def to_dict(self) -> Dict:
+        """セッションの extracted_data[category] に入れる形式"""
+        data = {"key": self.key, "value": self.value}
+        if self.timestamp is not None:
+            data["timestamp"] = to_iso(self.timestamp)
+        return data
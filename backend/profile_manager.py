@@ -2,21 +2,102 @@
 プロファイル管理: ユーザープロファイルとセッションデータの保存・読み込み
 """
 
-import json
+import itertools
+import logging
 import os
 import uuid
 from datetime import datetime
-from typing import Dict, List, Optional
-from config import PROFILES_DIR, SESSIONS_DIR, CATEGORIES, HUMAN_STAGES
+from typing import Dict, Iterator, List, Optional
+from config import DATA_DIR, CATEGORIES, HUMAN_STAGES
+from storage import (
+    LockTable, JsonFileCache, MessageLog, ShardedDir, IdManifest, atomic_write_json, read_json
+)
+from fact_store import FactStore, FACT_CREATED, FACT_CONFIRMED, FACT_UPDATED
+from archive import SessionArchive
+from usage import UsageStore, merge_usage
+from request_guard import IdempotencyStore, RateLimiter
+from models import Message, DataPoint
+from text_utils import normalize_text
+from tracing import traced
+
+logger = logging.getLogger("interview.profile")
 
 
 class ProfileManager:
-    """ユーザープロファイルとセッションを管理するクラス"""
+    """
+    ユーザープロファイルとセッションを管理するクラス
+    読み込み→変更→書き込みはキーごとのロック内で行うため、
+    複数ワーカープロセスから同じデータディレクトリを共有できる。
+
+    セッションは <id>.json（メタデータ）と <id>.jsonl / <id>.idx
+    （会話メッセージのログ）に分けて保存する。conversation を
+    JSONに直接持つ古いセッションは、最初のメッセージ追加時にログへ移行する。
+
+    profiles/・sessions/・facts/ のファイルはIDのハッシュで2階層のサブディレクトリ
+    （例: sessions/3f/a2/<id>.json）に振り分ける。振り分け前の配置のファイルも
+    そのまま読み書きできる（reshard.py で振り分け先へ移せる）。ユーザーとセッションの
+    IDは manifest/ の一覧にも記録し、列挙・件数の取得にディレクトリの走査を使わない。
+
+    しばらく更新されていないセッションは archive.py のアーカイバーが圧縮して
+    archive/ のセグメントファイルに移す。ファイルがないセッションはアーカイブから
+    （conversation を持つ古い形式として）読み、書き込むと通常のファイルに戻る。
+
+    抽出データはセッションの extracted_data に記録し、同時にユーザーの事実ストア
+    （facts/<id>.json、カテゴリー・項目ごとに現在の値を1件）を更新する。
+    カテゴリー別データ数とステージは事実ストアの件数から計算する。
+
+    add_listener で登録したオブジェクトには、書き込みのたびに次のメソッドが
+    （定義されていれば）ロック解放後に呼ばれる:
+        on_user_created(profile)
+        on_user_updated(profile)          プロファイルを保存するたび（作成時を除く）
+        on_session_created(session)
+        on_session_updated(session)       セッションJSONを保存するたび（作成・メッセージ追加時を除く）
+        on_message_added(session, seq, message)
+        on_data_added(user_id, session_id, category, key, value, timestamp)
+                                          事実ストアの項目が作成・更新されたとき
+        on_fact_changed(user_id, session_id, fact, change, previous_value)
+                                          同上（change は FACT_CREATED / FACT_UPDATED、
+                                          previous_value は更新前の値、作成時はNone）
+        on_counts_changed(user_id, old_counts, new_counts, old_stage, new_stage)
+        on_badge_added(user_id, badge_name)
+    """
+
+    def __init__(self, data_dir: str = DATA_DIR):
+        self.profiles_dir = os.path.join(data_dir, "profiles")
+        self.sessions_dir = os.path.join(data_dir, "sessions")
 
-    def __init__(self):
         # データディレクトリの作成
-        os.makedirs(PROFILES_DIR, exist_ok=True)
-        os.makedirs(SESSIONS_DIR, exist_ok=True)
+        self._profiles = ShardedDir(self.profiles_dir)
+        self._sessions = ShardedDir(self.sessions_dir)
+
+        self._locks = LockTable(os.path.join(data_dir, "locks"))
+        self.facts = FactStore(data_dir, self._locks)
+        self.archive = SessionArchive(os.path.join(data_dir, "archive"))
+        self.usage = UsageStore(data_dir, self._locks)
+        self.idempotency = IdempotencyStore(data_dir, self._locks)
+        self.rate_limits = RateLimiter(data_dir, self._locks)
+        self.user_manifest = IdManifest(os.path.join(data_dir, "manifest", "users.bin"))
+        self.session_manifest = IdManifest(os.path.join(data_dir, "manifest", "sessions.bin"))
+        for name in ("users", "sessions"):
+            if not self._manifest(name).exists():
+                self.rebuild_manifest(name, only_if_missing=True)
+        self._session_cache = JsonFileCache()
+        self._listeners = []
+
+    def add_listener(self, listener):
+        """書き込みイベントを受け取るリスナーを登録"""
+        self._listeners.append(listener)
+
+    def _notify(self, event: str, *args):
+        """リスナーにイベントを通知（リスナーの例外は書き込みに影響させない）"""
+        for listener in self._listeners:
+            handler = getattr(listener, event, None)
+            if handler is None:
+                continue
+            try:
+                handler(*args)
+            except Exception as e:
+                logger.exception("Listener error (%s): %s", event, e)
 
     def create_user(self, name: str, gender: str, character: str) -> Dict:
         """新規ユーザープロファイルを作成"""
@@ -30,31 +111,70 @@ class ProfileManager:
             "human_stage": 1,
             "badges": [],
             "total_data_count": 0,
+            "category_counts": {cat: 0 for cat in CATEGORIES.keys()},
+            "counts_source": "facts",
             "sessions": []
         }
 
         # プロファイル保存
+        self.facts.create(user_id)
         self._save_profile(user_id, profile)
+        self._add_to_manifest("users", user_id)
+        self._notify("on_user_created", profile)
         return profile
 
+    @traced('pm_read_profile')
     def get_user(self, user_id: str) -> Optional[Dict]:
         """ユーザープロファイルを取得"""
-        profile_path = os.path.join(PROFILES_DIR, f"{user_id}.json")
-        if not os.path.exists(profile_path):
-            return None
-
-        with open(profile_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        return read_json(self._profile_path(user_id))
+
+    def iter_user_ids(self, after: Optional[str] = None) -> Iterator[str]:
+        """全ユーザーIDを昇順に列挙（after より後のIDのみ）"""
+        return self.user_manifest.iter_sorted(after)
+
+    def count_users(self) -> int:
+        return self.user_manifest.count()
+
+    def count_sessions(self) -> int:
+        return self.session_manifest.count()
+
+    def _manifest(self, name: str) -> IdManifest:
+        return self.user_manifest if name == "users" else self.session_manifest
+
+    def _add_to_manifest(self, name: str, item_id: str):
+        # ファイルを保存してから記録するので、一覧のIDには必ずファイルがある
+        with self._locks.lock(f"manifest:{name}"):
+            self._manifest(name).append(item_id)
+
+    def rebuild_manifest(self, name: str, only_if_missing: bool = False) -> int:
+        """
+        ディレクトリを走査して一覧（"users" / "sessions"）を作り直し、件数を返す
+        only_if_missing: 一覧がない場合だけ作る（既存のデータディレクトリの初回起動用）
+        """
+        with self._locks.lock(f"manifest:{name}"):
+            manifest = self._manifest(name)
+            if only_if_missing and manifest.exists():
+                return manifest.count()
+            if name == "users":
+                count = manifest.rebuild(self._profiles.iter_keys(".json"))
+            else:
+                count = manifest.rebuild(itertools.chain(
+                    self._sessions.iter_keys(".json"), self.archive.iter_ids()))
+        logger.info("Rebuilt %s manifest: %d entries", name, count)
+        return count
 
     def update_user(self, user_id: str, updates: Dict) -> Dict:
         """ユーザープロファイルを更新"""
-        profile = self.get_user(user_id)
-        if not profile:
-            raise ValueError(f"User {user_id} not found")
+        with self._lock_profile(user_id):
+            profile = self.get_user(user_id)
+            if not profile:
+                raise ValueError(f"User {user_id} not found")
 
-        profile.update(updates)
-        profile["updated_at"] = datetime.now().isoformat()
-        self._save_profile(user_id, profile)
+            profile.update(updates)
+            profile["updated_at"] = datetime.now().isoformat()
+            self._save_profile(user_id, profile)
+
+        self._notify("on_user_updated", profile)
         return profile
 
     def create_session(self, user_id: str) -> Dict:
@@ -64,7 +184,8 @@ class ProfileManager:
             "session_id": session_id,
             "user_id": user_id,
             "date": datetime.now().isoformat(),
-            "conversation": [],
+            "message_count": 0,
+            "last_message": None,
             "extracted_data": {cat: [] for cat in CATEGORIES.keys()},
             "events_triggered": [],
             "reactions": {
@@ -74,95 +195,357 @@ class ProfileManager:
             }
         }
 
-        # セッション保存
+        # セッション保存（会話はメッセージログに保存する）
         self._save_session(session_id, session)
+        self._add_to_manifest("sessions", session_id)
+        session["conversation"] = []
 
         # ユーザープロファイルにセッションIDを追加
-        profile = self.get_user(user_id)
+        with self._lock_profile(user_id):
+            profile = self.get_user(user_id)
+            if profile:
+                profile["sessions"].append(session_id)
+                self._save_profile(user_id, profile)
+
+        self._notify("on_session_created", session)
         if profile:
-            profile["sessions"].append(session_id)
-            self._save_profile(user_id, profile)
+            self._notify("on_user_updated", profile)
+        return session
 
+    def get_session(self, session_id: str,
+                    include_conversation: bool = True) -> Optional[Dict]:
+        """セッションを取得（include_conversation=False なら会話を読み込まない）"""
+        session = self._load_session_meta(session_id)
+        if not session:
+            return session
+        if not include_conversation:
+            session.pop("conversation", None)
+        elif "conversation" not in session:
+            session["conversation"] = [
+                message.to_dict() for message in self._read_conversation(session_id, session)
+            ]
         return session
 
-    def get_session(self, session_id: str) -> Optional[Dict]:
-        """セッションを取得"""
-        session_path = os.path.join(SESSIONS_DIR, f"{session_id}.json")
-        if not os.path.exists(session_path):
+    def get_conversation(self, session_id: str) -> Optional[List[Message]]:
+        """会話をメッセージモデルのリストで取得（辞書より小さいので、会話全体を保持する場合に使う）"""
+        session = self._load_session_meta(session_id)
+        if not session:
+            return None
+        if "conversation" in session:
+            return [Message.from_dict(record) for record in session["conversation"]]
+        return self._read_conversation(session_id, session)
+
+    def _read_messages(self, session_id: str, start: int = 0,
+                       end: Optional[int] = None) -> List[Message]:
+        """メッセージログの [start, end) をモデルで読み込む"""
+        return [Message.from_record(record)
+                for record in self._message_log(session_id).read(start, end)]
+
+    def _read_conversation(self, session_id: str, session: Dict) -> List[Message]:
+        """
+        会話全体をメッセージログから読み込む
+        セッションJSONを読んだ後にアーカイバーがファイルを消した場合（ログが
+        message_count より短い）はアーカイブから読む
+        """
+        messages = self._read_messages(session_id)
+        if len(messages) < session.get("message_count", 0):
+            conversation = self._archived_conversation(session_id)
+            if conversation is not None:
+                return [Message.from_dict(record) for record in conversation]
+        return messages
+
+    def _archived_conversation(self, session_id: str) -> Optional[List[Dict]]:
+        archived = self._load_archived_session(session_id)
+        return archived["conversation"] if archived else None
+
+    def get_session_summary(self, session_id: str) -> Optional[Dict]:
+        """会話を読み込まずにセッションの概要を取得"""
+        session = self._load_session_meta(session_id)
+        if not session:
             return None
 
-        with open(session_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        if "conversation" in session:
+            # 古い形式のセッション
+            conversation = session["conversation"]
+            message_count = len(conversation)
+            last_message = conversation[-1] if conversation else None
+        else:
+            message_count = session.get("message_count", 0)
+            last_message = session.get("last_message")
+
+        return {
+            "session_id": session["session_id"],
+            "user_id": session["user_id"],
+            "date": session["date"],
+            "updated_at": session.get("updated_at"),
+            "version": session.get("version", 0),
+            "message_count": message_count,
+            "last_message": last_message,
+            "reactions": session["reactions"],
+            "events_triggered": session["events_triggered"],
+            "usage": session.get("usage", {}),
+            "data_counts": {
+                cat: len(data_list)
+                for cat, data_list in session["extracted_data"].items()
+            }
+        }
 
-    def update_session(self, session_id: str, updates: Dict) -> Dict:
-        """セッションを更新"""
-        session = self.get_session(session_id)
+    def get_messages(self, session_id: str, before: Optional[int] = None,
+                     after: Optional[int] = None, limit: int = 50) -> Optional[Dict]:
+        """
+        会話メッセージを範囲指定で取得
+        Args:
+            before: このseqより前のメッセージ（新しい方から limit 件）
+            after: このseqより後のメッセージ（古い方から limit 件）
+            limit: 最大件数
+            どちらも指定しない場合は最新の limit 件
+        Returns: {"messages": [...], "total": int, "has_more": bool}
+        """
+        session = self._load_session_meta(session_id)
         if not session:
-            raise ValueError(f"Session {session_id} not found")
+            return None
 
-        session.update(updates)
-        session["updated_at"] = datetime.now().isoformat()
-        self._save_session(session_id, session)
+        legacy = session.get("conversation")
+        if legacy is None:
+            total = self._message_log(session_id).count()
+            if total < session.get("message_count", 0):
+                # セッションJSONを読んだ後にアーカイブされた
+                legacy = self._archived_conversation(session_id)
+        if legacy is not None:
+            total = len(legacy)
+
+        if after is not None:
+            start = max(0, after + 1)
+            end = min(total, start + limit)
+            has_more = end < total
+        else:
+            end = total if before is None else min(total, max(0, before))
+            start = max(0, end - limit)
+            has_more = start > 0
+
+        if legacy is not None:
+            window = legacy[start:end]
+        else:
+            window = [message.to_dict() for message in self._read_messages(session_id, start, end)]
+            if len(window) < end - start:
+                # 件数を数えた後にアーカイブされた
+                legacy = self._archived_conversation(session_id)
+                if legacy is not None:
+                    window = legacy[start:end]
+
+        messages = []
+        for seq, message in enumerate(window, start):
+            message["seq"] = seq
+            messages.append(message)
+
+        return {"messages": messages, "total": total, "has_more": has_more}
+
+    def update_session(self, session_id: str, updates: Dict) -> Dict:
+        """セッションを更新（会話はメッセージログで管理するため conversation は無視）"""
+        updates = {key: value for key, value in updates.items() if key != "conversation"}
+        with self._lock_session(session_id):
+            session = self._load_session_meta(session_id)
+            if not session:
+                raise ValueError(f"Session {session_id} not found")
+
+            session.update(updates)
+            session["updated_at"] = datetime.now().isoformat()
+            self._save_session(session_id, session)
+
+        self._notify("on_session_updated", session)
         return session
 
-    def add_message(self, session_id: str, role: str, content: str,
-                   expression: str = "normal") -> Dict:
-        """会話メッセージを追加"""
-        session = self.get_session(session_id)
-        if not session:
-            raise ValueError(f"Session {session_id} not found")
+    def increment_reaction(self, session_id: str, reaction_tier: str) -> Dict:
+        """セッションのリアクション回数を加算"""
+        with self._lock_session(session_id):
+            session = self._load_session_meta(session_id)
+            if not session:
+                raise ValueError(f"Session {session_id} not found")
 
-        message = {
-            "role": role,
-            "content": content,
-            "timestamp": datetime.now().isoformat()
-        }
+            session["reactions"][reaction_tier] = session["reactions"].get(reaction_tier, 0) + 1
+            self._save_session(session_id, session)
+
+        self._notify("on_session_updated", session)
+        return session
 
-        if role == "assistant":
-            message["expression"] = expression
+    def add_triggered_event(self, session_id: str, event_name: str) -> Dict:
+        """発動したランダムイベントを記録"""
+        with self._lock_session(session_id):
+            session = self._load_session_meta(session_id)
+            if not session:
+                raise ValueError(f"Session {session_id} not found")
 
-        session["conversation"].append(message)
-        self._save_session(session_id, session)
+            session["events_triggered"].append(event_name)
+            self._save_session(session_id, session)
+
+        self._notify("on_session_updated", session)
+        return session
+
+    def add_message(self, session_id: str, role: str, content: str,
+                   expression: str = "normal") -> Dict:
+        """
+        会話メッセージを追加
+        メッセージはログに追記し、セッションJSONには件数と最新メッセージだけを保存する
+        Returns: 更新後のセッション（conversation を含まない）
+        """
+        with self._lock_session(session_id):
+            session = self._load_session_meta(session_id)
+            if not session:
+                raise ValueError(f"Session {session_id} not found")
+
+            model = Message(role, content, expression=expression if role == "assistant" else None)
+            message = model.to_dict()
+
+            message_log = self._message_log(session_id, create=True)
+            if "conversation" in session:
+                # 古い形式（またはアーカイブから戻した）セッションをメッセージログへ移行
+                message_log.remove()   # 移行・アーカイブの途中で中断した場合の残り
+                message_log.append([Message.from_dict(record).to_row()
+                                    for record in session.pop("conversation")])
+
+            session["message_count"] = message_log.append([model.to_row()])
+            session["last_message"] = message
+            self._save_session(session_id, session)
+
+        self._notify("on_message_added", session, session["message_count"] - 1, message)
         return session
 
     def add_extracted_data(self, session_id: str, category: str,
                           key: str, value: any) -> Dict:
-        """抽出したプロファイリングデータを追加"""
-        session = self.get_session(session_id)
-        if not session:
-            raise ValueError(f"Session {session_id} not found")
+        """
+        抽出したプロファイリングデータを追加
+        セッションには同じ項目・値がまだなければ記録し、事実ストアは常に更新する。
+        データ数・ステージは新しい項目の場合だけ増える。
+        """
+        with self._lock_session(session_id):
+            session = self._load_session_meta(session_id)
+            if not session:
+                raise ValueError(f"Session {session_id} not found")
+
+            if category not in session["extracted_data"]:
+                session["extracted_data"][category] = []
+
+            data_entry = DataPoint(category, key, value).to_dict()
+
+            entries = session["extracted_data"][category]
+            duplicate = any(
+                normalize_text(entry["key"]) == normalize_text(key)
+                and normalize_text(entry["value"]) == normalize_text(value)
+                for entry in entries
+            )
+            if not duplicate:
+                entries.append(data_entry)
+                self._save_session(session_id, session)
+
+        if not duplicate:
+            self._notify("on_session_updated", session)
+        user_id = session["user_id"]
+        self._ensure_facts(user_id)
+        fact, change = self.facts.upsert(user_id, session_id, category, key, value,
+                                         data_entry["timestamp"])
+
+        if change != FACT_CONFIRMED:
+            self._notify("on_data_added", user_id, session_id,
+                         category, key, value, data_entry["timestamp"])
+            previous_value = fact["history"][-1]["value"] if change == FACT_UPDATED else None
+            self._notify("on_fact_changed", user_id, session_id, fact, change, previous_value)
 
-        if category not in session["extracted_data"]:
-            session["extracted_data"][category] = []
+        # ユーザーの総データ数と人間形成ステージを更新
+        if change == FACT_CREATED:
+            self._update_user_stage(user_id, category)
 
-        data_entry = {
-            "key": key,
-            "value": value,
-            "timestamp": datetime.now().isoformat()
-        }
+        return session
 
-        session["extracted_data"][category].append(data_entry)
-        self._save_session(session_id, session)
+    def add_usage(self, user_id: str, session_id: str, usage_by_purpose: Dict[str, Dict]):
+        """LLM使用量（用途別）をセッションの usage とユーザーの集計に加える"""
+        if not usage_by_purpose:
+            return
+        with self._lock_session(session_id):
+            session = self._load_session_meta(session_id)
+            if session:
+                session["usage"] = merge_usage(session.get("usage", {}), usage_by_purpose)
+                self._save_session(session_id, session)
+        if session:
+            self._notify("on_session_updated", session)
+        self.usage.add(user_id, usage_by_purpose)
+
+    def get_usage(self, user_id: str) -> Optional[Dict]:
+        """ユーザーの使用量（累計・日別・上限の状態）"""
+        if not self.get_user(user_id):
+            return None
+        return {**self.usage.load(user_id), "quota": self.usage.quota_status(user_id)}
 
-        # ユーザーの総データ数と人間形成ステージを更新
-        self._update_user_stage(session["user_id"])
+    def get_facts(self, user_id: str, category: Optional[str] = None,
+                  include_history: bool = False) -> Optional[List[Dict]]:
+        """ユーザーの現在の事実（カテゴリー・項目ごとに1件）を取得"""
+        if not self.get_user(user_id):
+            return None
+        self._ensure_facts(user_id)
+        return self.facts.list_facts(user_id, category, include_history)
+
+    def _ensure_facts(self, user_id: str):
+        """事実ストア導入前のユーザーは、全セッションの抽出データから事実ストアを作る"""
+        if self.facts.exists(user_id):
+            return
+
+        def load_observations():
+            profile = self.get_user(user_id) or {"sessions": []}
+            for session_id in profile["sessions"]:
+                session = self._session_cache.get(self._session_path(session_id))
+                if not session:
+                    archived = self.archive.get(session_id)
+                    session = archived["session"] if archived else None
+                if not session:
+                    continue
+                for category, data_list in session["extracted_data"].items():
+                    for entry in data_list:
+                        yield (session_id, category, entry["key"], entry["value"],
+                               entry.get("timestamp", ""))
 
-        return session
+        if self.facts.ensure(user_id, load_observations):
+            logger.info("Built fact store from sessions",
+                        extra={"fields": {"user_id": user_id}})
 
     def get_category_data_count(self, user_id: str) -> Dict[str, int]:
-        """各カテゴリーのデータ数を取得"""
+        """
+        各カテゴリーのデータ数（重複を除いた項目数）を取得
+        プロファイルに保持している集計値を返す（事実ストアから数えた集計値が
+        ない古いプロファイルは、一度だけ数え直して保存する）
+        """
         profile = self.get_user(user_id)
         if not profile:
             return {}
 
-        category_counts = {cat: 0 for cat in CATEGORIES.keys()}
+        if profile.get("counts_source") != "facts":
+            recounted = False
+            # 事実ストアのロックを取るので、プロファイルのロックの外で数える
+            fact_counts = self._count_facts(user_id)
+            with self._lock_profile(user_id):
+                profile = self.get_user(user_id)
+                if profile.get("counts_source") != "facts":
+                    old_counts = profile.get("category_counts", {})
+                    old_stage = profile.get("human_stage", 1)
+                    self._apply_category_counts(profile, fact_counts)
+                    self._save_profile(user_id, profile)
+                    recounted = True
+            if recounted:
+                self._notify("on_user_updated", profile)
+                self._notify("on_counts_changed", user_id, old_counts,
+                             profile["category_counts"], old_stage, profile["human_stage"])
 
-        for session_id in profile["sessions"]:
-            session = self.get_session(session_id)
-            if session:
-                for category, data_list in session["extracted_data"].items():
-                    category_counts[category] += len(data_list)
+        category_counts = {cat: 0 for cat in CATEGORIES.keys()}
+        category_counts.update(profile["category_counts"])
+        return category_counts
 
+    def _count_facts(self, user_id: str) -> Dict[str, int]:
+        """
+        事実ストアからカテゴリー別データ数を数える
+        事実ストアのロックを取ることがあるため、プロファイルのロックを持ったまま呼ばないこと
+        （ロックは入れ子にしない）
+        """
+        self._ensure_facts(user_id)
+        category_counts = {cat: 0 for cat in CATEGORIES.keys()}
+        category_counts.update(self.facts.counts(user_id))
         return category_counts
 
     def get_total_data_count(self, user_id: str) -> int:
@@ -184,35 +567,109 @@ class ProfileManager:
 
     def add_badge(self, user_id: str, badge_name: str) -> Dict:
         """バッジを追加"""
-        profile = self.get_user(user_id)
-        if not profile:
-            raise ValueError(f"User {user_id} not found")
+        with self._lock_profile(user_id):
+            profile = self.get_user(user_id)
+            if not profile:
+                raise ValueError(f"User {user_id} not found")
+
+            added = badge_name not in profile["badges"]
+            if added:
+                profile["badges"].append(badge_name)
+                self._save_profile(user_id, profile)
+
+        if added:
+            self._notify("on_user_updated", profile)
+            self._notify("on_badge_added", user_id, badge_name)
+        return profile
 
-        if badge_name not in profile["badges"]:
-            profile["badges"].append(badge_name)
-            self._save_profile(user_id, profile)
+    def _profile_path(self, user_id: str) -> str:
+        return self._profiles.locate(user_id, ".json")
+
+    def _session_path(self, session_id: str) -> str:
+        return self._sessions.locate(session_id, ".json")
+
+    def session_file_path(self, session_id: str, suffix: str) -> str:
+        """セッションに付随するファイル（例: 再抽出の結果）のパス"""
+        return self._sessions.locate(session_id, suffix, create=True)
+
+    def _message_log(self, session_id: str, create: bool = False) -> MessageLog:
+        # メッセージログはセッションJSONと同じディレクトリにある
+        meta_path = self._sessions.locate(session_id, ".json", create=create)
+        return MessageLog(meta_path[:-len(".json")])
+
+    @traced('pm_read_session')
+    def _load_session_meta(self, session_id: str) -> Optional[Dict]:
+        """
+        セッションJSONだけを読み込む（会話メッセージは読まない）
+        アーカイブ済みのセッションは会話を conversation に入れた古い形式で返す
+        """
+        session = read_json(self._session_path(session_id))
+        if session is None:
+            session = self._load_archived_session(session_id)
+        return session
 
-        return profile
+    def _load_archived_session(self, session_id: str) -> Optional[Dict]:
+        archived = self.archive.get(session_id)
+        if archived is None:
+            return None
+        session = archived["session"]
+        if "conversation" not in session:
+            session["conversation"] = [Message.from_record(record).to_dict()
+                                       for record in archived["messages"]]
+        return session
 
-    def _save_profile(self, user_id: str, profile: Dict):
-        """プロファイルをファイルに保存"""
-        profile_path = os.path.join(PROFILES_DIR, f"{user_id}.json")
-        with open(profile_path, 'w', encoding='utf-8') as f:
-            json.dump(profile, f, ensure_ascii=False, indent=2)
+    def _lock_profile(self, user_id: str):
+        """プロファイルの読み込み→書き込みを排他するロック"""
+        return self._locks.lock(f"profile:{user_id}")
 
-    def _save_session(self, session_id: str, session: Dict):
-        """セッションをファイルに保存"""
-        session_path = os.path.join(SESSIONS_DIR, f"{session_id}.json")
-        with open(session_path, 'w', encoding='utf-8') as f:
-            json.dump(session, f, ensure_ascii=False, indent=2)
+    def _lock_session(self, session_id: str):
+        """セッションの読み込み→書き込みを排他するロック"""
+        return self._locks.lock(f"session:{session_id}")
 
-    def _update_user_stage(self, user_id: str):
-        """ユーザーの人間形成ステージを更新"""
-        total_count = self.get_total_data_count(user_id)
-        new_stage = self.calculate_human_stage(total_count)
+    @traced('pm_write_profile')
+    def _save_profile(self, user_id: str, profile: Dict):
+        """プロファイルをファイルに保存（保存ごとにバージョンを更新）"""
+        profile["version"] = profile.get("version", 0) + 1
+        atomic_write_json(self._profiles.locate(user_id, ".json", create=True), profile)
 
+    @traced('pm_write_session')
+    def _save_session(self, session_id: str, session: Dict):
+        """セッションをファイルに保存（保存ごとにバージョンを更新）"""
+        session["version"] = session.get("version", 0) + 1
+        atomic_write_json(self._sessions.locate(session_id, ".json", create=True), session)
+
+    def _apply_category_counts(self, profile: Dict, category_counts: Dict[str, int]):
+        """カテゴリー別データ数と、そこから決まる総数・ステージをプロファイルに反映"""
+        total_count = sum(category_counts.values())
+        profile["category_counts"] = category_counts
+        profile["counts_source"] = "facts"
+        profile["total_data_count"] = total_count
+        profile["human_stage"] = self.calculate_human_stage(total_count)
+
+    def _update_user_stage(self, user_id: str, category: str):
+        """追加されたデータ1件分の集計を反映し、人間形成ステージを更新"""
         profile = self.get_user(user_id)
-        if profile:
-            profile["human_stage"] = new_stage
-            profile["total_data_count"] = total_count
+        if not profile:
+            return
+        # 古いプロファイルは事実ストアから数え直す（事実ストアのロックを取るのでロックの外で。
+        # 追加済みのデータも事実ストアの件数に含まれる）
+        fact_counts = self._count_facts(user_id) if profile.get("counts_source") != "facts" else None
+
+        with self._lock_profile(user_id):
+            profile = self.get_user(user_id)
+            if not profile:
+                return
+            old_counts = profile.get("category_counts", {})
+            old_stage = profile.get("human_stage", 1)
+            if profile.get("counts_source") == "facts":
+                category_counts = dict(old_counts)
+                category_counts[category] = category_counts.get(category, 0) + 1
+            else:
+                # counts_source は "facts" から戻らないので、ロックの外で数えてある
+                category_counts = fact_counts
+            self._apply_category_counts(profile, category_counts)
             self._save_profile(user_id, profile)
+
+        self._notify("on_user_updated", profile)
+        self._notify("on_counts_changed", user_id, old_counts, category_counts,
+                     old_stage, profile["human_stage"])
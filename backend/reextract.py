@@ -0,0 +1,268 @@
+"""
+再抽出: 過去の会話のユーザー発言を現在の抽出プロンプトで処理し直す
+
+抽出プロンプトや CATEGORIES を変更しても、既存セッションの抽出データは古いプロンプトの
+結果のまま残る。このツールは全セッションのユーザー発言を順に読み、LM Studioで抽出し直して
+sessions/ 以下に <session_id>.extract-<version>.json として保存する
+（元の extracted_data は変更しない）。
+
+- バージョンは抽出プロンプトとモデルから決まる（--version で名前を付けることもできる）
+- 同じ発言は1回だけ抽出する（結果は reextract/<version>/cache.jsonl に保存して再実行でも使う）
+- LM Studioへの同時リクエスト数は --concurrency まで
+- 完了したユーザーを reextract/<version>/state.json に記録し、中断しても再実行すれば続きから
+  処理する（結果ファイルがあるセッションは飛ばす）。抽出に失敗した発言を含むセッションは
+  保存せず、次回の実行で処理し直す
+
+使い方:
+    python backend/reextract.py [--concurrency 4] [--version v2]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+sys.path.append(os.path.dirname(__file__))
+
+from config import (
+    LM_STUDIO_MODEL, REEXTRACT_DIR, REEXTRACT_CONCURRENCY, REEXTRACT_PROGRESS_SECONDS
+)
+from profile_manager import ProfileManager
+from interviewer import Interviewer
+from llm_scheduler import LLMScheduler, PRIORITY_MAINTENANCE
+from storage import atomic_write_json, read_json
+
+MESSAGE_PAGE = 500   # 会話を読み込む単位（メッセージ数）
+
+
+def utterance_key(text: str) -> str:
+    """同じ発言を判定するキー"""
+    return hashlib.sha1(text.strip().encode("utf-8")).hexdigest()
+
+
+def iter_user_turns(manager: ProfileManager, session_id: str) -> Iterator[Tuple[int, str]]:
+    """セッションのユーザー発言を (seq, 本文) で順に返す（ページ単位で読む）"""
+    after = -1
+    while True:
+        page = manager.get_messages(session_id, after=after, limit=MESSAGE_PAGE)
+        if not page or not page["messages"]:
+            return
+        for message in page["messages"]:
+            if message["role"] == "user" and message["content"].strip():
+                yield message["seq"], message["content"]
+        if not page["has_more"]:
+            return
+        after = page["messages"][-1]["seq"]
+
+
+class ReExtractor:
+    """再抽出の実行（1回分）"""
+
+    def __init__(self, manager: ProfileManager, interviewer: Interviewer,
+                 version: str, concurrency: int = REEXTRACT_CONCURRENCY):
+        self.manager = manager
+        self.interviewer = interviewer
+        self.version = version
+        self.prompt_version = interviewer.extraction_prompt_version()
+        self.concurrency = concurrency
+        self.work_dir = os.path.join(REEXTRACT_DIR, version)
+        os.makedirs(self.work_dir, exist_ok=True)
+        self.state_path = os.path.join(self.work_dir, "state.json")
+        self.state = read_json(self.state_path) or {"version": version, "last_user_id": None}
+
+        self._lock = threading.Lock()
+        self.cache: Dict[str, List[Dict]] = self._load_cache()
+        self._cache_file = open(os.path.join(self.work_dir, "cache.jsonl"), "a", encoding="utf-8")
+        self.inflight = {}        # 発言キー → Future
+        self.failed = set()       # この実行で抽出に失敗した発言キー
+        self.cursor_frozen = False
+
+        self.stats = {
+            "users": 0, "sessions_written": 0, "sessions_skipped": 0, "sessions_failed": 0,
+            "turns": 0, "cache_hits": 0, "llm_calls": 0, "llm_errors": 0
+        }
+        self.started = time.perf_counter()
+        self._last_progress = self.started
+
+    def _load_cache(self) -> Dict[str, List[Dict]]:
+        cache = {}
+        path = os.path.join(self.work_dir, "cache.jsonl")
+        if not os.path.exists(path):
+            return cache
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue   # 中断時の書きかけの行
+                cache[entry["key"]] = entry["data"]
+        return cache
+
+    def result_path(self, session_id: str) -> str:
+        return self.manager.session_file_path(session_id, f".extract-{self.version}.json")
+
+    def iter_sessions(self) -> Iterator[Tuple[str, str, bool]]:
+        """前回の続きから (user_id, session_id, ユーザーの最後のセッションか) を返す"""
+        for user_id in self.manager.iter_user_ids(after=self.state.get("last_user_id")):
+            profile = self.manager.get_user(user_id)
+            session_ids = profile.get("sessions", []) if profile else []
+            self.stats["users"] += 1
+            if not session_ids:
+                yield user_id, None, True
+            for i, session_id in enumerate(session_ids):
+                yield user_id, session_id, i == len(session_ids) - 1
+
+    def run(self):
+        pending = deque()   # 投入順のセッション（先頭から結果を書き出す）
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="reextract") as executor:
+            for user_id, session_id, last in self.iter_sessions():
+                entry = {"user_id": user_id, "session_id": session_id, "last": last,
+                         "turns": [], "futures": []}
+                if session_id and os.path.exists(self.result_path(session_id)):
+                    self.stats["sessions_skipped"] += 1
+                    entry["session_id"] = None
+                elif session_id:
+                    self._submit_session(executor, entry)
+                pending.append(entry)
+
+                # 実行待ちが多すぎる場合は先頭のセッションの完了を待つ
+                while pending and (len(self.inflight) >= self.concurrency * 4
+                                   or len(pending) >= self.concurrency * 16
+                                   or self._is_ready(pending[0])):
+                    self._finish(pending.popleft())
+                self._report_progress()
+
+            while pending:
+                self._finish(pending.popleft())
+
+        self._cache_file.close()
+        self._save_state()
+        self._report_progress(final=True)
+
+    def _submit_session(self, executor, entry: Dict):
+        for seq, text in iter_user_turns(self.manager, entry["session_id"]):
+            key = utterance_key(text)
+            entry["turns"].append((seq, key))
+            self.stats["turns"] += 1
+            with self._lock:
+                if key in self.cache:
+                    self.stats["cache_hits"] += 1
+                    continue
+                if key in self.failed:
+                    continue   # この実行では再試行しない（セッションは失敗として扱う）
+                future = self.inflight.get(key)
+                if future is None:
+                    future = executor.submit(self._extract, key, text)
+                    self.inflight[key] = future
+                else:
+                    self.stats["cache_hits"] += 1
+            entry["futures"].append(future)
+
+    def _extract(self, key: str, text: str):
+        """1発言を抽出してキャッシュに保存（ワーカースレッドで実行）"""
+        try:
+            data = self.interviewer.request_extraction(text, priority=PRIORITY_MAINTENANCE)
+        except Exception as e:
+            with self._lock:
+                self.stats["llm_errors"] += 1
+                self.failed.add(key)
+                self.inflight.pop(key, None)
+            raise RuntimeError(f"extraction failed: {e}") from e
+
+        with self._lock:
+            self.stats["llm_calls"] += 1
+            self.cache[key] = data
+            self._cache_file.write(json.dumps({"key": key, "data": data}, ensure_ascii=False) + "\n")
+            self._cache_file.flush()
+            self.inflight.pop(key, None)
+        return data
+
+    def _is_ready(self, entry: Dict) -> bool:
+        return all(future.done() for future in entry["futures"])
+
+    def _finish(self, entry: Dict):
+        """セッションの抽出結果を書き出し、ユーザーの処理が終わっていれば進捗を進める"""
+        for future in entry["futures"]:
+            future.exception()   # 完了を待つ
+
+        if entry["session_id"]:
+            if any(key in self.failed or key not in self.cache for _seq, key in entry["turns"]):
+                self.stats["sessions_failed"] += 1
+                # 失敗したセッションを次回処理し直せるよう、以降は進捗を進めない
+                self.cursor_frozen = True
+            else:
+                self._write_result(entry)
+
+        if entry["last"] and not self.cursor_frozen:
+            self.state["last_user_id"] = entry["user_id"]
+
+    def _write_result(self, entry: Dict):
+        extracted_data: Dict[str, List[Dict]] = {}
+        for seq, key in entry["turns"]:
+            for item in self.cache[key]:
+                extracted_data.setdefault(item["category"], []).append({
+                    "key": item["key"], "value": item["value"], "seq": seq
+                })
+
+        summary = self.manager.get_session_summary(entry["session_id"]) or {}
+        atomic_write_json(self.result_path(entry["session_id"]), {
+            "session_id": entry["session_id"],
+            "user_id": entry["user_id"],
+            "version": self.version,
+            "prompt_version": self.prompt_version,
+            "model": LM_STUDIO_MODEL,
+            "source_version": summary.get("version"),
+            "created_at": datetime.now().isoformat(),
+            "extracted_data": extracted_data
+        })
+        self.stats["sessions_written"] += 1
+
+    def _save_state(self):
+        self.state["updated_at"] = datetime.now().isoformat()
+        self.state["prompt_version"] = self.prompt_version
+        atomic_write_json(self.state_path, self.state)
+
+    def _report_progress(self, final: bool = False):
+        now = time.perf_counter()
+        if not final and now - self._last_progress < REEXTRACT_PROGRESS_SECONDS:
+            return
+        self._last_progress = now
+        self._save_state()
+
+        elapsed = max(now - self.started, 1e-9)
+        stats = self.stats
+        print(f"[{'done' if final else 'progress'}] {elapsed:.0f}s users={stats['users']} "
+              f"sessions={stats['sessions_written']} (skipped {stats['sessions_skipped']}, "
+              f"failed {stats['sessions_failed']}) turns={stats['turns']} "
+              f"({stats['turns'] / elapsed:.1f}/s) llm_calls={stats['llm_calls']} "
+              f"({stats['llm_calls'] / elapsed:.1f}/s, errors {stats['llm_errors']}) "
+              f"dedup_hits={stats['cache_hits']} in_flight={len(self.inflight)}", flush=True)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--version', help='結果のバージョン名（省略時は抽出プロンプトのハッシュ）')
+    parser.add_argument('--concurrency', type=int, default=REEXTRACT_CONCURRENCY,
+                        help='LM Studioへの同時リクエスト数')
+    args = parser.parse_args(argv)
+
+    interviewer = Interviewer()
+    # このプロセスのLM Studioへのリクエストは再抽出だけなので、同時実行数を合わせる
+    interviewer.scheduler = LLMScheduler(slots=args.concurrency)
+    version = args.version or interviewer.extraction_prompt_version()
+    print(f"Re-extracting with version {version}", flush=True)
+
+    extractor = ReExtractor(ProfileManager(), interviewer, version, args.concurrency)
+    extractor.run()
+    sys.exit(1 if extractor.stats["sessions_failed"] else 0)
+
+
+if __name__ == '__main__':
+    main()
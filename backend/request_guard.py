@@ -0,0 +1,387 @@
+"""
+チャットリクエストの重複処理とレート制限
+
+音声認識の自動送信・クライアントの再送・二重クリックで同じ /api/chat が重なると、
+そのたびにLLM呼び出し2回とセッションの書き込みが発生する。次の3つで防ぐ:
+
+- 同時実行の合流（single-flight）: 同じセッション・同じ内容（Idempotency-Key があれば
+  同じキー）のリクエストが処理中なら、新しく処理せずにその結果を待って返す
+- Idempotency-Key: 処理済みのキーで再送されたら、保存しておいた結果を返す
+  （idempotency/<ab>/<cd>/<session_id>.json、IDEMPOTENCY_TTL_SECONDS の間。
+  セッションをアーカイブするときに削除する）。
+  同じキーで内容が違う場合は422
+- レート制限: ユーザーごとのトークンバケット（CHAT_RATE_PER_MINUTE / CHAT_RATE_BURST）。
+  超えたリクエストは429（Retry-After 付き）。合流・返し直しはLLMを使わないので数えない
+
+Idempotency-Key 付きのリクエストは、処理を始める前にキーを「処理中」としてファイルに記録する。
+別のワーカーに届いた同じキーのリクエストはその記録を見て、結果が保存されるまで
+CHAT_JOIN_POLL_SECONDS ごとに確認して待つ（処理中の記録は CHAT_JOIN_TIMEOUT_SECONDS で
+期限切れになるので、処理していたワーカーが落ちても再送で処理し直せる）。
+キーのないリクエストの合流はプロセス内だけで行う。
+バケットは ratelimit/<ab>/<cd>/<user_id>.json に保存するので、上限は全ワーカーの合計になる。
+"""
+
+import asyncio
+import concurrent.futures
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, Optional, Tuple
+
+from config import (
+    CHAT_RATE_PER_MINUTE, CHAT_RATE_BURST, CHAT_JOIN_TIMEOUT_SECONDS, CHAT_JOIN_POLL_SECONDS,
+    IDEMPOTENCY_TTL_SECONDS, IDEMPOTENCY_MAX_KEYS, IDEMPOTENCY_MAX_KEY_LENGTH
+)
+from storage import LockTable, JsonFileCache, ShardedDir, atomic_write_json, read_json
+
+# (HTTPステータス, レスポンスボディ)
+ChatResult = Tuple[int, Dict]
+
+
+class ChatGuardError(Exception):
+    """Idempotency-Key のエラー（HTTPステータス付き）"""
+
+    def __init__(self, message: str, status: int):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+class RateLimiter:
+    """ユーザーごとのトークンバケット（全ワーカーで共有）"""
+
+    def __init__(self, data_dir: str, locks: LockTable,
+                 rate_per_minute: int = CHAT_RATE_PER_MINUTE, burst: int = CHAT_RATE_BURST):
+        self._dir = ShardedDir(os.path.join(data_dir, "ratelimit"))
+        self._locks = locks
+        self.rate = rate_per_minute / 60.0
+        self.burst = max(1, burst)
+
+    def acquire(self, user_id: str) -> float:
+        """1回分を消費する。消費できれば0、できなければ次に送れるまでの秒数"""
+        if self.rate <= 0:
+            return 0.0
+        with self._locks.lock(f"ratelimit:{user_id}"):
+            path = self._dir.locate(user_id, ".json", create=True)
+            now = time.time()
+            bucket = read_json(path)
+            if bucket is None:
+                tokens = float(self.burst)
+            else:
+                elapsed = max(0.0, now - bucket["updated"])   # 時計が戻った場合は補充しない
+                tokens = min(self.burst, bucket["tokens"] + elapsed * self.rate)
+            if tokens < 1.0:
+                return (1.0 - tokens) / self.rate
+            atomic_write_json(path, {"tokens": tokens - 1.0, "updated": now}, indent=None)
+            return 0.0
+
+
+class IdempotencyStore:
+    """
+    セッションごとの Idempotency-Key と結果
+    処理中のキーは status が None の記録（CHAT_JOIN_TIMEOUT_SECONDS を過ぎたら無効）
+    """
+
+    def __init__(self, data_dir: str, locks: LockTable):
+        self._dir = ShardedDir(os.path.join(data_dir, "idempotency"))
+        self._locks = locks
+        self._cache = JsonFileCache()
+
+    def _load(self, session_id: str) -> Dict:
+        """保存済みのキー（共有オブジェクトなので変更しないこと）"""
+        table = self._cache.get(self._dir.locate(session_id, ".json"))
+        return table["keys"] if table else {}
+
+    @staticmethod
+    def _live(record: Optional[Dict], now: float) -> bool:
+        if record is None:
+            return False
+        ttl = CHAT_JOIN_TIMEOUT_SECONDS if record["status"] is None else IDEMPOTENCY_TTL_SECONDS
+        return now - record["created"] <= ttl
+
+    def get(self, session_id: str, key: str) -> Optional[Dict]:
+        """処理済み・処理中のキーの記録"""
+        record = self._load(session_id).get(key)
+        return record if self._live(record, time.time()) else None
+
+    def claim(self, session_id: str, key: str, fingerprint: str) -> Optional[Dict]:
+        """
+        キーを処理中として記録する
+        Returns: 記録できればNone、すでに処理済み・処理中ならその記録
+        """
+        record = self.get(session_id, key)
+        if record is not None:
+            return record
+        with self._locks.lock(f"idempotency:{session_id}"):
+            record = self.get(session_id, key)
+            if record is None:
+                self._write(session_id, key, {"fingerprint": fingerprint, "status": None,
+                                              "body": None, "created": time.time()})
+            return record
+
+    def put(self, session_id: str, key: str, fingerprint: str, status: int, body: Dict):
+        with self._locks.lock(f"idempotency:{session_id}"):
+            self._write(session_id, key, {"fingerprint": fingerprint, "status": status,
+                                          "body": body, "created": time.time()})
+
+    def release(self, session_id: str, key: str, fingerprint: str):
+        """処理中の記録を消す（処理に失敗した。再送で処理し直せるようにする）"""
+        with self._locks.lock(f"idempotency:{session_id}"):
+            record = self._load(session_id).get(key)
+            if record is not None and record["status"] is None and record["fingerprint"] == fingerprint:
+                self._write(session_id, key, None)
+
+    def remove(self, session_id: str):
+        """セッションの記録を削除（アーカイブ時。有効な記録が残っていれば削除しない）"""
+        with self._locks.lock(f"idempotency:{session_id}"):
+            now = time.time()
+            if any(self._live(record, now) for record in self._load(session_id).values()):
+                return
+            path = self._dir.locate(session_id, ".json")
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            self._cache.invalidate(path)
+
+    def _write(self, session_id: str, key: str, record: Optional[Dict]):
+        """キーの記録を置き換えて保存（record が None なら削除、ロックを取得して呼ぶ）"""
+        now = time.time()
+        keys = {
+            k: existing for k, existing in self._load(session_id).items()
+            if k != key and self._live(existing, now)
+        }
+        if record is not None:
+            keys[key] = record
+        # 挿入順なので古いものから削除
+        for k in list(keys)[:max(0, len(keys) - IDEMPOTENCY_MAX_KEYS)]:
+            del keys[k]
+        atomic_write_json(self._dir.locate(session_id, ".json", create=True),
+                          {"session_id": session_id, "keys": keys})
+
+
+class ChatTicket:
+    """1リクエスト分の重複判定の情報"""
+
+    __slots__ = ('session_id', 'idempotency_key', 'fingerprint', 'flight_key')
+
+    def __init__(self, session_id, message, idempotency_key: Optional[str]):
+        self.session_id = session_id
+        self.idempotency_key = idempotency_key
+        self.fingerprint = hashlib.sha1(str(message).encode('utf-8')).hexdigest()
+        if idempotency_key:
+            self.flight_key = f"{session_id}\0key\0{idempotency_key}\0{self.fingerprint}"
+        else:
+            self.flight_key = f"{session_id}\0msg\0{self.fingerprint}"
+
+
+class ChatGuard:
+    """/api/chat の合流・Idempotency-Key・レート制限"""
+
+    def __init__(self, idempotency: IdempotencyStore, limiter: RateLimiter):
+        self.idempotency = idempotency
+        self.limiter = limiter
+        self._flights: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "joined": 0, "joined_other_worker": 0, "replayed": 0,
+                       "rate_limited": 0, "key_mismatch": 0, "join_timeouts": 0}
+
+    def ticket(self, session_id, message, idempotency_key: Optional[str]) -> ChatTicket:
+        """リクエストの重複判定の情報を作る（キーが長すぎる場合は400）"""
+        if idempotency_key is not None and len(idempotency_key) > IDEMPOTENCY_MAX_KEY_LENGTH:
+            raise ChatGuardError(
+                f"Idempotency-Key must be at most {IDEMPOTENCY_MAX_KEY_LENGTH} characters", 400
+            )
+        with self._lock:
+            self._stats["requests"] += 1
+        return ChatTicket(session_id, message, idempotency_key or None)
+
+    def replay(self, ticket: ChatTicket) -> Optional[ChatResult]:
+        """処理済みの Idempotency-Key なら保存した結果（同じキーで内容が違えば422）"""
+        if not ticket.idempotency_key or not ticket.session_id:
+            return None
+        record = self.idempotency.get(ticket.session_id, ticket.idempotency_key)
+        if record is None:
+            return None
+        self._check_fingerprint(ticket, record)
+        if record["status"] is None:
+            return None   # 処理中（run で待つ）
+        with self._lock:
+            self._stats["replayed"] += 1
+        return record["status"], record["body"]
+
+    def _check_fingerprint(self, ticket: ChatTicket, record: Dict):
+        if record["fingerprint"] != ticket.fingerprint:
+            with self._lock:
+                self._stats["key_mismatch"] += 1
+            raise ChatGuardError('Idempotency-Key was used with a different message', 422)
+
+    def remember(self, ticket: ChatTicket, result: ChatResult):
+        """成功した結果を保存（エラーは再送で処理し直せるよう保存しない）"""
+        status, body = result
+        if ticket.idempotency_key and status == 200:
+            self.idempotency.put(ticket.session_id, ticket.idempotency_key,
+                                 ticket.fingerprint, status, body)
+
+    def record_rate_limited(self):
+        with self._lock:
+            self._stats["rate_limited"] += 1
+
+    # 同時実行の合流
+
+    def _begin(self, ticket: ChatTicket) -> Tuple[Future, bool]:
+        """処理中のリクエストがあればその Future、なければ新しい Future と True（処理する側）"""
+        with self._lock:
+            future = self._flights.get(ticket.flight_key)
+            if future is not None:
+                self._stats["joined"] += 1
+                return future, False
+            future = self._flights[ticket.flight_key] = Future()
+            return future, True
+
+    def _end(self, ticket: ChatTicket, future: Future):
+        with self._lock:
+            if self._flights.get(ticket.flight_key) is future:
+                del self._flights[ticket.flight_key]
+
+    def _join_timeout(self) -> ChatResult:
+        with self._lock:
+            self._stats["join_timeouts"] += 1
+        return 409, {'error': 'The same request is still being processed'}
+
+    # 別のワーカーとの合流（Idempotency-Key 付きのみ）
+
+    def _claim(self, ticket: ChatTicket) -> Optional[Dict]:
+        """
+        キーを処理中として記録する
+        Returns: 記録できた（このリクエストが処理する）・キーがなければNone、
+                 別のワーカーが処理中・処理済みならその記録（内容が違えば ChatGuardError）
+        """
+        if not ticket.idempotency_key or not ticket.session_id:
+            return None
+        record = self.idempotency.claim(ticket.session_id, ticket.idempotency_key,
+                                        ticket.fingerprint)
+        if record is not None:
+            self._check_fingerprint(ticket, record)
+        return record
+
+    def _joined(self, record: Dict, deadline: float) -> Optional[ChatResult]:
+        """別のワーカーの記録から結果を作る（まだ処理中ならNone）"""
+        if record["status"] is not None:
+            return record["status"], record["body"]
+        if time.monotonic() >= deadline:
+            return self._join_timeout()
+        return None
+
+    def _count_other_worker(self):
+        with self._lock:
+            self._stats["joined_other_worker"] += 1
+
+    def _wait_other_worker(self, ticket: ChatTicket) -> Optional[ChatResult]:
+        """別のワーカーが同じキーを処理中・処理済みならその結果（このリクエストが処理する場合はNone）"""
+        deadline = time.monotonic() + CHAT_JOIN_TIMEOUT_SECONDS
+        record = self._claim(ticket)
+        if record is not None:
+            self._count_other_worker()
+        while record is not None:
+            result = self._joined(record, deadline)
+            if result is not None:
+                return result
+            time.sleep(CHAT_JOIN_POLL_SECONDS)
+            record = self._claim(ticket)
+        return None
+
+    async def _wait_other_worker_async(self, ticket: ChatTicket, run_io) -> Optional[ChatResult]:
+        """_wait_other_worker の非同期版"""
+        deadline = time.monotonic() + CHAT_JOIN_TIMEOUT_SECONDS
+        record = await run_io(self._claim, ticket)
+        if record is not None:
+            self._count_other_worker()
+        while record is not None:
+            result = self._joined(record, deadline)
+            if result is not None:
+                return result
+            await asyncio.sleep(CHAT_JOIN_POLL_SECONDS)
+            record = await run_io(self._claim, ticket)
+        return None
+
+    def _release(self, ticket: ChatTicket, result: Optional[ChatResult]):
+        """処理中の記録を片付ける（成功した結果は remember で保存済み）"""
+        if ticket.idempotency_key and ticket.session_id and (result is None or result[0] != 200):
+            self.idempotency.release(ticket.session_id, ticket.idempotency_key, ticket.fingerprint)
+
+    def run(self, ticket: ChatTicket, func: Callable[[], ChatResult]) -> Tuple[ChatResult, bool]:
+        """
+        同じリクエストが処理中ならその結果を待ち、なければ func() で処理する
+        別のワーカーが同じキーを違う内容で処理中・処理済みなら ChatGuardError（422）
+        Returns: (結果, 合流したか)
+        """
+        future, leader = self._begin(ticket)
+        if not leader:
+            try:
+                return future.result(timeout=CHAT_JOIN_TIMEOUT_SECONDS), True
+            except concurrent.futures.TimeoutError:
+                return self._join_timeout(), True
+        claimed = False
+        try:
+            joined = self._wait_other_worker(ticket)
+            if joined is not None:
+                future.set_result(joined)
+                return joined, True
+            claimed = True
+            result = func()
+        except BaseException as e:
+            future.set_exception(e)
+            if claimed:
+                self._release(ticket, None)
+            raise
+        else:
+            future.set_result(result)
+            self._release(ticket, result)
+            return result, False
+        finally:
+            self._end(ticket, future)
+
+    async def run_async(self, ticket: ChatTicket, func, run_io) -> Tuple[ChatResult, bool]:
+        """
+        run の非同期版
+        func: 結果を返すコルーチン関数、run_io: ファイルI/Oをスレッドで実行するコルーチン関数
+        """
+        future, leader = self._begin(ticket)
+        if not leader:
+            try:
+                # 待つ側がタイムアウト・切断しても処理中のリクエストは取り消さない
+                return await asyncio.wait_for(
+                    asyncio.shield(asyncio.wrap_future(future)), CHAT_JOIN_TIMEOUT_SECONDS
+                ), True
+            except asyncio.TimeoutError:
+                return self._join_timeout(), True
+        claimed = False
+        try:
+            joined = await self._wait_other_worker_async(ticket, run_io)
+            if joined is not None:
+                future.set_result(joined)
+                return joined, True
+            claimed = True
+            result = await func()
+        except BaseException as e:
+            future.set_exception(e)
+            if claimed:
+                await asyncio.shield(run_io(self._release, ticket, None))
+            raise
+        else:
+            future.set_result(result)
+            await run_io(self._release, ticket, result)
+            return result, False
+        finally:
+            self._end(ticket, future)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._flights)
+        stats["rate_per_minute"] = self.limiter.rate * 60
+        stats["burst"] = self.limiter.burst
+        return stats
@@ -0,0 +1,60 @@
+"""
+振り分け前の配置（profiles/<id>.json など）のファイルを、IDのハッシュで振り分けた
+サブディレクトリ（profiles/ab/cd/<id>.json）へ移し、ユーザー・セッションの一覧を作り直す
+
+振り分け前のファイルもそのまま読み書きできるので、実行は必須ではない（ディレクトリの
+ファイル数を減らしたいときに実行する）。ファイルはID単位のロック内で移すため、
+サーバーを止めずに実行できる。
+
+使い方:
+    python backend/reshard.py [--data-dir data] [--dry-run]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(__file__))
+
+from config import DATA_DIR
+from profile_manager import ProfileManager
+
+
+def reshard(manager: ProfileManager, dry_run: bool = False) -> dict:
+    """振り分け前のファイルを移し、ディレクトリごとの移したID数を返す"""
+    targets = [
+        ("profiles", manager._profiles, "profile"),
+        ("sessions", manager._sessions, "session"),
+        ("facts", manager.facts._dir, "facts"),
+    ]
+    moved = {}
+    for name, directory, lock_prefix in targets:
+        groups = directory.iter_legacy()
+        if not dry_run:
+            for key, names in groups.items():
+                with manager._locks.lock(f"{lock_prefix}:{key}"):
+                    directory.adopt_legacy(key, names, primary=f"{key}.json")
+        moved[name] = len(groups)
+        print(f"  {name}: {len(groups)} ids{' (dry run)' if dry_run else ''}", flush=True)
+    return moved
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    parser.add_argument('--dry-run', action='store_true', help='移すファイル数を表示するだけ')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    manager = ProfileManager(args.data_dir)
+    reshard(manager, args.dry_run)
+    if not args.dry_run:
+        users = manager.rebuild_manifest("users")
+        sessions = manager.rebuild_manifest("sessions")
+        print(f"Manifest: {users} users, {sessions} sessions")
+    print(f"Done in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
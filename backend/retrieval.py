@@ -0,0 +1,213 @@
+"""
+過去セッションの想起: 最新の発言に関係する過去の事実を選んでプロンプトに入れる
+
+ユーザーごとに、事実ストアの現在の事実と過去セッションの発言を文書とするBM25索引
+（文字n-gram）を作る。最新のユーザー発言で検索し、上位の事実を RETRIEVAL_TOKEN_BUDGET の
+範囲で返すので、セッションが増えてもプロンプトの長さは一定に保たれる。
+
+- 事実は現在の値だけを入れる（職業が 学生 → 会社員 と変わったら 会社員 だけ）。
+  事実ストアのバージョンが変わったら、保持している発言と合わせて索引を作り直す
+- 現在のセッションの発言と、現在のセッションで最後に更新された事実は返さない
+  （会話履歴としてそのまま送っているため）
+- 索引はプロセス内にユーザー単位でキャッシュする（LRU）。新しいセッションが始まると
+  前のセッションの発言だけ追加し、過去のセッションに戻った場合は作り直す
+- ファイルから作るので、複数ワーカーでもそれぞれ同じ内容になる
+"""
+
+import math
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional
+
+from config import (
+    RETRIEVAL_TOP_K, RETRIEVAL_TOKEN_BUDGET, RETRIEVAL_MAX_ITEM_CHARS,
+    RETRIEVAL_MESSAGES_PER_SESSION, RETRIEVAL_CACHE_USERS
+)
+from text_utils import normalize_text, char_ngram_list
+
+# BM25のパラメータ
+BM25_K1 = 1.2
+BM25_B = 0.75
+# これより短い発言（「はい」「うん」など）は索引に入れない
+MIN_MESSAGE_CHARS = 5
+
+
+def _is_hiragana(ch: str) -> bool:
+    return '\u3041' <= ch <= '\u309f'
+
+
+def _tokens(text: str) -> List[str]:
+    """
+    索引・検索に使うトークン: ひらがな以外を含む1-gramと2-gram
+    （「猫」「本」のような1文字の語でも一致させる。ひらがなだけのもの（「です」「の」など）は
+    助詞・語尾が多く、無関係な発言が一致してしまうので除く）
+    """
+    normalized = normalize_text(text)
+    grams = char_ngram_list(normalized, 1) + char_ngram_list(normalized, 2)
+    return [gram for gram in grams
+            if not gram.isspace() and not all(_is_hiragana(ch) for ch in gram)]
+
+
+def estimate_tokens(text: str) -> int:
+    """トークン数の概算（日本語は1文字1トークン、英数字は4文字で1トークン程度）"""
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return (len(text) - ascii_chars) + (ascii_chars + 3) // 4
+
+
+def _truncate(text: str, limit: int = RETRIEVAL_MAX_ITEM_CHARS) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+
+class _UserIndex:
+    """1ユーザー分のBM25索引"""
+
+    def __init__(self):
+        self.sessions = set()       # 発言を索引に入れたセッションID
+        self.messages: List[tuple] = []   # 過去の発言 (text, key_text)。作り直すときに使う
+        self.facts_version = None   # 索引に入っている事実のバージョン
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.texts: List[str] = []  # プロンプトに入れる文字列
+        self.sources: List[Optional[str]] = []   # 事実を最後に更新したセッションID（発言はNone）
+        self.lengths: List[int] = []
+        self.postings: Dict[str, List[tuple]] = {}   # トークン → [(文書番号, 出現回数)]
+        self.seen = set()           # 重複除去用（正規化した文字列）
+        self.total_length = 0
+
+    def rebuild(self, facts: List[Dict], version):
+        """現在の事実と保持している発言から索引を作り直す"""
+        self._reset()
+        # カテゴリー名（「基本プロフィール」など）は一般的な語なので索引に入れない
+        for fact in facts:
+            self.add(_truncate(f"{fact['key']}: {fact['value']}"), source=fact.get('session_id'))
+        for text, key_text in self.messages:
+            self.add(text, key_text)
+        self.facts_version = version
+
+    def add_message(self, text: str, key_text: str):
+        self.messages.append((text, key_text))
+        self.add(text, key_text)
+
+    def add(self, text: str, key_text: Optional[str] = None, source: Optional[str] = None):
+        """文書を追加（key_text は索引に使う文字列、省略時は text）"""
+        normalized = normalize_text(key_text or text)
+        if not normalized or normalized in self.seen:
+            return
+        self.seen.add(normalized)
+
+        tokens = Counter(_tokens(normalized))
+        doc_id = len(self.texts)
+        self.texts.append(text)
+        self.sources.append(source)
+        length = sum(tokens.values())
+        self.lengths.append(length)
+        self.total_length += length
+        for token, tf in tokens.items():
+            self.postings.setdefault(token, []).append((doc_id, tf))
+
+    def search(self, query: str) -> List[tuple]:
+        """BM25スコアの高い順に [(スコア, 文書番号)]"""
+        if not self.texts:
+            return []
+        terms = set(_tokens(query))
+        count = len(self.texts)
+        avg_length = self.total_length / count
+        scores: Dict[int, float] = {}
+        for term in terms:
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            df = len(postings)
+            idf = math.log(1 + (count - df + 0.5) / (df + 0.5))
+            for doc_id, tf in postings:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[doc_id] / avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return sorted(((score, doc_id) for doc_id, score in scores.items()), reverse=True)
+
+
+class MemoryRetriever:
+    """過去セッションから関連する事実を選ぶ"""
+
+    def __init__(self, profile_manager, cache_size: int = RETRIEVAL_CACHE_USERS):
+        self.profile_manager = profile_manager
+        self.cache_size = cache_size
+        self._indexes: OrderedDict = OrderedDict()   # user_id → _UserIndex
+        self._lock = threading.Lock()
+
+    def retrieve(self, profile: Dict, session_id: str, query: str,
+                 top_k: int = RETRIEVAL_TOP_K,
+                 token_budget: int = RETRIEVAL_TOKEN_BUDGET) -> List[str]:
+        """
+        最新の発言 query に関係する過去の事実を返す
+        Returns: プロンプトに入れる文字列のリスト（関係が強い順、合計は token_budget 以内）
+        """
+        past_sessions = [sid for sid in profile.get('sessions', []) if sid != session_id]
+        if not past_sessions or not query:
+            return []
+
+        index = self._get_index(profile['user_id'], past_sessions)
+        selected = []
+        used = 0
+        with index.lock:
+            for _score, doc_id in index.search(query):
+                if index.sources[doc_id] == session_id:
+                    continue
+                text = index.texts[doc_id]
+                tokens = estimate_tokens(text)
+                if used + tokens > token_budget:
+                    continue
+                selected.append(text)
+                used += tokens
+                if len(selected) >= top_k:
+                    break
+        return selected
+
+    def _get_index(self, user_id: str, past_sessions: List[str]) -> _UserIndex:
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is not None:
+                self._indexes.move_to_end(user_id)
+
+        past = set(past_sessions)
+        if index is None or not index.sessions <= past:
+            # 初回、または索引に入っているセッションに戻った場合は作り直す
+            index = _UserIndex()
+        with index.lock:
+            for sid in past_sessions:
+                if sid not in index.sessions:
+                    self._add_session(index, sid)
+                    index.sessions.add(sid)
+            version = self.profile_manager.facts.load(user_id).get("version", 0)
+            if version != index.facts_version:
+                index.rebuild(self.profile_manager.get_facts(user_id) or [], version)
+
+        with self._lock:
+            self._indexes[user_id] = index
+            self._indexes.move_to_end(user_id)
+            while len(self._indexes) > self.cache_size:
+                self._indexes.popitem(last=False)
+        return index
+
+    def _add_session(self, index: _UserIndex, session_id: str):
+        """セッションのユーザーの発言を索引に追加（抽出データは事実ストアから入れる）"""
+        page = self.profile_manager.get_messages(session_id, limit=RETRIEVAL_MESSAGES_PER_SESSION)
+        for message in (page or {}).get('messages', []):
+            content = message.get('content', '')
+            if message.get('role') == 'user' and len(content.strip()) >= MIN_MESSAGE_CHARS:
+                index.add_message(f"以前の発言「{_truncate(content)}」", content)
+
+    def invalidate(self, user_id: str):
+        """ユーザーの索引を破棄（次回の検索で作り直す）"""
+        with self._lock:
+            self._indexes.pop(user_id, None)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            indexes = list(self._indexes.values())
+        return {
+            'cached_users': len(indexes),
+            'documents': sum(len(index.texts) for index in indexes)
+        }
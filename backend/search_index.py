@@ -0,0 +1,237 @@
+"""
+検索インデックス: ユーザーの事実（カテゴリー・項目・現在の値）の転置インデックス
+
+- 項目名と値を正規化し、文字1-gram・2-gramで索引する（分かち書き不要）
+- 事実ストアの項目が作成・更新されるたびに data/search_facts.jsonl に追記し、
+  各ワーカーはこのログの増分を読み込んで自分のインデックスを更新する（ワーカー間で結果が一致する）
+- 同じユーザー・同じ項目（カテゴリーと正規化した項目名）の行は後の行が前の行を置き換え、
+  置き換えられた行は検索しない（職業が 学生 → 会社員 になったら 学生 では見つからない）
+- 置き換えられた行がたまったら、現在の行だけのログに書き直す
+- 検索はトークン・カテゴリーのリストのうち最も短いものだけを新しい順に走査し、
+  部分文字列の照合と絞り込みを行って件数に達したら打ち切る
+ログがない場合（既存データ）は rebuild() で事実ストアから作り直す。
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from array import array
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+from config import DATA_DIR, SEARCH_COMPACT_MIN_ROWS
+from fact_store import fact_id
+from storage import LockTable
+from text_utils import normalize_text, char_ngrams
+
+# 照合用テキストで項目名と値を区切る文字（クエリには現れない）
+_SEPARATOR = "\x00"
+
+
+@lru_cache(maxsize=65536)
+def _fact_tokens(key: str, value: str) -> tuple:
+    """
+    照合用テキストと索引するトークン（1-gramと2-gram）
+    同じ項目・値は繰り返し現れるのでキャッシュする（再構築・起動時の読み込みを速くする）
+    """
+    text = normalize_text(key) + _SEPARATOR + normalize_text(value)
+    grams = tuple(gram for gram in char_ngrams(text, 1) | char_ngrams(text, 2)
+                  if _SEPARATOR not in gram)
+    return text, grams
+
+
+def _query_grams(query: str) -> set:
+    """クエリのトークン（1文字の場合のみ1-gram）"""
+    return char_ngrams(query, 2) if len(query) >= 2 else char_ngrams(query, 1)
+
+
+class SearchIndex:
+    """抽出データの転置インデックス（プロセスごと、共有ログから増分更新）"""
+
+    def __init__(self, data_dir: str = DATA_DIR):
+        self.log_path = os.path.join(data_dir, "search_facts.jsonl")
+        self._locks = LockTable(os.path.join(data_dir, "locks"))
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # fact: (user_id, session_id, category, key, value, timestamp, 照合用テキスト)
+        self._facts: List[tuple] = []
+        self._postings: Dict[str, array] = {}
+        self._by_category: Dict[str, array] = {}
+        # (user_id, 事実のID) → 現在の行の番号、置き換えられた行の番号
+        self._current: Dict[tuple, int] = {}
+        self._superseded = set()
+        self._log_inode = None
+        self._log_offset = 0
+
+    # --- ProfileManager リスナー ---
+
+    def on_fact_changed(self, user_id: str, session_id: str, fact: Dict,
+                        change: str, previous_value):
+        line = json.dumps([user_id, session_id, fact["category"], fact["key"],
+                           fact["value"], fact["updated_at"]], ensure_ascii=False) + "\n"
+        with self._locks.lock("search-log"):
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(line)
+        with self._lock:
+            self._refresh()
+            if len(self._superseded) >= max(SEARCH_COMPACT_MIN_ROWS, len(self._current)):
+                self._compact()
+
+    # --- インデックス更新 ---
+
+    def _add_fact(self, row: list):
+        user_id, session_id, category, key, value, timestamp = row
+        text, grams = _fact_tokens(str(key), str(value))
+        row_id = len(self._facts)
+        self._facts.append((
+            sys.intern(user_id), session_id, sys.intern(category),
+            sys.intern(str(key)), value, timestamp, text
+        ))
+        current_key = (self._facts[row_id][0], fact_id(category, str(key)))
+        previous = self._current.get(current_key)
+        if previous is not None:
+            self._superseded.add(previous)
+        self._current[current_key] = row_id
+        for gram in grams:
+            postings = self._postings.get(gram)
+            if postings is None:
+                postings = self._postings[gram] = array("I")
+            postings.append(row_id)
+        by_category = self._by_category.get(category)
+        if by_category is None:
+            by_category = self._by_category[category] = array("I")
+        by_category.append(row_id)
+
+    def _compact(self):
+        """現在の行だけのログに書き直す（self._lock を取得して呼ぶ）"""
+        tmp_path = self.log_path + ".tmp"
+        with self._locks.lock("search-log"):
+            self._refresh()
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for row_id in sorted(self._current.values()):
+                    f.write(json.dumps(list(self._facts[row_id][:6]), ensure_ascii=False) + "\n")
+            os.replace(tmp_path, self.log_path)
+        self._reset()
+        self._refresh()
+
+    def _refresh(self):
+        """共有ログの増分を取り込む（ログが作り直されていれば最初から読み直す）"""
+        try:
+            st = os.stat(self.log_path)
+        except FileNotFoundError:
+            if self._log_inode is not None:
+                self._reset()
+            return
+
+        if st.st_ino != self._log_inode or st.st_size < self._log_offset:
+            self._reset()
+            self._log_inode = st.st_ino
+        if st.st_size == self._log_offset:
+            return
+
+        with open(self.log_path, "rb") as f:
+            f.seek(self._log_offset)
+            chunk = f.read(st.st_size - self._log_offset)
+        # 書き込み途中の行は次回に回す
+        end = chunk.rfind(b"\n") + 1
+        for line in chunk[:end].splitlines():
+            if line:
+                self._add_fact(json.loads(line))
+        self._log_offset += end
+
+    def rebuild(self, profile_manager) -> Dict:
+        """全ユーザーの事実ストアを走査してログとインデックスを作り直す"""
+        started = time.perf_counter()
+        tmp_path = self.log_path + ".tmp"
+        facts = 0
+        try:
+            scan_start = os.path.getsize(self.log_path)
+        except FileNotFoundError:
+            scan_start = 0
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for user_id in profile_manager.iter_user_ids():
+                for fact in profile_manager.get_facts(user_id) or []:
+                    f.write(json.dumps([
+                        user_id, fact["session_id"], fact["category"],
+                        fact["key"], fact["value"], fact["updated_at"]
+                    ], ensure_ascii=False) + "\n")
+                    facts += 1
+
+        # 走査中に追記された分を引き継いでから置き換える（後の行が走査分を置き換える）
+        with self._locks.lock("search-log"):
+            if os.path.exists(self.log_path):
+                with open(self.log_path, "rb") as src, open(tmp_path, "ab") as dst:
+                    src.seek(scan_start)
+                    dst.write(src.read())
+            os.replace(tmp_path, self.log_path)
+        with self._lock:
+            self._refresh()
+        return {
+            "facts": facts,
+            "took_ms": round((time.perf_counter() - started) * 1000, 1)
+        }
+
+    # --- 検索 ---
+
+    def search(self, query: str, category: Optional[str] = None,
+               since: Optional[str] = None, until: Optional[str] = None,
+               limit: int = 20) -> Dict:
+        """
+        項目名・現在の値にクエリを含む事実を新しい順に検索し、ユーザーごとにまとめて返す
+        since / until は正規化済みのISO日時（since以上、until未満）
+        """
+        started = time.perf_counter()
+        normalized = normalize_text(query)
+        matches = []
+        has_more = False
+
+        with self._lock:
+            self._refresh()
+            postings = [self._postings.get(gram) for gram in _query_grams(normalized)]
+            if category:
+                postings.append(self._by_category.get(category))
+            if postings and all(p is not None for p in postings):
+                candidates = min(postings, key=len)
+                superseded = self._superseded
+                for i in range(len(candidates) - 1, -1, -1):
+                    if candidates[i] in superseded:
+                        continue
+                    fact = self._facts[candidates[i]]
+                    if normalized not in fact[6]:
+                        continue
+                    if category and fact[2] != category:
+                        continue
+                    if (since and fact[5] < since) or (until and fact[5] >= until):
+                        continue
+                    if len(matches) >= limit:
+                        has_more = True
+                        break
+                    matches.append(fact)
+
+        users: Dict[str, List[Dict]] = {}
+        for user_id, session_id, fact_category, key, value, timestamp, _text in matches:
+            users.setdefault(user_id, []).append({
+                "session_id": session_id,
+                "category": fact_category,
+                "key": key,
+                "value": value,
+                "timestamp": timestamp
+            })
+
+        return {
+            "query": query,
+            "results": [{"user_id": user_id, "facts": facts} for user_id, facts in users.items()],
+            "count": len(matches),
+            "has_more": has_more,
+            "took_ms": round((time.perf_counter() - started) * 1000, 2)
+        }
+
+    def stats(self) -> Dict:
+        with self._lock:
+            self._refresh()
+            return {"facts": len(self._current), "superseded": len(self._superseded),
+                    "tokens": len(self._postings)}
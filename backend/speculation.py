@@ -0,0 +1,198 @@
+"""
+投機的な事前処理: ユーザーが次の発言を入力している間に、次の応答のプロンプトを用意しておく
+
+応答を返してから次のメッセージが届くまで、LM Studioは数十秒空いていることが多い。
+ターンが終わったら、次の応答で送るはずのプロンプトの先頭部分（このターン後の集計で作った
+システムプロンプト + ここまでの会話）を max_tokens=1 で送り、LM Studio側のプロンプト
+キャッシュ（KVキャッシュ）に載せておく。次のメッセージが届いたら、実際のプロンプトの先頭が
+事前処理したものと一致するかを判定し（一致すればキャッシュが効く）、結果は捨てる。
+
+- メンテナンス優先度で送り、LLMの空きスロットが SPECULATION_MIN_IDLE_SLOTS 未満なら送らない
+  （送る時点で空きがなければ待たずにやめる）
+- 過去セッションの想起（メッセージごとに変わる）は最新のユーザー発言に付けるので、一致の判定には含めない
+- 次の話題の候補（suggest_next_topic）も用意し、応答の生成に失敗した場合の代替メッセージに使う
+- 的中率と、使われなかった事前処理のトークン数・所要時間（無駄になった計算量）を stats() で返す
+
+事前処理の結果はプロセス内に持つ（マルチプロセスでは、次のメッセージが別のワーカーに届くと
+的中しない）。SPECULATION_ENABLED が False の場合は何もしない。
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from config import (
+    SPECULATION_ENABLED, SPECULATION_MIN_IDLE_SLOTS, SPECULATION_TTL_SECONDS,
+    SPECULATION_MAX_SESSIONS, SPECULATION_WORKERS
+)
+
+logger = logging.getLogger("interview.speculation")
+
+# 事前処理の状態
+PENDING = "pending"
+READY = "ready"
+FAILED = "failed"
+
+
+class Speculator:
+    """セッションごとの事前処理（次の応答のプロンプトの先読み）"""
+
+    def __init__(self, interviewer, profile_manager, enabled: bool = SPECULATION_ENABLED):
+        self.interviewer = interviewer
+        self.profile_manager = profile_manager
+        self.enabled = enabled
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=SPECULATION_WORKERS, thread_name_prefix='speculation'
+        ) if enabled else None
+        self._stats = {
+            "scheduled": 0, "skipped_busy": 0, "warmed": 0, "failed": 0,
+            "hits": 0, "misses": 0, "miss_reasons": {}, "unused": 0, "fallback_used": 0,
+            "prompt_tokens": 0, "llm_ms": 0.0, "wasted_prompt_tokens": 0, "wasted_llm_ms": 0.0
+        }
+
+    # ターンの終わり: 事前処理を予約
+
+    def schedule(self, turn: Dict):
+        """ターンの終わりに次の応答の事前処理を予約（バックグラウンドで送る）"""
+        if not self.enabled or turn.get('over_quota') or not turn.get('response'):
+            return
+        if self.interviewer.scheduler.idle_slots() < SPECULATION_MIN_IDLE_SLOTS:
+            with self._lock:
+                self._stats["skipped_busy"] += 1
+            return
+
+        entry = {
+            "state": PENDING,
+            "created": time.monotonic(),
+            "messages": turn['messages'] + [{"role": "assistant", "content": turn['response']}],
+            "system_prompt": None,
+            "next_topic": None,
+            "current": True
+        }
+        with self._lock:
+            self._stats["scheduled"] += 1
+            self._replace(turn['session_id'], entry)
+        self._executor.submit(self._warm, turn['user_id'], entry)
+
+    def _replace(self, session_id: str, entry: Optional[Dict]):
+        """セッションの事前処理を置き換える（self._lock を取得して呼ぶ）"""
+        old = self._entries.pop(session_id, None)
+        if old is not None:
+            self._discard(old, "unused")
+        if entry is not None:
+            self._entries[session_id] = entry
+            while len(self._entries) > SPECULATION_MAX_SESSIONS:
+                _sid, evicted = self._entries.popitem(last=False)
+                self._discard(evicted, "unused")
+
+    def _discard(self, entry: Dict, counter: Optional[str]):
+        """使われなかった事前処理（送信済みなら計算量は無駄になった）"""
+        entry["current"] = False
+        if counter:
+            self._stats[counter] += 1
+        if entry["state"] == READY:
+            self._stats["wasted_prompt_tokens"] += entry["prompt_tokens"]
+            self._stats["wasted_llm_ms"] += entry["llm_ms"]
+
+    def _warm(self, user_id: str, entry: Dict):
+        """事前処理を実行（ワーカースレッド）"""
+        try:
+            profile = self.profile_manager.get_user(user_id)
+            if not profile:
+                return
+            category_counts = self.profile_manager.get_category_data_count(user_id)
+            empty_categories = self.profile_manager.get_empty_categories(user_id)
+            system_prompt = self.interviewer.generate_system_prompt(
+                profile['character'], profile, category_counts, empty_categories
+            )
+            entry["system_prompt"] = system_prompt
+            entry["next_topic"] = self.interviewer.suggest_next_topic(
+                empty_categories, profile['character']
+            )
+
+            started = time.perf_counter()
+            usage = self.interviewer.warm_prefix(system_prompt, entry["messages"])
+            elapsed_ms = (time.perf_counter() - started) * 1000
+        except Exception as e:
+            logger.exception("Speculation failed: %s", e)
+            usage = None
+
+        with self._lock:
+            if usage is None:
+                entry["state"] = FAILED
+                self._stats["failed"] += 1
+                return
+            entry["state"] = READY
+            entry["prompt_tokens"] = usage.get("prompt_tokens") or 0
+            entry["llm_ms"] = elapsed_ms
+            self._stats["warmed"] += 1
+            self._stats["prompt_tokens"] += entry["prompt_tokens"]
+            self._stats["llm_ms"] += elapsed_ms
+            if not entry["current"]:
+                # 送っている間に次のメッセージが届いた・置き換えられた
+                self._discard(entry, None)
+
+    # 次のメッセージ: 事前処理の判定
+
+    def consume(self, turn: Dict):
+        """
+        次のメッセージが届いたときに事前処理を取り出し、実際のプロンプトと一致したかを記録
+        turn には begin_chat_turn で集めた値（messages の末尾は今回のユーザー発言）が入っていること。
+        次の話題の候補があれば turn['next_topic'] に入れる。
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            entry = self._entries.pop(turn['session_id'], None)
+        if entry is None:
+            return
+
+        reason = None
+        if time.monotonic() - entry["created"] > SPECULATION_TTL_SECONDS:
+            reason = "expired"
+        elif entry["state"] != READY:
+            reason = entry["state"]   # まだ送っている途中・失敗
+        elif entry["messages"] != turn['messages'][:-1]:
+            reason = "history"
+        else:
+            profile = turn['profile']
+            system_prompt = self.interviewer.generate_system_prompt(
+                profile['character'], profile, turn['category_counts'], turn['empty_categories']
+            )
+            if system_prompt != entry["system_prompt"]:
+                reason = "system_prompt"
+
+        if reason != "expired" and entry["next_topic"]:
+            turn['next_topic'] = entry["next_topic"]
+
+        with self._lock:
+            if reason is None:
+                self._stats["hits"] += 1
+                entry["current"] = False
+            else:
+                self._stats["misses"] += 1
+                reasons = self._stats["miss_reasons"]
+                reasons[reason] = reasons.get(reason, 0) + 1
+                self._discard(entry, None)
+
+    def record_fallback(self):
+        with self._lock:
+            self._stats["fallback_used"] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = {**self._stats, "miss_reasons": dict(self._stats["miss_reasons"])}
+            stats["pending_sessions"] = len(self._entries)
+        judged = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / judged, 3) if judged else None
+        stats["waste_ratio"] = (round(stats["wasted_prompt_tokens"] / stats["prompt_tokens"], 3)
+                                if stats["prompt_tokens"] else None)
+        stats["llm_ms"] = round(stats["llm_ms"], 1)
+        stats["wasted_llm_ms"] = round(stats["wasted_llm_ms"], 1)
+        stats["enabled"] = self.enabled
+        return stats
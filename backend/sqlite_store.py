@@ -0,0 +1,256 @@
+"""
+SQLiteストア: JSONファイルストアの移行先
+
+data/profiles・data/sessions の内容を1つのSQLiteファイルに保存する。
+- users / sessions はJSONをそのまま data 列に持ち、検索に使う列だけ取り出す
+- messages はセッションのメッセージログ（seq順）
+- extracted_data はセッションの抽出データ（カテゴリー内の順番を idx に持つ）
+事実ストアは抽出データから作り直せるので移行しない。
+
+users / sessions の書き込みは version が同じか新しい場合だけ反映するので、
+移行ツールと二重書き込み（SqliteMirror）がどの順で書いても最新の内容が残る。
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional
+
+logger = logging.getLogger("interview.sqlite")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    name TEXT,
+    created_at TEXT,
+    version INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    date TEXT,
+    version INTEGER NOT NULL DEFAULT 0,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_user ON sessions (user_id);
+CREATE TABLE IF NOT EXISTS messages (
+    session_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    user_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    timestamp TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (session_id, seq)
+);
+CREATE INDEX IF NOT EXISTS messages_user ON messages (user_id);
+CREATE TABLE IF NOT EXISTS extracted_data (
+    session_id TEXT NOT NULL,
+    category TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    user_id TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT,
+    timestamp TEXT,
+    PRIMARY KEY (session_id, category, idx)
+);
+CREATE INDEX IF NOT EXISTS extracted_user ON extracted_data (user_id);
+CREATE TABLE IF NOT EXISTS migration_state (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+_UPSERT_USER = """
+INSERT INTO users (user_id, name, created_at, version, data) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (user_id) DO UPDATE SET
+    name = excluded.name, version = excluded.version, data = excluded.data
+WHERE excluded.version >= users.version
+"""
+
+_UPSERT_SESSION = """
+INSERT INTO sessions (session_id, user_id, date, version, message_count, data)
+VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (session_id) DO UPDATE SET
+    version = excluded.version, message_count = excluded.message_count, data = excluded.data
+WHERE excluded.version >= sessions.version
+"""
+
+_INSERT_MESSAGE = """
+INSERT OR IGNORE INTO messages (session_id, seq, user_id, role, content, timestamp, data)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+_INSERT_EXTRACTED = """
+INSERT INTO extracted_data (session_id, category, idx, user_id, key, value, timestamp)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, ensure_ascii=False)
+
+
+class SqliteStore:
+    """SQLiteファイル1つ分のストア（接続はスレッドごと）"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self.connection().executescript(SCHEMA)
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    # 書き込み（呼び出し側のトランザクション内で使う）
+
+    def _upsert_user(self, conn, profile: Dict):
+        conn.execute(_UPSERT_USER, (
+            profile["user_id"], profile.get("name"), profile.get("created_at"),
+            profile.get("version", 0), _dumps(profile)
+        ))
+
+    def _upsert_session(self, conn, session: Dict):
+        """セッションを書き込み、反映された場合は抽出データも置き換える"""
+        meta = {key: value for key, value in session.items() if key != "conversation"}
+        cursor = conn.execute(_UPSERT_SESSION, (
+            meta["session_id"], meta["user_id"], meta.get("date"), meta.get("version", 0),
+            meta.get("message_count", 0), _dumps(meta)
+        ))
+        if cursor.rowcount == 0:
+            return   # より新しいバージョンが書き込み済み
+
+        conn.execute("DELETE FROM extracted_data WHERE session_id = ?", (meta["session_id"],))
+        conn.executemany(_INSERT_EXTRACTED, [
+            (meta["session_id"], category, idx, meta["user_id"], entry["key"],
+             _dumps(entry["value"]), entry.get("timestamp"))
+            for category, data_list in meta.get("extracted_data", {}).items()
+            for idx, entry in enumerate(data_list)
+        ])
+
+    def _insert_messages(self, conn, session_id: str, user_id: str,
+                         messages: Iterable[tuple]):
+        """messages: (seq, message) の列"""
+        conn.executemany(_INSERT_MESSAGE, [
+            (session_id, seq, user_id, message["role"], message["content"],
+             message.get("timestamp"), _dumps(message))
+            for seq, message in messages
+        ])
+
+    def write_batch(self, records: List[Dict], checkpoint: Optional[tuple] = None):
+        """
+        移行レコードをまとめて1トランザクションで書き込む
+        records: {"profile": ..., "sessions": [{"session": ..., "messages": [...]}]}
+        checkpoint: (名前, 値) を同じトランザクションで保存（再開位置）
+        """
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for record in records:
+                profile = record["profile"]
+                self._upsert_user(conn, profile)
+                for entry in record["sessions"]:
+                    session = entry["session"]
+                    self._upsert_session(conn, session)
+                    self._insert_messages(conn, session["session_id"], profile["user_id"],
+                                          enumerate(entry["messages"]))
+            if checkpoint:
+                conn.execute("INSERT OR REPLACE INTO migration_state (name, value) VALUES (?, ?)",
+                             checkpoint)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _write(self, func, *args):
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            func(conn, *args)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def upsert_user(self, profile: Dict):
+        self._write(self._upsert_user, profile)
+
+    def upsert_session(self, session: Dict):
+        self._write(self._upsert_session, session)
+
+    def add_message(self, session: Dict, seq: int, message: Dict):
+        """メッセージとセッション（件数・最新メッセージ）を書き込む"""
+        def write(conn):
+            self._insert_messages(conn, session["session_id"], session["user_id"],
+                                  [(seq, message)])
+            self._upsert_session(conn, session)
+        self._write(write)
+
+    # 移行の状態・検証
+
+    def get_state(self, name: str) -> Optional[str]:
+        row = self.connection().execute(
+            "SELECT value FROM migration_state WHERE name = ?", (name,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def delete_state(self, name: str):
+        self.connection().execute("DELETE FROM migration_state WHERE name = ?", (name,))
+
+    def counts_for_users(self, user_ids: List[str]) -> Dict[str, Dict[str, int]]:
+        """ユーザーごとのセッション数・メッセージ数・抽出データ数"""
+        counts = {user_id: {"sessions": 0, "messages": 0, "data": 0} for user_id in user_ids}
+        if not user_ids:
+            return counts
+        conn = self.connection()
+        placeholders = ",".join("?" * len(user_ids))
+        for field, table in (("sessions", "sessions"), ("messages", "messages"),
+                             ("data", "extracted_data")):
+            rows = conn.execute(
+                f"SELECT user_id, COUNT(*) FROM {table} "
+                f"WHERE user_id IN ({placeholders}) GROUP BY user_id", user_ids
+            )
+            for user_id, count in rows:
+                counts[user_id][field] = count
+        return counts
+
+
+class SqliteMirror:
+    """
+    ProfileManager のリスナーとしてSQLiteにも書き込む（二重書き込み）
+    JSONストアが正で、SQLiteへの書き込みに失敗してもリクエストは失敗させない
+    （ProfileManager がログに出す）。漏れは移行ツールの再実行・検証で補う。
+    """
+
+    def __init__(self, store: SqliteStore):
+        self.store = store
+
+    def on_user_created(self, profile: Dict):
+        self.store.upsert_user(profile)
+
+    def on_user_updated(self, profile: Dict):
+        self.store.upsert_user(profile)
+
+    def on_session_created(self, session: Dict):
+        self.store.upsert_session(session)
+
+    def on_session_updated(self, session: Dict):
+        self.store.upsert_session(session)
+
+    def on_message_added(self, session: Dict, seq: int, message: Dict):
+        self.store.add_message(session, seq, message)
@@ -0,0 +1,220 @@
+"""
+静的アセット配信: 起動時にフロントエンドのCSS/JSをフィンガープリント付きで事前圧縮
+
+- ファイル内容のハッシュをファイル名に含める（style.css → style.<hash>.css）
+- gzip（brotliモジュールがあればbrも）で事前に圧縮して保存
+- index.html 内の参照をハッシュ付きのパスに書き換える
+- ハッシュ付きアセットは immutable で長期キャッシュさせる
+生成結果の一覧は asset-manifest.json に保存する。ワーカーは一覧を読むだけで、
+元ファイルが変わっている（または一覧がない）場合だけファイルロック内で生成し直す
+（gunicorn では起動時にマスタープロセスで一度だけ生成する）。手動で生成する場合:
+    python backend/static_assets.py
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import re
+import tempfile
+from typing import Dict, Optional
+
+from flask import request, send_file
+
+from config import ASSET_URL_PREFIX, ASSET_EXTENSIONS, FRONTEND_DIR, ASSET_BUILD_DIR
+
+try:
+    import brotli
+except ImportError:  # brotliがなければgzipのみ
+    brotli = None
+
+try:
+    import fcntl
+except ImportError:  # Windows: 生成の排他はしない（同時に生成しても置き換えは原子的）
+    fcntl = None
+
+logger = logging.getLogger("interview.assets")
+
+# 長期キャッシュ（ハッシュ付きファイル名なので内容が変わればURLも変わる）
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+MANIFEST_FILE = 'asset-manifest.json'
+
+
+def _write_atomic(path: str, data: bytes):
+    """一時ファイル経由で書き込む（失敗時は一時ファイルを消す）"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class AssetPipeline:
+    """フロントエンドアセットのフィンガープリント・事前圧縮・配信"""
+
+    def __init__(self, source_dir: str, build_dir: str):
+        self.source_dir = source_dir
+        self.build_dir = build_dir
+        # 元のパス（css/style.css）→ ハッシュ付きのパス（css/style.<hash>.css）
+        self.manifest: Dict[str, str] = {}
+        # ハッシュ付きのパス → (mimetype, ETag)
+        self._assets: Dict[str, tuple] = {}
+        self.index_etag: Optional[str] = None
+
+    def _sources(self):
+        """生成対象の元ファイル（元のパス, ファイルパス）"""
+        for root, _dirs, files in os.walk(self.source_dir):
+            if os.path.abspath(root).startswith(os.path.abspath(self.build_dir)):
+                continue
+            for filename in sorted(files):
+                if os.path.splitext(filename)[1] not in ASSET_EXTENSIONS:
+                    continue
+                source_path = os.path.join(root, filename)
+                yield os.path.relpath(source_path, self.source_dir).replace(os.sep, '/'), source_path
+
+    def _source_signature(self) -> str:
+        """元ファイルのパス・サイズ・更新時刻から作る識別子（変わったら生成し直す）"""
+        digest = hashlib.sha256()
+        paths = list(self._sources()) + [('index.html', os.path.join(self.source_dir, 'index.html'))]
+        for rel_path, source_path in sorted(paths):
+            st = os.stat(source_path)
+            digest.update(f"{rel_path}\0{st.st_size}\0{st.st_mtime_ns}\n".encode('utf-8'))
+        return digest.hexdigest()
+
+    def load(self) -> bool:
+        """生成済みの一覧を読む（一覧がない・元ファイルが変わっている場合はFalse）"""
+        try:
+            with open(os.path.join(self.build_dir, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return False
+        if saved.get('source_signature') != self._source_signature():
+            return False
+        self.manifest = saved['manifest']
+        self._assets = {path: tuple(asset) for path, asset in saved['assets'].items()}
+        self.index_etag = saved['index_etag']
+        return True
+
+    def load_or_build(self):
+        """生成済みなら読み、なければ生成（複数ワーカーが同時に起動しても生成は1つだけ）"""
+        if self.load():
+            return
+        os.makedirs(self.build_dir, exist_ok=True)
+        with open(os.path.join(self.build_dir, '.build.lock'), 'w') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            # 待っている間に他のワーカーが生成していれば読むだけ
+            if not self.load():
+                self.build()
+
+    def build(self):
+        """アセットを生成して一覧を保存"""
+        signature = self._source_signature()
+        for rel_path, source_path in self._sources():
+            with open(source_path, 'rb') as f:
+                self._add(rel_path, f.read())
+
+        # index.html の参照を書き換え
+        with open(os.path.join(self.source_dir, 'index.html'), 'r', encoding='utf-8') as f:
+            html = f.read()
+        html = re.sub(r'(href|src)="([^"]+)"', self._rewrite_reference, html)
+        self.index_etag = self._store('index.html', html.encode('utf-8'))
+
+        # 一覧は最後に保存する（途中で失敗した生成を読まない）
+        _write_atomic(os.path.join(self.build_dir, MANIFEST_FILE), json.dumps({
+            'source_signature': signature,
+            'manifest': self.manifest,
+            'assets': self._assets,
+            'index_etag': self.index_etag
+        }, ensure_ascii=False).encode('utf-8'))
+
+        logger.info("Built %d assets into %s (brotli: %s)",
+                    len(self.manifest), self.build_dir, 'yes' if brotli else 'no')
+
+    def _rewrite_reference(self, match) -> str:
+        attr, url = match.group(1), match.group(2)
+        hashed = self.manifest.get(url)
+        if hashed is None:
+            return match.group(0)
+        return f'{attr}="{ASSET_URL_PREFIX}/{hashed}"'
+
+    def _add(self, rel_path: str, data: bytes):
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        stem, ext = os.path.splitext(rel_path)
+        hashed_path = f"{stem}.{digest}{ext}"
+        self.manifest[rel_path] = hashed_path
+        mimetype = mimetypes.guess_type(rel_path)[0] or 'application/octet-stream'
+        self._assets[hashed_path] = (mimetype, digest)
+        self._store(hashed_path, data, digest)
+
+    def _store(self, rel_path: str, data: bytes, digest: Optional[str] = None) -> str:
+        """
+        元データと圧縮版を保存
+        digest を渡した場合はファイル名に内容のハッシュが含まれるので、保存済みならスキップする
+        """
+        path = os.path.join(self.build_dir, *rel_path.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        variants = {path: lambda: data,
+                    path + '.gz': lambda: gzip.compress(data, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            variants[path + '.br'] = lambda: brotli.compress(data)
+
+        for variant_path, make in variants.items():
+            if digest is None or not os.path.exists(variant_path):
+                _write_atomic(variant_path, make())
+        return digest or hashlib.sha256(data).hexdigest()[:12]
+
+    def _send(self, rel_path: str, mimetype: str, etag: str, cache_control: str):
+        """Accept-Encoding に応じて事前圧縮済みファイルを送信"""
+        path = os.path.join(self.build_dir, *rel_path.split('/'))
+        accepted = request.accept_encodings
+        encoding = None
+        if brotli is not None and accepted['br']:
+            encoding = 'br'
+        elif accepted['gzip']:
+            encoding = 'gzip'
+
+        if encoding:
+            path += '.br' if encoding == 'br' else '.gz'
+
+        # ファイルパスで渡すと、WSGIサーバーがsendfileで送信できる
+        response = send_file(path, mimetype=mimetype, etag=f"{etag}-{encoding or 'identity'}",
+                             conditional=True, max_age=None)
+        response.headers.pop('Content-Disposition', None)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Cache-Control'] = cache_control
+        return response
+
+    def send_asset(self, hashed_path: str):
+        """ハッシュ付きアセットを送信（存在しなければNone）"""
+        asset = self._assets.get(hashed_path)
+        if asset is None:
+            return None
+        mimetype, etag = asset
+        return self._send(hashed_path, mimetype, etag, IMMUTABLE_CACHE_CONTROL)
+
+    def send_index(self):
+        """書き換え済みの index.html を送信（毎回再検証させる）"""
+        return self._send('index.html', 'text/html', self.index_etag, 'no-cache')
+
+
+def main():
+    pipeline = AssetPipeline(FRONTEND_DIR, ASSET_BUILD_DIR)
+    pipeline.build()
+    print(f"Built {len(pipeline.manifest)} assets into {ASSET_BUILD_DIR}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,412 @@
+"""
+ストレージ: ファイルロック、アトミック書き込み、プロセス間で整合する読み込みキャッシュ
+
+複数ワーカープロセスから同じデータディレクトリを扱えるようにするための部品。
+- LockTable: キーごとの排他ロック（プロセス内はRLock、プロセス間はflock）
+- atomic_write_json: 一時ファイル + rename による書き込み（読み手は常に完全なファイルを見る）
+- JsonFileCache: stat情報で検証する読み込みキャッシュ（他ワーカーの書き込みで自動的に無効化）
+- MessageLog: 範囲読み込みできる追記専用のメッセージログ
+- ShardedDir: IDのハッシュで振り分けたディレクトリ（振り分け前の配置も読める）
+- IdManifest: IDの一覧（ディレクトリを走査せずに列挙・件数取得する）
+"""
+
+import bisect
+import hashlib
+import json
+import os
+import struct
+import tempfile
+import threading
+import uuid
+import zlib
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from config import LOCK_STRIPES, FSYNC_WRITES, SHARD_DEPTH
+from tracing import traced
+
+try:
+    import fcntl
+except ImportError:  # Windows: プロセス内ロックのみ
+    fcntl = None
+
+
+class LockTable:
+    """
+    ストライプ化されたロックテーブル
+    キーをハッシュして固定数のロックファイルに割り当てるため、
+    ユーザー数やセッション数が増えてもロックファイルは増えない。
+    同一スレッド内での再取得（ネスト）は可能。
+    """
+
+    def __init__(self, lock_dir: str, stripes: int = LOCK_STRIPES):
+        os.makedirs(lock_dir, exist_ok=True)
+        self.lock_dir = lock_dir
+        self.stripes = stripes
+        self._thread_locks = [threading.RLock() for _ in range(stripes)]
+        self._local = threading.local()
+
+    def _stripe(self, key: str) -> int:
+        return zlib.crc32(key.encode('utf-8')) % self.stripes
+
+    @contextmanager
+    def lock(self, key: str):
+        """キーに対する排他ロックを取得"""
+        stripe = self._stripe(key)
+        held = getattr(self._local, 'held', None)
+        if held is None:
+            held = self._local.held = {}
+
+        with self._thread_locks[stripe]:
+            if stripe in held:
+                # 同一スレッドで取得済み
+                held[stripe][1] += 1
+                try:
+                    yield
+                finally:
+                    held[stripe][1] -= 1
+                return
+
+            fd = None
+            if fcntl is not None:
+                lock_path = os.path.join(self.lock_dir, f"{stripe:04d}.lock")
+                fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            held[stripe] = [fd, 1]
+            try:
+                yield
+            finally:
+                del held[stripe]
+                if fd is not None:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+                    os.close(fd)
+
+
+def atomic_write_json(path: str, data: Any, indent: Optional[int] = 2):
+    """一時ファイルに書き込んでからrenameで置き換える"""
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-', suffix='.json')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=indent)
+            if FSYNC_WRITES:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def read_json(path: str) -> Optional[Any]:
+    """JSONファイルを読み込む（存在しない場合はNone）"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+class JsonFileCache:
+    """
+    読み込み専用のJSONキャッシュ
+    (inode, mtime, size) が変わっていれば読み直すので、
+    他のワーカープロセスがrenameで書き換えた場合も古い内容は返さない。
+    返すオブジェクトは共有されるため、呼び出し側で変更してはいけない。
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def get(self, path: str) -> Optional[Any]:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            self.invalidate(path)
+            return None
+
+        stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+        entry = self._entries.get(path)
+        if entry is not None and entry[0] == stamp:
+            return entry[1]
+
+        data = read_json(path)
+        if data is None:
+            return None
+
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                # 古いものから半分を捨てる
+                for old_path in list(self._entries)[:self.max_entries // 2]:
+                    del self._entries[old_path]
+            self._entries[path] = (stamp, data)
+        return data
+
+    def invalidate(self, path: str):
+        with self._lock:
+            self._entries.pop(path, None)
+
+
+class MessageLog:
+    """
+    追記専用のメッセージログ
+    <name>.jsonl に1行1メッセージ（JSON）、<name>.idx に各行の (オフセット, 長さ) を
+    8バイト整数2つで記録する。インデックスを使って任意の範囲のメッセージだけを
+    読み込めるため、会話全体をデシリアライズする必要がない。
+    追記は呼び出し側でセッションのロックを取得したうえで行うこと。
+    """
+
+    ENTRY = struct.Struct('<QQ')
+
+    def __init__(self, base_path: str):
+        self.log_path = base_path + '.jsonl'
+        self.index_path = base_path + '.idx'
+
+    def exists(self) -> bool:
+        return os.path.exists(self.index_path)
+
+    def remove(self):
+        """ログを削除（インデックスを先に消す）"""
+        for path in (self.index_path, self.log_path):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def count(self) -> int:
+        """記録済みメッセージ数"""
+        try:
+            return os.path.getsize(self.index_path) // self.ENTRY.size
+        except FileNotFoundError:
+            return 0
+
+    @traced('msglog_append')
+    def append(self, messages: List) -> int:
+        """メッセージ（JSONにできる値）を追記し、追記後のメッセージ数を返す"""
+        lines = [
+            (json.dumps(message, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8')
+            for message in messages
+        ]
+        with open(self.log_path, 'ab') as log_file:
+            offset = log_file.seek(0, os.SEEK_END)
+            log_file.write(b''.join(lines))
+            if FSYNC_WRITES:
+                log_file.flush()
+                os.fsync(log_file.fileno())
+
+        entries = []
+        for line in lines:
+            entries.append(self.ENTRY.pack(offset, len(line)))
+            offset += len(line)
+
+        with open(self.index_path, 'ab') as index_file:
+            # ログより後にインデックスを書くので、読み手が途中の行を見ることはない
+            index_file.seek(0, os.SEEK_END)
+            index_file.truncate(index_file.tell() - index_file.tell() % self.ENTRY.size)
+            index_file.write(b''.join(entries))
+            if FSYNC_WRITES:
+                index_file.flush()
+                os.fsync(index_file.fileno())
+            return index_file.tell() // self.ENTRY.size
+
+    @traced('msglog_read')
+    def read(self, start: int = 0, end: Optional[int] = None) -> List:
+        """[start, end) の範囲のメッセージを読み込む"""
+        try:
+            with open(self.index_path, 'rb') as index_file:
+                index_file.seek(start * self.ENTRY.size)
+                size = None if end is None else max(0, end - start) * self.ENTRY.size
+                raw_index = index_file.read(size) if size is not None else index_file.read()
+        except FileNotFoundError:
+            return []
+
+        usable = len(raw_index) - len(raw_index) % self.ENTRY.size
+        entries = [self.ENTRY.unpack_from(raw_index, pos)
+                   for pos in range(0, usable, self.ENTRY.size)]
+        if not entries:
+            return []
+
+        # 範囲全体を1回で読み込んでから行ごとに切り出す
+        first_offset = entries[0][0]
+        last_offset, last_length = entries[-1]
+        try:
+            with open(self.log_path, 'rb') as log_file:
+                log_file.seek(first_offset)
+                chunk = log_file.read(last_offset + last_length - first_offset)
+        except FileNotFoundError:
+            return []   # インデックスを開いた後に削除された
+
+        # 各行をつないで1つのJSON配列として解析する（行ごとに json.loads するより速い）
+        return json.loads(b'[' + b','.join(
+            chunk[offset - first_offset:offset - first_offset + length]
+            for offset, length in entries
+        ) + b']')
+
+
+def uuid_bytes(item_id: str) -> bytes:
+    """UUID文字列を16バイトに（UUIDでなければ ValueError）"""
+    return bytes.fromhex(item_id.replace('-', ''))
+
+
+def uuid_str(record: bytes) -> str:
+    """16バイトをUUID文字列に（uuid.UUID を経由するより速い）"""
+    h = record.hex()
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
+
+class ShardedDir:
+    """
+    IDのハッシュ（md5の先頭）で base/ab/cd/<id><suffix> のように振り分けたディレクトリ
+    1ディレクトリあたりのファイル数が増えすぎないようにする（2階層で65536ディレクトリ）。
+    振り分け前の base/<id><suffix> にあるファイルもそのまま読み書きでき、
+    adopt_legacy で振り分け先へ移せる。
+    """
+
+    def __init__(self, base_dir: str, depth: int = SHARD_DEPTH):
+        os.makedirs(base_dir, exist_ok=True)
+        self.base_dir = base_dir
+        self.depth = depth
+
+    def shard(self, key: str) -> str:
+        """キーの振り分け先ディレクトリ"""
+        digest = hashlib.md5(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.base_dir, *(digest[i * 2:i * 2 + 2] for i in range(self.depth)))
+
+    def path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.shard(key), key + suffix)
+
+    def locate(self, key: str, suffix: str, create: bool = False) -> str:
+        """
+        既存ファイルのパス（振り分け先 → 振り分け前の順に探す）
+        どちらにもなければ振り分け先のパスを返す（create=True ならディレクトリも作る）
+        """
+        path = self.path(key, suffix)
+        if os.path.exists(path):
+            return path
+        legacy_path = os.path.join(self.base_dir, key + suffix)
+        if os.path.exists(legacy_path):
+            return legacy_path
+        if create:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def _leaf_dirs(self) -> Iterator[str]:
+        level = [self.base_dir]
+        for _ in range(self.depth):
+            level = [entry.path for directory in level for entry in os.scandir(directory)
+                     if entry.is_dir() and len(entry.name) == 2]
+        return iter(level)
+
+    def iter_keys(self, suffix: str) -> Iterator[str]:
+        """<id><suffix> のファイルがあるキーを列挙（振り分け前の配置も含む、順不同）"""
+        for directory in [self.base_dir, *self._leaf_dirs()]:
+            for entry in os.scandir(directory):
+                key, dot, rest = entry.name.partition('.')
+                if key and dot and '.' + rest == suffix:
+                    yield key
+
+    def iter_legacy(self) -> Dict[str, List[str]]:
+        """振り分け前の配置にあるファイル名をキーごとにまとめる"""
+        groups: Dict[str, List[str]] = {}
+        for entry in os.scandir(self.base_dir):
+            key, dot, _rest = entry.name.partition('.')
+            if key and dot and entry.is_file():
+                groups.setdefault(key, []).append(entry.name)
+        return groups
+
+    def adopt_legacy(self, key: str, names: Iterable[str], primary: str):
+        """
+        振り分け前のファイルを振り分け先へ移す（呼び出し側でキーのロックを取得すること）
+        すべてハードリンクしてから primary（例: <id>.json）を先に消すので、
+        読み手はどの時点でも一方の配置に揃ったファイルを見る。
+        """
+        names = sorted(names, key=lambda name: name != primary)
+        target_dir = self.shard(key)
+        os.makedirs(target_dir, exist_ok=True)
+        for name in names:
+            source, target = os.path.join(self.base_dir, name), os.path.join(target_dir, name)
+            if os.path.exists(target):
+                if os.path.samefile(source, target):
+                    continue   # 前回の実行でリンク済み
+                raise FileExistsError(target)
+            os.link(source, target)
+        for name in names:
+            os.unlink(os.path.join(self.base_dir, name))
+
+
+class IdManifest:
+    """
+    IDの一覧（追記専用）
+    UUIDを16バイトずつ記録するので、件数はファイルサイズから分かり、
+    100万件でも16MBを読むだけで列挙できる（ディレクトリの走査は不要）。
+    追記と rebuild は呼び出し側で同じロックを取得して行うこと。
+    """
+
+    RECORD = 16
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def count(self) -> int:
+        try:
+            return os.path.getsize(self.path) // self.RECORD
+        except FileNotFoundError:
+            return 0
+
+    def append(self, item_id: str):
+        record = uuid.UUID(item_id).bytes
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, record)
+        finally:
+            os.close(fd)
+
+    def _read_records(self) -> List[bytes]:
+        try:
+            with open(self.path, 'rb') as f:
+                raw = f.read()
+        except FileNotFoundError:
+            return []
+        usable = len(raw) - len(raw) % self.RECORD
+        return [raw[pos:pos + self.RECORD] for pos in range(0, usable, self.RECORD)]
+
+    def iter_sorted(self, after: Optional[str] = None) -> Iterator[str]:
+        """IDを昇順に列挙（after より後のIDのみ）"""
+        # UUIDの文字列の順序とバイト列の順序は同じなので、バイト列のまま並べる
+        records = sorted(set(self._read_records()))
+        start = bisect.bisect_right(records, uuid_bytes(after)) if after else 0
+        for pos in range(start, len(records)):
+            yield uuid_str(records[pos])
+
+    def rebuild(self, item_ids: Iterable[str]) -> int:
+        """一覧を作り直し、記録した件数を返す（UUIDでないIDは無視する）"""
+        records = set()
+        for item_id in item_ids:
+            try:
+                record = uuid_bytes(item_id)
+            except ValueError:
+                continue
+            if len(record) == self.RECORD:
+                records.add(record)
+        data = b''.join(sorted(records))
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        return len(records)
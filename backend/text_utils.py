@@ -0,0 +1,29 @@
+"""
+テキスト処理: 日本語を含む値の正規化とトークン化
+"""
+
+import re
+import unicodedata
+
+_SPACES = re.compile(r'\s+')
+
+
+def normalize_text(value) -> str:
+    """全角・半角や大文字・小文字、空白の違いを吸収した比較用の文字列"""
+    text = unicodedata.normalize('NFKC', str(value)).lower()
+    return _SPACES.sub(' ', text).strip()
+
+
+def char_ngrams(text: str, n: int = 2) -> set:
+    """
+    文字n-gramの集合（分かち書きなしで日本語を検索するためのトークン）
+    n文字未満の文字列はそれ自体を1つのトークンとする
+    """
+    return set(char_ngram_list(text, n))
+
+
+def char_ngram_list(text: str, n: int = 2) -> list:
+    """文字n-gramのリスト（重複を含む。出現回数を数える場合に使う）"""
+    if len(text) < n:
+        return [text] if text else []
+    return [text[i:i + n] for i in range(len(text) - n + 1)]
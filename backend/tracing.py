@@ -0,0 +1,142 @@
+"""
+リクエストトレース: 処理の段階ごとの所要時間を計測
+
+- span(name) で囲んだ区間と、@traced(name) を付けた関数の所要時間を記録する
+- リクエストごとに Server-Timing ヘッダーとして返す（ブラウザの開発者ツールで見られる）
+- 一部のリクエスト（サンプリング）と遅いリクエストはトレースログに記録する
+トレースは contextvars で保持するため、スレッド・asyncio のどちらでも使える。
+TRACE_ENABLED が False の場合、@traced は元の関数をそのまま返し、span は何もしない。
+"""
+
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import random
+import time
+from typing import List, Optional
+
+from config import TRACE_ENABLED, TRACE_LOG_SAMPLE_RATE, TRACE_SLOW_MS
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar('trace', default=None)
+# 書き出し先（TRACE_LOG_PATH）は logging_setup で設定する
+trace_logger = logging.getLogger('interview.trace')
+
+
+class Trace:
+    """1リクエスト分のトレース"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.perf_counter()
+        self.spans: List[tuple] = []   # (名前, 開始からの秒数, 所要秒数)
+
+    def add(self, name: str, started: float, duration: float):
+        self.spans.append((name, started - self.started, duration))
+
+
+class _Span:
+    """計測区間"""
+
+    __slots__ = ('trace', 'name', 'started')
+
+    def __init__(self, trace: Trace, name: str):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.trace.add(self.name, self.started, time.perf_counter() - self.started)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+def span(name: str):
+    """with span("name"): で区間を計測（トレース中でなければ何もしない）"""
+    trace = _current_trace.get()
+    if trace is None:
+        return _NOOP
+    return _Span(trace, name)
+
+
+def traced(name: str):
+    """関数の所要時間を計測するデコレーター（async関数にも使える）"""
+    def decorator(func):
+        if not TRACE_ENABLED:
+            return func
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def start_trace(name: str) -> Optional[Trace]:
+    """リクエストのトレースを開始（無効時はNone）"""
+    if not TRACE_ENABLED:
+        return None
+    trace = Trace(name)
+    _current_trace.set(trace)
+    return trace
+
+
+def finish_trace(trace: Optional[Trace]) -> Optional[str]:
+    """トレースを終了して Server-Timing ヘッダーの値を返す"""
+    if trace is None:
+        return None
+    _current_trace.set(None)
+    total = time.perf_counter() - trace.started
+
+    # 同じ名前の区間はまとめる（回数は desc に入れる）
+    totals = {}
+    for name, _start, duration in trace.spans:
+        entry = totals.setdefault(name, [0.0, 0])
+        entry[0] += duration
+        entry[1] += 1
+    metrics = [
+        f'{name};dur={duration * 1000:.2f}' + (f';desc="x{count}"' if count > 1 else '')
+        for name, (duration, count) in totals.items()
+    ]
+    metrics.append(f'total;dur={total * 1000:.2f}')
+
+    if total * 1000 >= TRACE_SLOW_MS or random.random() < TRACE_LOG_SAMPLE_RATE:
+        _write_log(trace, total)
+    return ', '.join(metrics)
+
+
+def _write_log(trace: Trace, total: float):
+    record = {
+        'time': time.time(),
+        'name': trace.name,
+        'total_ms': round(total * 1000, 2),
+        'spans': [
+            {'name': name, 'start_ms': round(start * 1000, 2), 'dur_ms': round(duration * 1000, 2)}
+            for name, start, duration in trace.spans
+        ]
+    }
+    trace_logger.info(json.dumps(record, ensure_ascii=False))
@@ -0,0 +1,180 @@
+"""
+LLM使用量の計測: 呼び出しごとのトークン数・所要時間を用途別に集計
+
+- Interviewer は LM Studio への呼び出しを metered(用途) で囲んで記録する
+  （トークン数は応答JSONの usage ブロック: prompt_tokens / completion_tokens）
+- チャットのリクエストでは start_meter() でメーターを用意し、ターンの終わりに
+  ProfileManager.add_usage でセッションとユーザーの集計に加える
+- メーターがない呼び出し（接続確認・ウォームアップ・再抽出など）はプロセス内の集計にだけ入る
+メーターは contextvars で保持するため、スレッド・asyncio のどちらでも使える。
+
+ユーザーごとの集計は usage/<ab>/<cd>/<user_id>.json に、累計と日別（USAGE_RETENTION_DAYS 日分）
+を保存する。1日のトークン数が USAGE_DAILY_TOKEN_QUOTA を超えたユーザーは、
+応答は続けたままデータ抽出と過去セッションの想起を省略する。
+"""
+
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+from typing import Dict, Optional
+
+from config import USAGE_DAILY_TOKEN_QUOTA, USAGE_RETENTION_DAYS
+from storage import LockTable, JsonFileCache, ShardedDir, atomic_write_json
+
+# 用途
+PURPOSE_REPLY = "reply"
+PURPOSE_EXTRACTION = "extraction"
+PURPOSE_HEALTH = "health"
+PURPOSE_SPECULATION = "speculation"
+
+_current_meter: contextvars.ContextVar = contextvars.ContextVar('usage_meter', default=None)
+
+_process_lock = threading.Lock()
+_process_usage: Dict[str, Dict] = {}
+
+
+def empty_usage() -> Dict:
+    return {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "llm_ms": 0.0}
+
+
+def merge_usage(target: Dict[str, Dict], usage_by_purpose: Dict[str, Dict]) -> Dict[str, Dict]:
+    """用途別の使用量を target に加える（target を返す）"""
+    for purpose, usage in usage_by_purpose.items():
+        entry = target.setdefault(purpose, empty_usage())
+        for field, value in usage.items():
+            entry[field] = entry.get(field, 0) + value
+        entry["llm_ms"] = round(entry["llm_ms"], 1)
+    return target
+
+
+def total_tokens(usage_by_purpose: Dict[str, Dict]) -> int:
+    return sum(usage.get("total_tokens", 0) for usage in usage_by_purpose.values())
+
+
+class UsageMeter:
+    """1ターン分の使用量"""
+
+    def __init__(self):
+        self.by_purpose: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def add(self, purpose: str, usage: Dict):
+        with self._lock:
+            merge_usage(self.by_purpose, {purpose: usage})
+
+    def to_dict(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {purpose: dict(usage) for purpose, usage in self.by_purpose.items()}
+
+
+def start_meter() -> UsageMeter:
+    """このコンテキスト（リクエスト）の計測を開始"""
+    meter = UsageMeter()
+    _current_meter.set(meter)
+    return meter
+
+
+def finish_meter():
+    """計測を終了（スレッドを使い回すサーバーで次のリクエストに残さない）"""
+    _current_meter.set(None)
+
+
+def record_call(purpose: str, seconds: float, usage: Optional[Dict] = None):
+    """LM Studioへの呼び出し1回分を記録（usage がない応答・失敗はトークン数0）"""
+    usage = usage or {}
+    prompt_tokens = usage.get("prompt_tokens") or 0
+    completion_tokens = usage.get("completion_tokens") or 0
+    entry = {
+        "calls": 1,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": usage.get("total_tokens") or prompt_tokens + completion_tokens,
+        "llm_ms": seconds * 1000
+    }
+    meter = _current_meter.get()
+    if meter is not None:
+        meter.add(purpose, entry)
+    with _process_lock:
+        merge_usage(_process_usage, {purpose: entry})
+
+
+class LLMCall:
+    """metered() の中で応答を読み、usage を記録に渡す"""
+
+    __slots__ = ('usage',)
+
+    def __init__(self):
+        self.usage = None
+
+    def read(self, response) -> Optional[Dict]:
+        """成功した応答のJSONを返す（失敗時はNone）。requests / httpx のどちらの応答にも使える"""
+        if response.status_code != 200:
+            return None
+        result = response.json()
+        self.usage = result.get("usage") if isinstance(result, dict) else None
+        return result
+
+
+@contextmanager
+def metered(purpose: str):
+    """with metered(用途) as call: で囲んだLM Studioへの呼び出しを記録（例外時も所要時間は記録）"""
+    call = LLMCall()
+    started = time.perf_counter()
+    try:
+        yield call
+    finally:
+        record_call(purpose, time.perf_counter() - started, call.usage)
+
+
+def process_usage() -> Dict[str, Dict]:
+    """このプロセスの起動以降の使用量（メーターのない呼び出しも含む）"""
+    with _process_lock:
+        return {purpose: dict(usage) for purpose, usage in _process_usage.items()}
+
+
+class UsageStore:
+    """ユーザーごとの使用量（累計・日別）"""
+
+    def __init__(self, data_dir: str, locks: LockTable):
+        self._dir = ShardedDir(os.path.join(data_dir, "usage"))
+        self._locks = locks
+        self._cache = JsonFileCache()
+
+    def load(self, user_id: str) -> Dict:
+        """使用量を取得（共有オブジェクトなので変更しないこと）"""
+        table = self._cache.get(self._dir.locate(user_id, ".json"))
+        if table is None:
+            return {"user_id": user_id, "total": {}, "daily": {}}
+        return table
+
+    def add(self, user_id: str, usage_by_purpose: Dict[str, Dict]) -> Dict:
+        today = date.today().isoformat()
+        oldest = (date.today() - timedelta(days=USAGE_RETENTION_DAYS - 1)).isoformat()
+        with self._locks.lock(f"usage:{user_id}"):
+            current = self.load(user_id)
+            table = {
+                "user_id": user_id,
+                "total": merge_usage({k: dict(v) for k, v in current["total"].items()},
+                                     usage_by_purpose),
+                "daily": {day: usage for day, usage in current["daily"].items() if day >= oldest}
+            }
+            table["daily"][today] = merge_usage(
+                {k: dict(v) for k, v in table["daily"].get(today, {}).items()}, usage_by_purpose
+            )
+            atomic_write_json(self._dir.locate(user_id, ".json", create=True), table)
+        return table
+
+    def tokens_today(self, user_id: str) -> int:
+        return total_tokens(self.load(user_id)["daily"].get(date.today().isoformat(), {}))
+
+    def quota_status(self, user_id: str) -> Dict:
+        """今日の使用量と上限（上限0は無制限）"""
+        used = self.tokens_today(user_id)
+        return {
+            "daily_token_quota": USAGE_DAILY_TOKEN_QUOTA,
+            "tokens_today": used,
+            "exceeded": bool(USAGE_DAILY_TOKEN_QUOTA) and used >= USAGE_DAILY_TOKEN_QUOTA
+        }
@@ -0,0 +1,303 @@
+"""
+/api/chat パイプラインの負荷テスト
+
+ローカルの疑似LLMサーバーと一時データディレクトリを使ってアプリをプロセス内で起動し、
+多数の仮想ユーザーが並行して user/create → session/create → chat × N を実行する。
+エンドポイントごとのレイテンシ（p50/p95/p99）、リクエスト数/秒、
+チャット1ターンあたりのディスク読み書きバイト数・ファイルオープン数を計測し、JSONに保存する。
+
+使い方:
+    python benchmarks/load_test.py --users 50 --concurrency 16 --turns 10 -o results.json
+    python benchmarks/load_test.py --compare results.json   # 前回の結果と比較
+ディスクのバイト数は /proc/self/io の read_bytes / write_bytes（Linuxのみ、ブロックデバイス単位）、
+syscall_* は read/write システムコールのバイト数（ソケット通信を含む）。
+1ターンあたりの値は、ユーザー・セッション作成分も含めた合計をチャット回数で割ったもの。
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+
+# 仮想ユーザーの発言（日本語の一般的な自己紹介・雑談）
+MESSAGES = [
+    "はじめまして、よろしくお願いします。",
+    "東京でエンジニアとして働いています。",
+    "休みの日はだいたいカフェで本を読んでいます。",
+    "最近はミステリー小説にはまっていて、東野圭吾をよく読みます。",
+    "朝はコーヒーを飲まないと目が覚めないんです。",
+    "大学では経済学を勉強していました。",
+    "猫を二匹飼っていて、名前はモチとキナコです。",
+    "週末はジョギングをしていて、来年はフルマラソンに出たいと思っています。",
+    "料理は好きだけど、平日は忙しくてなかなか作れないですね。",
+    "実家は北海道で、年に一回くらい帰ります。",
+    "ラーメンが大好きで、特に味噌ラーメンが好きです。",
+    "学生時代は吹奏楽部でトランペットを吹いていました。",
+    "将来は海外で働いてみたいという気持ちもあります。",
+    "人見知りなので、初対面の人と話すのは少し緊張します。",
+    "最近、家計簿アプリを使い始めて節約を頑張っています。",
+    "夜更かしをしてしまうのが悩みです。",
+    "旅行が好きで、去年は京都と沖縄に行きました。",
+    "友達とはよくボードゲームをして遊びます。",
+    "健康のために野菜を多めに食べるようにしています。",
+    "仕事ではチームのリーダーを任されることが増えてきました。",
+]
+
+# 疑似LLMが抽出結果として返すデータ
+FACTS = [
+    ("趣味・興味・娯楽", "趣味", "読書"),
+    ("趣味・興味・娯楽", "趣味", "ジョギング"),
+    ("基本プロフィール", "職業", "エンジニア"),
+    ("基本プロフィール", "出身地", "北海道"),
+    ("健康・ライフスタイル", "食習慣", "ラーメン"),
+    ("現在の生活", "ペット", "猫"),
+]
+
+SUMMARY_ENDPOINTS = ("user/create", "session/create", "chat")
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    """LM Studio互換の疑似サーバー（応答遅延は server.delay 秒）"""
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        system_prompt = body['messages'][0]['content']
+        if 'プロファイリングデータ抽出' in system_prompt:
+            facts = random.sample(FACTS, 2)
+            content = json.dumps([
+                {"category": c, "key": k, "value": v} for c, k, v in facts
+            ], ensure_ascii=False)
+        else:
+            content = "そうなんだ！もっと教えて？"
+        time.sleep(self.server.delay)
+        out = json.dumps({
+            "choices": [{"message": {"content": content}}],
+            "usage": {"prompt_tokens": 200, "completion_tokens": 20, "total_tokens": 220}
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+    def do_GET(self):
+        # モデル一覧（接続確認用）
+        out = json.dumps({"data": [{"id": "fake-model"}]}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_fake_llm(delay: float) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeLLMHandler)
+    server.daemon_threads = True
+    server.delay = delay
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def read_proc_io() -> dict:
+    """プロセスのI/O統計（Linux以外は空）"""
+    try:
+        with open('/proc/self/io') as f:
+            return {k: int(v) for k, v in (line.split(': ') for line in f)}
+    except OSError:
+        return {}
+
+
+class OpenCounter:
+    """監査フックでデータディレクトリ配下のファイルオープン数を数える"""
+
+    def __init__(self, data_dir: str):
+        self.prefix = os.path.realpath(data_dir)
+        self.count = 0
+        self.enabled = False
+        sys.addaudithook(self._hook)
+
+    def _hook(self, event, args):
+        if self.enabled and event == 'open' and isinstance(args[0], str):
+            if os.path.realpath(args[0]).startswith(self.prefix):
+                self.count += 1
+
+
+def percentiles(values: list) -> dict:
+    if not values:
+        return {"count": 0}
+    values = sorted(values)
+
+    def pick(ratio):
+        return round(values[min(len(values) - 1, int(len(values) * ratio))] * 1000, 2)
+
+    return {
+        "count": len(values),
+        "mean_ms": round(sum(values) / len(values) * 1000, 2),
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "max_ms": round(values[-1] * 1000, 2)
+    }
+
+
+def simulate_user(base_url: str, turns: int, latencies: dict, errors: list, lock):
+    """1ユーザー分の操作を実行"""
+    http = requests.Session()
+    rng = random.Random()
+
+    def call(name, path, payload):
+        started = time.perf_counter()
+        response = http.post(base_url + path, json=payload, timeout=120)
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.setdefault(name, []).append(elapsed)
+            if response.status_code != 200:
+                errors.append(f"{name}: {response.status_code}")
+        return response.json() if response.status_code == 200 else None
+
+    user = call('user/create', '/api/user/create',
+                {'name': 'ベンチ', 'gender': rng.choice(['男性', '女性'])})
+    if not user:
+        return
+    session = call('session/create', '/api/session/create', {'user_id': user['user_id']})
+    if not session:
+        return
+    session_id = session['session']['session_id']
+    for _ in range(turns):
+        call('chat', '/api/chat', {'session_id': session_id, 'message': rng.choice(MESSAGES)})
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=BACKEND_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(current: dict, baseline: dict):
+    """前回の結果との差分を表示"""
+    print(f"\nbaseline: {baseline.get('revision')}  current: {current.get('revision')}")
+    for name in SUMMARY_ENDPOINTS:
+        old = baseline['endpoints'].get(name, {})
+        new = current['endpoints'].get(name, {})
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            if key in old and key in new and old[key]:
+                change = (new[key] - old[key]) / old[key] * 100
+                print(f"  {name:15s} {key}: {old[key]:9.2f} -> {new[key]:9.2f} ({change:+.1f}%)")
+    for key in ("requests_per_sec", "disk_read_bytes_per_turn",
+                "disk_write_bytes_per_turn", "files_opened_per_turn"):
+        old, new = baseline.get(key), current.get(key)
+        if old is not None and new is not None:
+            print(f"  {key}: {old} -> {new}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=50, help='仮想ユーザー数')
+    parser.add_argument('--concurrency', type=int, default=16, help='同時に動くユーザー数')
+    parser.add_argument('--turns', type=int, default=10, help='1ユーザーあたりのチャット回数')
+    parser.add_argument('--llm-delay', type=float, default=0.05, help='疑似LLMの応答遅延（秒）')
+    parser.add_argument('-o', '--output', help='結果を保存するJSONファイル')
+    parser.add_argument('--compare', help='比較する前回の結果（JSON）')
+    parser.add_argument('--verbose', action='store_true', help='サーバーのログを表示')
+    parser.add_argument('--keep-data', action='store_true', help='一時データディレクトリを残す')
+    args = parser.parse_args()
+
+    fake_llm = start_fake_llm(args.llm_delay)
+    data_dir = tempfile.mkdtemp(prefix='interview-load-')
+    os.environ['LM_STUDIO_URL'] = f"http://127.0.0.1:{fake_llm.server_port}/v1/chat/completions"
+    os.environ['INTERVIEW_DATA_DIR'] = data_dir
+    os.environ.setdefault('INTERVIEW_LOG_LEVEL', 'DEBUG' if args.verbose else 'WARNING')
+    # 疑似ユーザーは待たずに送り続けるので、ユーザーごとのレート制限は外す
+    os.environ.setdefault('INTERVIEW_CHAT_RATE_PER_MINUTE', '0')
+
+    # 環境変数を設定してからアプリを読み込む
+    sys.path.insert(0, BACKEND_DIR)
+    from werkzeug.serving import make_server
+    import app as app_module
+
+    server = make_server('127.0.0.1', 0, app_module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    latencies, errors, lock = {}, [], threading.Lock()
+    opens = OpenCounter(data_dir)
+    log_target = sys.stdout if args.verbose else open(os.devnull, 'w')
+
+    io_before = read_proc_io()
+    opens.enabled = True
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(log_target):
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            futures = [executor.submit(simulate_user, base_url, args.turns, latencies, errors, lock)
+                       for _ in range(args.users)]
+            for future in futures:
+                future.result()
+    elapsed = time.perf_counter() - started
+    opens.enabled = False
+    io_after = read_proc_io()
+    server.shutdown()
+    # 一時ディレクトリを消す前に集計の未反映分を書き出す
+    app_module.analytics.flush()
+
+    total_requests = sum(len(v) for v in latencies.values())
+    chat_turns = len(latencies.get('chat', [])) or 1
+
+    def per_turn(key):
+        if key not in io_after:
+            return None
+        return round((io_after[key] - io_before[key]) / chat_turns)
+
+    result = {
+        "revision": git_revision(),
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "python": platform.python_version(),
+        "params": vars(args),
+        "duration_sec": round(elapsed, 2),
+        "requests": total_requests,
+        "errors": len(errors),
+        "requests_per_sec": round(total_requests / elapsed, 1),
+        "chat_turns_per_sec": round(len(latencies.get('chat', [])) / elapsed, 1),
+        "endpoints": {name: percentiles(latencies.get(name, [])) for name in SUMMARY_ENDPOINTS},
+        "disk_read_bytes_per_turn": per_turn('read_bytes'),
+        "disk_write_bytes_per_turn": per_turn('write_bytes'),
+        "syscall_read_chars_per_turn": per_turn('rchar'),
+        "syscall_write_chars_per_turn": per_turn('wchar'),
+        "files_opened_per_turn": round(opens.count / chat_turns, 1)
+    }
+    if args.keep_data:
+        result["data_dir"] = data_dir
+    else:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if errors:
+        print(f"errors (first 5): {errors[:5]}", file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(result, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+"""
+ProfileManager / GamificationManager のマイクロベンチマーク
+
+合成データを一時ディレクトリに生成し、操作ごとの所要時間とメモリ確保量が
+データ量に対してどう変化するかを計測する。
+- 会話の長さ（10 → 10,000 メッセージ）: add_message, get_session, get_conversation, get_messages
+- ユーザーあたりのセッション数（1 → 500）: get_category_data_count, add_extracted_data
+- メッセージの長さ（10 → 10,000 文字）: analyze_message_for_data
+- メッセージの表現（辞書 / models.Message）: 1件あたりの保持メモリ、メッセージログとの
+  デシリアライズ・シリアライズ時間（辞書は以前の形式・1行ずつの解析、Message は配列形式・
+  範囲をまとめて解析）
+
+使い方:
+    python benchmarks/micro_benchmarks.py
+    python benchmarks/micro_benchmarks.py --quick -o micro.json
+時間は repeat 回の中央値、メモリは tracemalloc で計測した1回あたりのピーク確保量。
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from profile_manager import ProfileManager  # noqa: E402
+from gamification import GamificationManager  # noqa: E402
+from models import Message  # noqa: E402
+
+CONVERSATION_LENGTHS = (10, 100, 1000, 10000)
+SESSION_COUNTS = (1, 10, 100, 500)
+MESSAGE_LENGTHS = (10, 100, 1000, 10000)
+QUICK_CONVERSATION_LENGTHS = (10, 100, 1000)
+QUICK_SESSION_COUNTS = (1, 10, 100)
+
+SAMPLE_TEXT = "昨日は友達とカフェに行って、転職のことや将来の夢について話しました。楽しかったです。"
+
+
+def measure(func, repeat: int) -> dict:
+    """所要時間（中央値）と1回あたりのピークメモリ確保量"""
+    func()  # キャッシュなどを温める
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "median_us": round(statistics.median(timings) * 1e6, 1),
+        "peak_alloc_kb": round((peak - before) / 1024, 1)
+    }
+
+
+def retained_bytes(build) -> int:
+    """build() が返したオブジェクトが保持しているメモリ量"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del result
+    return retained
+
+
+def compare_message_models(count: int, repeat: int) -> list:
+    """会話 count 件を辞書で持つ場合と models.Message で持つ場合の比較"""
+    models = [
+        Message("user" if i % 2 == 0 else "assistant", f"{SAMPLE_TEXT}（{i}）",
+                expression=None if i % 2 == 0 else "smile")
+        for i in range(count)
+    ]
+    dicts = [model.to_dict() for model in models]
+    dict_lines = [json.dumps(record, ensure_ascii=False).encode('utf-8') for record in dicts]
+    row_lines = [json.dumps(model.to_row(), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+                 for model in models]
+
+    results = []
+    for name, decode, encode in (
+        ("dict", lambda: [json.loads(line) for line in dict_lines],
+         lambda: [json.dumps(record, ensure_ascii=False) for record in dicts]),
+        ("Message", lambda: [Message.from_record(record)
+                             for record in json.loads(b'[' + b','.join(row_lines) + b']')],
+         lambda: [json.dumps(model.to_row(), ensure_ascii=False, separators=(',', ':'))
+                  for model in models]),
+    ):
+        results.append({
+            "operation": f"messages as {name}",
+            "dimension": "messages",
+            "size": count,
+            "bytes_per_message": round(retained_bytes(decode) / count, 1),
+            "decode_us_per_message": round(measure(decode, repeat)["median_us"] / count, 3),
+            "encode_us_per_message": round(measure(encode, repeat)["median_us"] / count, 3)
+        })
+    return results
+
+
+def build_conversation(manager: ProfileManager, length: int) -> str:
+    """length 件のメッセージを持つセッションを作る"""
+    user = manager.create_user("ベンチ", "女性", "misaki")
+    session = manager.create_session(user["user_id"])
+    for i in range(length):
+        role = "user" if i % 2 == 0 else "assistant"
+        manager.add_message(session["session_id"], role, f"{SAMPLE_TEXT}（{i}）")
+    return session["session_id"]
+
+
+def build_sessions(manager: ProfileManager, count: int) -> tuple:
+    """count 件のセッション（各5件の抽出データ）を持つユーザーを作る"""
+    user = manager.create_user("ベンチ", "男性", "kenta")
+    session_id = None
+    for i in range(count):
+        session_id = manager.create_session(user["user_id"])["session_id"]
+        for j in range(5):
+            manager.add_extracted_data(session_id, "趣味・興味・娯楽", "趣味", f"趣味{i}-{j}")
+    return user["user_id"], session_id
+
+
+def run(args) -> list:
+    manager = ProfileManager(args.data_dir)
+    gamification = GamificationManager()
+    results = []
+
+    def record(operation, dimension, size, stats):
+        results.append({"operation": operation, "dimension": dimension, "size": size, **stats})
+        print(f"{operation:28s} {dimension:9s}={size:>6}  "
+              f"{stats['median_us']:>11.1f} us  {stats['peak_alloc_kb']:>9.1f} KiB")
+
+    lengths = QUICK_CONVERSATION_LENGTHS if args.quick else CONVERSATION_LENGTHS
+    for length in lengths:
+        session_id = build_conversation(manager, length)
+        record("add_message", "messages", length, measure(
+            lambda: manager.add_message(session_id, "user", SAMPLE_TEXT), args.repeat))
+        record("get_session", "messages", length, measure(
+            lambda: manager.get_session(session_id), args.repeat))
+        record("get_conversation", "messages", length, measure(
+            lambda: manager.get_conversation(session_id), args.repeat))
+        record("get_messages(limit=50)", "messages", length, measure(
+            lambda: manager.get_messages(session_id, limit=50), args.repeat))
+
+    counts = QUICK_SESSION_COUNTS if args.quick else SESSION_COUNTS
+    for count in counts:
+        user_id, session_id = build_sessions(manager, count)
+        record("get_category_data_count", "sessions", count, measure(
+            lambda: manager.get_category_data_count(user_id), args.repeat))
+        record("add_extracted_data", "sessions", count, measure(
+            lambda: manager.add_extracted_data(session_id, "学習・成長", "資格", "簿記"),
+            args.repeat))
+
+    for length in MESSAGE_LENGTHS:
+        message = (SAMPLE_TEXT * (length // len(SAMPLE_TEXT) + 1))[:length]
+        record("analyze_message_for_data", "chars", length, measure(
+            lambda: gamification.analyze_message_for_data(message), args.repeat))
+
+    for entry in compare_message_models(1000 if args.quick else 10000, max(3, args.repeat // 4)):
+        results.append(entry)
+        print(f"{entry['operation']:28s} {'messages':9s}={entry['size']:>6}  "
+              f"{entry['bytes_per_message']:>8.1f} B/msg  "
+              f"decode {entry['decode_us_per_message']:.2f} us  "
+              f"encode {entry['encode_us_per_message']:.2f} us")
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=20, help='計測の繰り返し回数')
+    parser.add_argument('--quick', action='store_true', help='大きいサイズを省略する')
+    parser.add_argument('-o', '--output', help='結果を保存するJSONファイル')
+    parser.add_argument('--data-dir', help='データディレクトリ（省略時は一時ディレクトリ）')
+    args = parser.parse_args()
+
+    temporary = args.data_dir is None
+    if temporary:
+        args.data_dir = tempfile.mkdtemp(prefix='interview-micro-')
+    try:
+        results = run(args)
+    finally:
+        if temporary:
+            shutil.rmtree(args.data_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+マルチプロセス書き込みのストレステスト
+
+複数のワーカープロセスが同じセッション群に並行して add_message /
+add_extracted_data / add_badge を行い、最後に件数を検証して
+更新の取りこぼし（lost update）がないことを確認する。
+
+使い方:
+    python benchmarks/stress_concurrent_writes.py --workers 8 --messages 200
+終了コード: 取りこぼしがなければ0、あれば1
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from multiprocessing import Pool
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from profile_manager import ProfileManager  # noqa: E402
+
+
+def _worker(args):
+    """1ワーカー分の書き込みを実行"""
+    data_dir, worker_id, session_ids, user_id, count = args
+    manager = ProfileManager(data_dir)
+    for i in range(count):
+        session_id = session_ids[i % len(session_ids)]
+        manager.add_message(session_id, 'user', f"worker{worker_id}-msg{i}")
+        if i % 10 == 0:
+            # データ数は事実（カテゴリー・項目ごとに1件）の数なので、項目名を毎回変える
+            manager.add_extracted_data(session_id, "趣味・興味・娯楽", f"趣味{worker_id}-{i}", "読書")
+    manager.add_badge(user_id, f"badge-{worker_id}")
+    return worker_id
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, default=8, help='ワーカープロセス数')
+    parser.add_argument('--messages', type=int, default=200, help='ワーカーごとのメッセージ数')
+    parser.add_argument('--sessions', type=int, default=2, help='共有するセッション数')
+    parser.add_argument('--data-dir', help='データディレクトリ（省略時は一時ディレクトリ）')
+    args = parser.parse_args()
+
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='interview-stress-')
+    manager = ProfileManager(data_dir)
+    profile = manager.create_user("stress", "その他", "aoi")
+    user_id = profile['user_id']
+    session_ids = [manager.create_session(user_id)['session_id'] for _ in range(args.sessions)]
+
+    started = time.perf_counter()
+    jobs = [(data_dir, w, session_ids, user_id, args.messages) for w in range(args.workers)]
+    with Pool(args.workers) as pool:
+        pool.map(_worker, jobs)
+    elapsed = time.perf_counter() - started
+
+    # 検証
+    expected_messages = args.workers * args.messages
+    expected_data = args.workers * len(range(0, args.messages, 10))
+    actual_messages = sum(len(manager.get_session(s)['conversation']) for s in session_ids)
+    actual_data = manager.get_total_data_count(user_id)
+    profile = manager.get_user(user_id)
+    actual_badges = len(profile['badges'])
+
+    print(f"data dir : {data_dir}")
+    print(f"elapsed  : {elapsed:.2f}s ({expected_messages / elapsed:.0f} messages/s)")
+    print(f"messages : {actual_messages}/{expected_messages}")
+    print(f"data     : {actual_data}/{expected_data} (profile total: {profile['total_data_count']})")
+    print(f"badges   : {actual_badges}/{args.workers}")
+
+    ok = (actual_messages == expected_messages and
+          actual_data == expected_data and
+          profile['total_data_count'] == expected_data and
+          actual_badges == args.workers)
+    print("OK: no lost updates" if ok else "FAILED: lost updates detected")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
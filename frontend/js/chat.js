@@ -150,14 +150,46 @@ function setupVoiceButton() {
     }
 }
 
+/**
+ * 再送を識別するキー（メッセージごとに1つ）
+ */
+function createIdempotencyKey() {
+    if (window.crypto && typeof crypto.randomUUID === 'function') {
+        return crypto.randomUUID();
+    }
+    return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+}
+
+/**
+ * チャットAPIに送信（通信エラーは同じキーで1回だけ再送。サーバーは処理済みの結果を返す）
+ */
+async function postChat(body, idempotencyKey) {
+    const request = () => fetch(`${API_BASE_URL}/chat`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'Idempotency-Key': idempotencyKey
+        },
+        body: JSON.stringify(body)
+    });
+    try {
+        return await request();
+    } catch (error) {
+        console.warn('Chat request failed, retrying:', error);
+        return await request();
+    }
+}
+
 /**
  * メッセージ送信
  */
 async function sendMessage() {
     const messageInput = document.getElementById('messageInput');
     const message = messageInput.value.trim();
+    const sendButton = document.getElementById('sendButton');
 
-    if (!message) return;
+    // 応答待ちの間は送らない（音声認識の自動送信などによる二重送信を防ぐ）
+    if (!message || sendButton.disabled) return;
 
     // ユーザーメッセージを表示
     displayMessage('user', message);
@@ -166,23 +198,26 @@ async function sendMessage() {
     messageInput.value = '';
 
     // ボタンを無効化（レスポンス待ち）
-    const sendButton = document.getElementById('sendButton');
     sendButton.disabled = true;
     messageInput.disabled = true;
 
     try {
         // チャットAPIにリクエスト
-        const response = await fetch(`${API_BASE_URL}/chat`, {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({
-                session_id: currentSessionId,
-                message: message
-            })
-        });
+        const response = await postChat({
+            session_id: currentSessionId,
+            message: message,
+            // 変化したフィールドだけを受け取る
+            delta: true,
+            profile_version: currentProfile.version
+        }, createIdempotencyKey());
 
         const data = await response.json();
 
+        if (response.status === 429) {
+            alert(`送信が多すぎます。${Math.ceil(data.retry_after || 1)}秒ほど待ってから送信してください`);
+            return;
+        }
+
         if (!data.success) {
             alert('メッセージ送信に失敗しました');
             return;
@@ -208,13 +243,18 @@ async function sendMessage() {
             }
         }
 
+        // プロファイル更新（差分のみの場合はマージ）
+        if (data.profile) {
+            currentProfile = data.profile;
+        } else {
+            currentProfile = Object.assign({}, currentProfile, data.profile_delta);
+        }
+
         // ステージ変化
         if (data.stage_changed) {
-            updateHumanFormation(data.new_stage, data.profile.total_data_count);
+            updateHumanFormation(data.new_stage, currentProfile.total_data_count);
         }
 
-        // プロファイル更新
-        currentProfile = data.profile;
         updateStatusDisplay(currentProfile);
 
         // メッセージカウントを増やす